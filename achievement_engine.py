@@ -0,0 +1,195 @@
+import logging
+import sqlite3
+from collections import namedtuple
+from typing import Callable, Iterable, Optional
+
+from database_manager import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+# Event types raised from progress logging
+PROGRESS_LOGGED = 'progress_logged'
+WORKOUT_COMPLETED = 'workout_completed'
+WEIGHT_LOGGED = 'weight_logged'
+
+# A rule is awarded once `metric` reaches `threshold`. `bit` is its position in
+# achievement_state.awarded_mask and must never be reused for another rule.
+AchievementRule = namedtuple('AchievementRule',
+                             'bit achievement_type title description events metric threshold')
+
+RULES = [
+    AchievementRule(0, 'first_workout', 'First Steps', 'Completed your first workout!',
+                    (WORKOUT_COMPLETED,), 'total_workouts', 1),
+    AchievementRule(1, 'consistent_10', 'Getting Strong', 'Completed 10 workouts!',
+                    (WORKOUT_COMPLETED,), 'total_workouts', 10),
+    AchievementRule(2, 'consistent_50', 'Fitness Warrior', 'Completed 50 workouts!',
+                    (WORKOUT_COMPLETED,), 'total_workouts', 50),
+    AchievementRule(3, 'weight_loss_5kg', 'Transformation', 'Lost 5kg or more!',
+                    (WEIGHT_LOGGED,), 'weight_lost', 5),
+    AchievementRule(4, 'month_commitment', 'Committed', 'One month of fitness journey!',
+                    (PROGRESS_LOGGED,), 'days_registered', 30),
+    AchievementRule(5, 'streak_7', 'On Fire', 'Worked out 7 days in a row!',
+                    (WORKOUT_COMPLETED,), 'current_streak', 7),
+    AchievementRule(6, 'streak_30', 'Unstoppable', 'Worked out 30 days in a row!',
+                    (WORKOUT_COMPLETED,), 'current_streak', 30),
+]
+
+
+def index_rules(rules):
+    """Map each event type to the rules it can affect"""
+    by_event = {}
+    for rule in rules:
+        for event in rule.events:
+            by_event.setdefault(event, []).append(rule)
+    return by_event
+
+
+class AchievementEngine:
+    """Awards achievements incrementally from progress events.
+
+    Each user has one achievement_state row holding running counters and a
+    bitmask of awarded achievements. An event updates the counters and checks
+    only the not-yet-awarded rules registered for that event type.
+    """
+
+    def __init__(self, db: DatabaseManager, notify: Optional[Callable[[int, str, str], object]] = None,
+                 rules=None):
+        self.db = db
+        self.notify = notify
+        self.rules = rules if rules is not None else RULES
+        self.rules_by_event = index_rules(self.rules)
+        self.rules_by_type = {rule.achievement_type: rule for rule in self.rules}
+
+    def handle_progress(self, event: dict):
+        """Progress listener for DatabaseManager.log_progress"""
+        events = [PROGRESS_LOGGED]
+        if event.get('workout_completed'):
+            events.append(WORKOUT_COMPLETED)
+        if event.get('weight') is not None:
+            events.append(WEIGHT_LOGGED)
+        self.process(event['user_id'], events, workouts=1 if event.get('workout_completed') else 0,
+                     weight=event.get('weight'), current_streak=event.get('current_streak'))
+
+    def evaluate(self, user_id):
+        """Check every rule for a user without recording a new event"""
+        return self.process(user_id, None)
+
+    def process(self, user_id, events: Optional[Iterable[str]], workouts: int = 0, weight=None,
+                current_streak: Optional[int] = None):
+        """Apply an event's counter deltas and award any rules it satisfies.
+
+        `events=None` evaluates all rules. Returns the newly awarded rules.
+        """
+        conn = self.db.get_connection(user_id)
+        conn.isolation_level = None
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        awarded = []
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('SELECT * FROM achievement_state WHERE user_id = ?', (user_id,))
+            state = cursor.fetchone()
+            if state is None:
+                # First event for this user: seed counters from history once.
+                # The progress row behind this event is already included.
+                state = self._seed_state(cursor, user_id)
+            elif workouts or weight is not None:
+                cursor.execute('''
+                    UPDATE achievement_state
+                    SET total_workouts = total_workouts + ?,
+                        first_weight = COALESCE(first_weight, ?),
+                        last_weight = COALESCE(?, last_weight)
+                    WHERE user_id = ?
+                ''', (workouts, weight, weight, user_id))
+                cursor.execute('SELECT * FROM achievement_state WHERE user_id = ?', (user_id,))
+                state = cursor.fetchone()
+
+            mask = state['awarded_mask']
+            if events is None:
+                candidates = self.rules
+            else:
+                candidates = [rule for event in events for rule in self.rules_by_event.get(event, ())]
+            candidates = [rule for rule in candidates if not mask & (1 << rule.bit)]
+
+            if candidates:
+                metrics = self._metrics(cursor, state, current_streak)
+                for rule in candidates:
+                    value = metrics.get(rule.metric)
+                    if value is not None and value >= rule.threshold and not mask & (1 << rule.bit):
+                        mask |= 1 << rule.bit
+                        awarded.append(rule)
+                        cursor.execute('''
+                            INSERT INTO achievements (user_id, achievement_type, title, description)
+                            VALUES (?, ?, ?, ?)
+                        ''', (user_id, rule.achievement_type, rule.title, rule.description))
+
+                if awarded:
+                    cursor.execute('UPDATE achievement_state SET awarded_mask = ? WHERE user_id = ?',
+                                   (mask, user_id))
+            cursor.execute('COMMIT')
+        except Exception:
+            if conn.in_transaction:
+                cursor.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+        for rule in awarded:
+            logger.info(f"Achievement '{rule.title}' added for user {user_id}")
+            if self.notify:
+                self.notify(user_id, rule.title, rule.description)
+        return awarded
+
+    def _metrics(self, cursor, state, current_streak=None):
+        metrics = {'total_workouts': state['total_workouts']}
+        if current_streak is None:
+            cursor.execute('''
+                SELECT CASE WHEN last_workout_date >= date('now', '-1 day') THEN current_streak ELSE 0 END
+                FROM users WHERE user_id = ?
+            ''', (state['user_id'],))
+            row = cursor.fetchone()
+            current_streak = row[0] if row else None
+        metrics['current_streak'] = current_streak
+        if state['first_weight'] is not None and state['last_weight'] is not None:
+            metrics['weight_lost'] = state['first_weight'] - state['last_weight']
+        if state['registered_at']:
+            cursor.execute("SELECT julianday('now') - julianday(?)", (state['registered_at'],))
+            metrics['days_registered'] = cursor.fetchone()[0]
+        return metrics
+
+    def _seed_state(self, cursor, user_id):
+        """Build a user's state row from their full history (runs once per user)"""
+        cursor.execute('''
+            SELECT COUNT(*) FROM progress WHERE user_id = ? AND workout_completed = 1
+        ''', (user_id,))
+        total_workouts = cursor.fetchone()[0]
+
+        cursor.execute('''
+            SELECT weight FROM progress WHERE user_id = ? AND weight IS NOT NULL
+            ORDER BY date ASC, id ASC LIMIT 1
+        ''', (user_id,))
+        first = cursor.fetchone()
+        cursor.execute('''
+            SELECT weight FROM progress WHERE user_id = ? AND weight IS NOT NULL
+            ORDER BY date DESC, id DESC LIMIT 1
+        ''', (user_id,))
+        last = cursor.fetchone()
+
+        cursor.execute('SELECT created_at FROM users WHERE user_id = ?', (user_id,))
+        registered = cursor.fetchone()
+
+        cursor.execute('SELECT DISTINCT achievement_type FROM achievements WHERE user_id = ?', (user_id,))
+        mask = 0
+        for (achievement_type,) in cursor.fetchall():
+            rule = self.rules_by_type.get(achievement_type)
+            if rule:
+                mask |= 1 << rule.bit
+
+        cursor.execute('''
+            INSERT INTO achievement_state
+            (user_id, awarded_mask, total_workouts, first_weight, last_weight, registered_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (user_id, mask, total_workouts, first[0] if first else None,
+              last[0] if last else None, registered[0] if registered else None))
+        cursor.execute('SELECT * FROM achievement_state WHERE user_id = ?', (user_id,))
+        return cursor.fetchone()
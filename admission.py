@@ -0,0 +1,184 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+BUSY_MESSAGE = "🚦 Our AI coach is very busy right now. Please try again in a few minutes."
+
+
+class AdmissionRejected(Exception):
+    """Work refused by the admission controller; `reason` is rate_limited, queue_full or timeout"""
+
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+class AdmissionController:
+    """Admission control for AI generations.
+
+    At most max_concurrent generations run at once. Further callers wait in
+    FIFO order, up to max_waiting of them for at most wait_timeout seconds;
+    past that, work is shed straight away rather than left to time out. A
+    caller inside notify_queued() is told its position when it has to wait.
+
+    Queued background generations (plan jobs) are bounded the same way:
+    admit_job() refuses new ones once max_queued_jobs are waiting.
+
+    Separately, each user has a token bucket of user_burst generations,
+    refilled at one every user_interval seconds (check_user).
+    """
+
+    def __init__(self, max_concurrent: int = None, max_waiting: int = None, wait_timeout: float = None,
+                 max_queued_jobs: int = None, user_burst: float = None, user_interval: float = None,
+                 max_tracked_users: int = 10000):
+        self.max_concurrent = max(1, int(max_concurrent if max_concurrent is not None
+                                         else os.getenv('AI_MAX_CONCURRENT', '4')))
+        self.max_waiting = int(max_waiting if max_waiting is not None else os.getenv('AI_MAX_WAITING', '20'))
+        self.wait_timeout = float(wait_timeout if wait_timeout is not None else os.getenv('AI_WAIT_TIMEOUT', '30'))
+        self.max_queued_jobs = int(max_queued_jobs if max_queued_jobs is not None
+                                   else os.getenv('AI_MAX_QUEUED_JOBS', '50'))
+        self.user_burst = float(user_burst if user_burst is not None else os.getenv('AI_USER_BURST', '3'))
+        self.user_interval = float(user_interval if user_interval is not None
+                                   else os.getenv('AI_USER_INTERVAL', '120'))
+        self.max_tracked_users = max_tracked_users
+        self._lock = threading.Lock()
+        self._slot_freed = threading.Condition(self._lock)
+        self._in_flight = 0
+        self._waiters = deque()
+        self._buckets = {}
+        self._waits = deque(maxlen=500)
+        self._local = threading.local()
+        self.stats = {'admitted': 0, 'queued': 0, 'shed_queue_full': 0, 'shed_timeout': 0, 'shed_backlog': 0,
+                      'rate_limited': 0}
+
+    def check_user(self, user_id) -> bool:
+        """Take one of the user's tokens; False (and counted) when the user is over their rate"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(user_id, (self.user_burst, now))
+            tokens = min(self.user_burst, tokens + (now - updated) / self.user_interval)
+            if tokens < 1:
+                self._buckets[user_id] = (tokens, now)
+                self.stats['rate_limited'] += 1
+                return False
+            self._buckets[user_id] = (tokens - 1, now)
+            if len(self._buckets) > self.max_tracked_users:
+                self._forget_full_buckets(now)
+            return True
+
+    def retry_after(self, user_id) -> float:
+        """Seconds until the user has a token again"""
+        with self._lock:
+            tokens, updated = self._buckets.get(user_id, (self.user_burst, time.monotonic()))
+        tokens += (time.monotonic() - updated) / self.user_interval
+        return max(0.0, (1 - tokens) * self.user_interval)
+
+    def _forget_full_buckets(self, now):
+        # A bucket that has refilled is the same as no bucket
+        for user_id, (tokens, updated) in list(self._buckets.items()):
+            if tokens + (now - updated) / self.user_interval >= self.user_burst:
+                del self._buckets[user_id]
+
+    def admit_job(self, queued_jobs: int) -> bool:
+        """Whether another background generation may be queued behind queued_jobs others"""
+        if queued_jobs < self.max_queued_jobs:
+            return True
+        with self._lock:
+            self.stats['shed_backlog'] += 1
+        return False
+
+    @contextmanager
+    def notify_queued(self, callback: Callable[[int], None]):
+        """Call callback(position) if a generation in this block has to wait for a slot"""
+        previous = getattr(self._local, 'on_queued', None)
+        self._local.on_queued = callback
+        try:
+            yield
+        finally:
+            self._local.on_queued = previous
+
+    @contextmanager
+    def slot(self):
+        """Hold one of the max_concurrent generation slots; raises AdmissionRejected when shed"""
+        wait_started = time.monotonic()
+        with self._lock:
+            if self._in_flight < self.max_concurrent and not self._waiters:
+                self._in_flight += 1
+                position = 0
+            elif len(self._waiters) >= self.max_waiting:
+                self.stats['shed_queue_full'] += 1
+                raise AdmissionRejected('queue_full', f"{len(self._waiters)} generations already waiting")
+            else:
+                ticket = object()
+                self._waiters.append(ticket)
+                self.stats['queued'] += 1
+                position = len(self._waiters)
+
+        if position:
+            on_queued = getattr(self._local, 'on_queued', None)
+            if on_queued:
+                try:
+                    on_queued(position)
+                except Exception as e:
+                    logger.error(f"Queue position callback failed: {e}")
+            with self._lock:
+                admitted = self._slot_freed.wait_for(
+                    lambda: self._waiters[0] is ticket and self._in_flight < self.max_concurrent,
+                    self.wait_timeout)
+                self._waiters.remove(ticket)
+                if admitted:
+                    self._in_flight += 1
+                else:
+                    self.stats['shed_timeout'] += 1
+                # The next waiter may now be at the front
+                self._slot_freed.notify_all()
+            if not admitted:
+                raise AdmissionRejected('timeout', f"no generation slot within {self.wait_timeout:.0f}s")
+
+        with self._lock:
+            self.stats['admitted'] += 1
+            self._waits.append(time.monotonic() - wait_started)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def try_acquire(self) -> bool:
+        """Take a slot only if one is free right now and nobody is waiting; give it back with release()"""
+        with self._lock:
+            if self._in_flight < self.max_concurrent and not self._waiters:
+                self._in_flight += 1
+                return True
+            return False
+
+    def release(self):
+        """Give back a slot taken by try_acquire() (slot() releases its own)"""
+        with self._lock:
+            self._in_flight -= 1
+            self._slot_freed.notify_all()
+
+    def get_metrics(self) -> dict:
+        """Slots in use, queue length, wait times (ms) and shed counts"""
+        with self._lock:
+            waits = sorted(self._waits)
+            metrics = dict(self.stats, in_flight=self._in_flight, waiting=len(self._waiters),
+                           max_concurrent=self.max_concurrent, max_waiting=self.max_waiting,
+                           max_queued_jobs=self.max_queued_jobs,
+                           tracked_users=len(self._buckets))
+        metrics['wait_ms_p50'] = round(waits[len(waits) // 2] * 1000, 1) if waits else 0.0
+        metrics['wait_ms_p95'] = round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 1) if waits else 0.0
+        metrics['wait_ms_max'] = round(waits[-1] * 1000, 1) if waits else 0.0
+        return metrics
+
+
+def rate_limited_message(retry_after: float) -> str:
+    """What to tell a user who is over their generation rate"""
+    minutes = max(1, round(retry_after / 60))
+    return (f"⏳ You've asked for a lot in a short time. Please try again in about "
+            f"{minutes} minute{'s' if minutes != 1 else ''}.")
@@ -1,16 +1,95 @@
 import requests
 import json
 import logging
-from typing import Dict, Any, Optional
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout, wait, FIRST_COMPLETED
+from typing import Dict, Any, Optional, Callable
 import os
+from admission import AdmissionController, AdmissionRejected, BUSY_MESSAGE
+from cassette import Cassette, CassetteMiss
+from circuit_breaker import CircuitBreaker
+import fallbacks
+import nutrition
+import tracing
 
 logger = logging.getLogger(__name__)
 
 
-class AIService:
+class AIServiceError(Exception):
+    """Raised in strict mode when a completion could not be obtained"""
+
+
+class LatencyTracker:
+    """Rolling window of recent completion latencies (seconds)"""
+
+    def __init__(self, window: int = 200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        """Return the pct-th percentile of the window, or None when empty"""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, max(0, int(round(pct / 100 * len(samples))) - 1))
+        return samples[index]
+
+
+class UsageTracker:
+    """Completion count, tokens and latency per request tag ('workout_plan', 'diet_plan_adjust'...)"""
+
     def __init__(self):
+        self._totals = {}
+        self._lock = threading.Lock()
+
+    def record(self, tag: str, seconds: float, usage: Optional[dict]):
+        usage = usage or {}
+        with self._lock:
+            totals = self._totals.setdefault(tag, {'requests': 0, 'prompt_tokens': 0, 'completion_tokens': 0,
+                                                   'seconds': 0.0})
+            totals['requests'] += 1
+            totals['prompt_tokens'] += usage.get('prompt_tokens') or 0
+            totals['completion_tokens'] += usage.get('completion_tokens') or 0
+            totals['seconds'] += seconds
+
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+        """Totals per tag plus per-request averages"""
+        with self._lock:
+            totals = {tag: dict(values) for tag, values in self._totals.items()}
+        for values in totals.values():
+            count = values['requests']
+            values['avg_prompt_tokens'] = round(values['prompt_tokens'] / count, 1)
+            values['avg_completion_tokens'] = round(values['completion_tokens'] / count, 1)
+            values['avg_seconds'] = round(values['seconds'] / count, 3)
+        return totals
+
+
+# Reply from plan adjustment when the plan needs no edits
+NO_PLAN_CHANGES = 'NO CHANGES'
+
+
+class AIService:
+    def __init__(self, db=None):
+        # DatabaseManager holding users' saved plans, used as a fallback (optional)
+        self.db = db
+
+        # Optional record/replay of completions (AI_CASSETTE_MODE, see cassette.py)
+        cassette = Cassette()
+        self.cassette = cassette if cassette.enabled else None
+
         self.api_key = os.getenv('OPENROUTER_API_KEY')
-        if not self.api_key:
+        # Replaying with on_miss 'error' never reaches the API
+        if not self.api_key and (not self.cassette or self.cassette.needs_network):
             logger.critical("OPENROUTER_API_KEY environment variable not set!")
             raise ValueError("OPENROUTER_API_KEY environment variable not set!")
         self.base_url = "https://openrouter.ai/api/v1/chat/completions"
@@ -21,9 +100,185 @@ class AIService:
             "X-Title": "Telegram Fitness Bot"
         }
 
+        # Opt-in request hedging: if the first request has not answered by the
+        # configured latency percentile, a second one goes to AI_HEDGE_MODEL.
+        self.hedging_enabled = os.getenv('AI_HEDGE_ENABLED', 'false').lower() == 'true'
+        self.hedge_model = os.getenv('AI_HEDGE_MODEL')  # defaults to the primary model
+        self.hedge_percentile = float(os.getenv('AI_HEDGE_PERCENTILE', '95'))
+        self.hedge_min_delay = float(os.getenv('AI_HEDGE_MIN_DELAY', '2.0'))
+        self.hedge_default_delay = float(os.getenv('AI_HEDGE_DEFAULT_DELAY', '10.0'))
+        self.hedge_min_samples = int(os.getenv('AI_HEDGE_MIN_SAMPLES', '20'))
+        # Fraction of requests that may fire a hedge; unused budget accrues up to a small burst
+        self.hedge_budget = float(os.getenv('AI_HEDGE_BUDGET', '0.1'))
+        self.hedge_burst = float(os.getenv('AI_HEDGE_BURST', '5'))
+        self._hedge_tokens = self.hedge_burst
+        self._hedge_lock = threading.Lock()
+        self._hedge_executor = None
+        self.latency = LatencyTracker()
+        self.usage = UsageTracker()
+        self.hedge_stats = {
+            'requests': 0,
+            'hedges_fired': 0,
+            'hedges_won': 0,
+            'hedges_skipped_budget': 0,
+            'hedges_skipped_no_slot': 0
+        }
+        if self.hedging_enabled:
+            self._hedge_executor = ThreadPoolExecutor(
+                max_workers=int(os.getenv('AI_HEDGE_MAX_WORKERS', '16')),
+                thread_name_prefix='ai-hedge'
+            )
+            logger.info(f"AI request hedging enabled (p{self.hedge_percentile:g}, budget {self.hedge_budget:.0%})")
+
+        # Circuit breaker: after AI_BREAKER_THRESHOLD consecutive failures calls are
+        # short-circuited to local fallbacks until a probe succeeds again.
+        self.breaker = CircuitBreaker(
+            'openrouter',
+            failure_threshold=int(os.getenv('AI_BREAKER_THRESHOLD', '5')),
+            reset_timeout=float(os.getenv('AI_BREAKER_RESET_TIMEOUT', '30'))
+        )
+        # Global concurrency limit and bounded wait queue for completions, plus
+        # per-user rate limits checked by the bot (AI_MAX_CONCURRENT and friends)
+        self.admission = AdmissionController()
+
+        # Last successful plan per (kind, user_id), served while the circuit is open;
+        # the user's saved plan in the database backs it up across restarts and workers
+        self._plan_cache = OrderedDict()
+        self._plan_cache_size = int(os.getenv('AI_PLAN_CACHE_SIZE', '256'))
+        self._plan_cache_lock = threading.Lock()
+
+    def _post_completion(self, data: dict, tag: str = 'other') -> str:
+        """Send one completion request and return the message content"""
+        started = time.monotonic()
+        if self.cassette:
+            entry = self.cassette.play(data)
+            if entry is not None:
+                elapsed = time.monotonic() - started
+                self.latency.record(elapsed)
+                self.usage.record(tag, elapsed, entry['usage'])
+                return entry['content']
+
+        response = requests.post(self.base_url, headers=self.headers,
+                                 json=data, timeout=30)
+        response.raise_for_status()
+
+        result = response.json()
+        content = result['choices'][0]['message']['content']
+        elapsed = time.monotonic() - started
+        self.latency.record(elapsed)
+        self.usage.record(tag, elapsed, result.get('usage'))
+        if self.cassette:
+            self.cassette.record(data, content, result.get('usage'), elapsed)
+        return content
+
+    def _hedge_delay(self) -> float:
+        """How long to wait on the first request before hedging"""
+        if len(self.latency) < self.hedge_min_samples:
+            return self.hedge_default_delay
+        return max(self.hedge_min_delay, self.latency.percentile(self.hedge_percentile))
+
+    def _take_hedge_token(self) -> bool:
+        with self._hedge_lock:
+            if self._hedge_tokens >= 1:
+                self._hedge_tokens -= 1
+                self.hedge_stats['hedges_fired'] += 1
+                return True
+            self.hedge_stats['hedges_skipped_budget'] += 1
+            return False
+
+    def _hedged_completion(self, data: dict, tag: str = 'other') -> str:
+        """Run a completion, hedging to the alternate model if it is slow.
+
+        The first successful answer wins; the other request is cancelled if it
+        has not started yet and otherwise left to finish and be ignored. The
+        hedge needs an admission slot of its own, held until both requests are
+        done, and is skipped when none is free.
+        """
+        with self._hedge_lock:
+            self.hedge_stats['requests'] += 1
+            self._hedge_tokens = min(self.hedge_burst, self._hedge_tokens + self.hedge_budget)
+
+        primary = self._hedge_executor.submit(self._post_completion, data, tag)
+        try:
+            return primary.result(timeout=self._hedge_delay())
+        except FutureTimeout:
+            pass
+
+        if not self.admission.try_acquire():
+            with self._hedge_lock:
+                self.hedge_stats['hedges_skipped_no_slot'] += 1
+            return primary.result()
+        if not self._take_hedge_token():
+            self.admission.release()
+            return primary.result()
+
+        hedge_data = dict(data, model=self.hedge_model or data['model'])
+        hedge = self._hedge_executor.submit(self._post_completion, hedge_data, tag)
+        logger.info(f"Hedging slow completion to {hedge_data['model']}")
+        tracing.set_attribute('ai.hedged', True)
+
+        # The extra slot covers whichever request is still running after the winner returns
+        unfinished = [primary, hedge]
+        release_lock = threading.Lock()
+
+        def release_when_both_done(future):
+            with release_lock:
+                unfinished.remove(future)
+                last = not unfinished
+            if last:
+                self.admission.release()
+
+        primary.add_done_callback(release_when_both_done)
+        hedge.add_done_callback(release_when_both_done)
+
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        with self._hedge_lock:
+                            self.hedge_stats['hedges_won'] += 1
+                        tracing.set_attribute('ai.hedge_won', True)
+                    for loser in pending:
+                        loser.cancel()
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def get_usage_stats(self) -> Dict[str, Dict[str, float]]:
+        """Requests, tokens and latency per request tag"""
+        return self.usage.get_stats()
+
+    def get_cassette_stats(self) -> Optional[Dict[str, Any]]:
+        """Responses recorded, replayed and missed; None without a cassette"""
+        return self.cassette.get_stats() if self.cassette else None
+
+    def get_hedge_stats(self) -> Dict[str, Any]:
+        """Hedging counters plus fire and win rates"""
+        with self._hedge_lock:
+            stats = dict(self.hedge_stats)
+        stats['fire_rate'] = stats['hedges_fired'] / stats['requests'] if stats['requests'] else 0.0
+        stats['win_rate'] = stats['hedges_won'] / stats['hedges_fired'] if stats['hedges_fired'] else 0.0
+        stats['current_delay'] = self._hedge_delay()
+        return stats
+
     def _make_request(self, messages: list, model: str = "openai/gpt-3.5-turbo",
-                      max_tokens: int = 1500, temperature: float = 0.7) -> str:
-        """Make request to OpenRouter API"""
+                      max_tokens: int = 1500, temperature: float = 0.7,
+                      fallback: Optional[Callable[[], str]] = None, tag: str = 'other') -> str:
+        """Make request to OpenRouter API.
+
+        `fallback` produces a local reply used when the circuit is open or the
+        request fails; without one the usual apology message is returned.
+        Token use and latency are recorded under `tag` (get_usage_stats).
+        """
+        tracing.set_attribute('ai.model', model)
+        tracing.set_attribute('ai.tag', tag)
+        if not self.breaker.allow_request():
+            tracing.set_attribute('ai.breaker_open', True)
+            return fallback() if fallback else "Sorry, our AI coach is temporarily unavailable. Please try again in a few minutes."
+
         try:
             data = {
                 "model": model,
@@ -32,27 +287,87 @@ class AIService:
                 "temperature": temperature
             }
 
-            response = requests.post(self.base_url, headers=self.headers,
-                                     json=data, timeout=30)
-            response.raise_for_status()
-
-            result = response.json()
-            return result['choices'][0]['message']['content']
-
+            with self.admission.slot():
+                if self.hedging_enabled:
+                    content = self._hedged_completion(data, tag)
+                else:
+                    content = self._post_completion(data, tag)
+            self.breaker.record_success()
+            return content
+
+        except AdmissionRejected as e:
+            # Shed load is not the API's fault, so the breaker is left alone
+            logger.warning(f"AI request shed ({e.reason}): {e}; {self.admission.get_metrics()}")
+            tracing.set_attribute('ai.shed', e.reason)
+            return fallback() if fallback else BUSY_MESSAGE
+        except CassetteMiss as e:
+            # Nor is a request missing from the cassette
+            logger.warning(f"AI cassette miss: {e}")
+            tracing.set_attribute('ai.cassette_miss', True)
+            if fallback:
+                return fallback()
+            return "Sorry, I'm experiencing technical difficulties. Please try again later."
         except requests.exceptions.RequestException as e:
             if e.response and e.response.status_code == 401:
                 logger.error("API request error: 401 Unauthorized. Please check your API key.")
-                return "Sorry, I'm experiencing authentication issues. Please contact the administrator."
-            logger.error(f"API request error: {e}")
-            return "Sorry, I'm experiencing technical difficulties. Please try again later."
+                message = "Sorry, I'm experiencing authentication issues. Please contact the administrator."
+            else:
+                logger.error(f"API request error: {e}")
+                message = "Sorry, I'm experiencing technical difficulties. Please try again later."
         except KeyError as e:
             logger.error(f"API response format error: {e}")
-            return "Sorry, I couldn't process the response. Please try again."
+            message = "Sorry, I couldn't process the response. Please try again."
         except Exception as e:
             logger.error(f"Unexpected error: {e}")
-            return "An unexpected error occurred. Please try again later."
+            message = "An unexpected error occurred. Please try again later."
+
+        self.breaker.record_failure()
+        tracing.record_error(message)
+        return fallback() if fallback else message
+
+    def _cache_plan(self, kind: str, user_profile: Dict[str, Any], plan: str):
+        key = (kind, user_profile.get('user_id'))
+        with self._plan_cache_lock:
+            self._plan_cache[key] = plan
+            self._plan_cache.move_to_end(key)
+            while len(self._plan_cache) > self._plan_cache_size:
+                self._plan_cache.popitem(last=False)
+
+    def _cached_plan(self, kind: str, user_profile: Dict[str, Any]) -> Optional[str]:
+        user_id = user_profile.get('user_id')
+        with self._plan_cache_lock:
+            plan = self._plan_cache.get((kind, user_id))
+        if plan or self.db is None or user_id is None:
+            return plan
+        try:
+            get_plan = self.db.get_active_workout_plan if kind == 'workout' else self.db.get_active_diet_plan
+            stored = get_plan(user_id)
+        except Exception as e:
+            logger.error(f"Could not load the saved {kind} plan for user {user_id}: {e}")
+            return None
+        return stored.get('plan') if stored else None
+
+    def _generate_plan(self, kind: str, user_profile: Dict[str, Any], messages: list,
+                       template: Callable[[], str], strict: bool = False) -> str:
+        """Request a plan, falling back to the user's cached or saved plan, or a template.
+
+        In strict mode a failure raises AIServiceError instead, so callers that
+        can retry later (the job queue) do not settle for a fallback.
+        """
+        failed = []
 
-    def generate_workout_plan(self, user_profile: Dict[str, Any]) -> str:
+        def fallback():
+            if strict:
+                raise AIServiceError(f"{kind} plan generation failed")
+            failed.append(True)
+            return self._cached_plan(kind, user_profile) or template()
+
+        plan = self._make_request(messages, fallback=fallback, tag=f'{kind}_plan')
+        if not failed:
+            self._cache_plan(kind, user_profile, plan)
+        return plan
+
+    def generate_workout_plan(self, user_profile: Dict[str, Any], strict: bool = False) -> str:
         """Generate personalized workout plan"""
         system_prompt = """You are a certified personal trainer and fitness expert. Create detailed, safe, and effective workout plans based on user profiles. Always include:
 - Warm-up and cool-down
@@ -90,9 +405,10 @@ Format your response clearly for mobile reading."""
             {"role": "user", "content": user_prompt}
         ]
 
-        return self._make_request(messages)
+        return self._generate_plan('workout', user_profile, messages,
+                                   lambda: fallbacks.workout_plan(user_profile), strict)
 
-    def generate_diet_plan(self, user_profile: Dict[str, Any]) -> str:
+    def generate_diet_plan(self, user_profile: Dict[str, Any], strict: bool = False) -> str:
         """Generate personalized diet plan"""
         system_prompt = """You are a qualified nutritionist. Create balanced, healthy meal plans based on user profiles. Always include:
 - Caloric requirements calculation
@@ -102,28 +418,12 @@ Format your response clearly for mobile reading."""
 - Practical preparation tips
 Consider dietary restrictions and fitness goals."""
 
-        # Calculate BMR for caloric needs
         age = user_profile.get('age', 25)
         weight = user_profile.get('weight', 70)
         height = user_profile.get('height', 170)
         gender = user_profile.get('gender', 'Male')
-
-        # Harris-Benedict equation
-        if gender.lower() == 'male':
-            bmr = 88.362 + (13.397 * weight) + (4.799 * height) - (5.677 * age)
-        else:
-            bmr = 447.593 + (9.247 * weight) + (3.098 * height) - (4.330 * age)
-
-        # Activity factor based on workout frequency
-        workout_days = user_profile.get('workout_days', 3)
-        if workout_days <= 2:
-            activity_factor = 1.2
-        elif workout_days <= 4:
-            activity_factor = 1.375
-        else:
-            activity_factor = 1.55
-
-        daily_calories = int(bmr * activity_factor)
+        targets = nutrition.daily_targets(user_profile)
+        daily_calories = targets['calories_target']
 
         user_prompt = f"""
         Create a comprehensive daily meal plan for:
@@ -136,11 +436,12 @@ Consider dietary restrictions and fitness goals."""
         - Fitness Goals: {user_profile.get('goals', 'General fitness')}
         - Dietary Restrictions: {user_profile.get('dietary_restrictions') or 'None'}
         - Estimated Daily Calories Needed: {daily_calories}
+        - Daily Macro Targets: {targets['protein_target']} g protein, {targets['carbs_target']} g carbs, {targets['fat_target']} g fat
 
         Please provide:
         1. Daily meal structure (breakfast, lunch, dinner, snacks)
         2. Sample meals with approximate calories
-        3. Macronutrient breakdown
+        3. Macronutrient breakdown matching the targets above
         4. Pre/post workout nutrition tips
         5. Hydration guidelines
         6. Weekly meal prep suggestions
@@ -154,10 +455,57 @@ Consider dietary restrictions and fitness goals."""
             {"role": "user", "content": user_prompt}
         ]
 
-        return self._make_request(messages)
+        return self._generate_plan('diet', user_profile, messages,
+                                   lambda: fallbacks.diet_plan(user_profile, daily_calories), strict)
+
+    def adjust_plan(self, kind: str, plan: str, changes: Dict[str, tuple], strict: bool = False) -> Optional[str]:
+        """Revise only the parts of a stored plan affected by profile changes.
+
+        `changes` maps field names to (old, new) values. The model sees the
+        current plan and the changes, and answers with just the sections that
+        need rewriting, each under the plan's own heading (see
+        plan_jobs.apply_revisions), so the completion is a fraction of a full
+        plan. Returns None when no section needs to change, or when the
+        request fails outside strict mode.
+        """
+        expert = "certified personal trainer" if kind == 'workout' else "qualified nutritionist"
+        system_prompt = f"""You are a {expert} updating an existing {kind} plan after a client's profile changed. Edit as little as possible: keep everything that is still right."""
+
+        change_lines = '\n'.join(f"- {field.replace('_', ' ').title()}: {old} -> {new}"
+                                  for field, (old, new) in changes.items())
+        user_prompt = f"""
+        **Current {kind} plan:**
+        {plan}
 
-    def generate_exercise_explanation(self, exercise_name: str, user_level: str = "beginner") -> str:
-        """Generate detailed exercise explanation"""
+        **Profile changes since this plan was written:**
+        {change_lines}
+
+        Reply with only the sections that must change. Start each one with the exact heading line
+        it has in the current plan, followed by the full revised section. Do not repeat unchanged
+        sections. If nothing needs to change, reply with exactly: {NO_PLAN_CHANGES}
+        """
+
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+
+        def unavailable():
+            if strict:
+                raise AIServiceError(f"{kind} plan adjustment failed")
+            return NO_PLAN_CHANGES
+
+        revision = self._make_request(messages, max_tokens=600, temperature=0.3, fallback=unavailable,
+                                      tag=f'{kind}_plan_adjust')
+        return None if revision.strip().upper().startswith(NO_PLAN_CHANGES) else revision
+
+    def generate_exercise_explanation(self, exercise_name: str, user_level: str = "beginner",
+                                      strict: bool = False) -> str:
+        """Generate detailed exercise explanation.
+
+        In strict mode a failure raises AIServiceError instead of returning an
+        apology, so callers that store the answer never store an error.
+        """
         system_prompt = """You are a fitness instructor. Provide clear, safe exercise instructions with proper form cues and common mistakes to avoid."""
 
         user_prompt = f"""
@@ -178,21 +526,25 @@ Consider dietary restrictions and fitness goals."""
             {"role": "user", "content": user_prompt}
         ]
 
-        return self._make_request(messages, max_tokens=500)
+        def unavailable():
+            raise AIServiceError(f"Could not explain '{exercise_name}'")
+
+        return self._make_request(messages, max_tokens=500, fallback=unavailable if strict else None,
+                                  tag='exercise')
 
     def analyze_progress(self, progress_data: list, user_profile: Dict[str, Any]) -> str:
-        """Analyze user progress and provide insights"""
+        """Analyze user progress (ProgressRows) and provide insights"""
         system_prompt = """You are a fitness coach analyzing client progress. Provide encouraging, constructive feedback with specific recommendations."""
 
         # Format progress data for analysis
         progress_summary = []
         for record in progress_data:
             progress_summary.append({
-                'date': record[4],
-                'weight': record[2],
-                'workout_completed': record[3],
-                'duration': record[5] if len(record) > 5 else None,
-                'calories_burned': record[6] if len(record) > 6 else None
+                'date': record.date,
+                'weight': record.weight,
+                'workout_completed': record.workout_completed,
+                'duration': record.duration_minutes,
+                'calories_burned': record.calories_burned
             })
 
         user_prompt = f"""
@@ -220,7 +572,7 @@ Consider dietary restrictions and fitness goals."""
             {"role": "user", "content": user_prompt}
         ]
 
-        return self._make_request(messages, max_tokens=800)
+        return self._make_request(messages, max_tokens=800, tag='progress_analysis')
 
     def generate_motivation_message(self, user_profile: Dict[str, Any], context: str = "daily") -> str:
         """Generate motivational messages"""
@@ -241,7 +593,9 @@ Consider dietary restrictions and fitness goals."""
             {"role": "user", "content": user_prompt}
         ]
 
-        return self._make_request(messages, max_tokens=150, temperature=0.8)
+        return self._make_request(messages, max_tokens=150, temperature=0.8,
+                                  fallback=lambda: fallbacks.motivation_message(user_profile, context),
+                                  tag='motivation')
 
     def answer_fitness_question(self, question: str, user_profile: Dict[str, Any]) -> str:
         """Answer general fitness questions"""
@@ -264,4 +618,4 @@ Consider dietary restrictions and fitness goals."""
             {"role": "user", "content": user_prompt}
         ]
 
-        return self._make_request(messages, max_tokens=600)
+        return self._make_request(messages, max_tokens=600, tag='question')
@@ -0,0 +1,108 @@
+"""Nutrition targets for many users: batch arrays vs one profile at a time.
+
+Generates --users random profiles and times:
+
+    per user       nutrition.daily_targets for each profile dict
+    batch          nutrition.batch_targets over the profile columns (numpy when installed)
+    batch, python  the same with numpy switched off
+
+then fills a temporary database with those users and an active diet plan
+each, and times the nightly DatabaseManager.recompute_nutrition_targets:
+first filling every plan's targets, then after 1% of users changed weight.
+
+    python benchmarks/nutrition_batch_benchmark.py --users 100000
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import nutrition  # noqa: E402
+from database_manager import DatabaseManager  # noqa: E402
+from storage import SQLiteBackend  # noqa: E402
+
+GOALS = ('Lose weight', 'Build muscle', 'Improve endurance', 'General fitness')
+FIELDS = ('age', 'weight', 'height', 'gender', 'workout_days', 'goals')
+
+
+def make_profiles(count, seed=1):
+    rng = random.Random(seed)
+    return [{'user_id': index, 'age': rng.randint(16, 75), 'weight': round(rng.uniform(45, 140), 1),
+             'height': rng.randint(150, 200), 'gender': rng.choice(('Male', 'Female')),
+             'workout_days': rng.randint(1, 7), 'goals': rng.choice(GOALS)}
+            for index in range(count)]
+
+
+def per_user(profiles):
+    return [tuple(nutrition.daily_targets(profile).values()) for profile in profiles]
+
+
+def batch(profiles):
+    columns = [[profile[field] for profile in profiles] for field in FIELDS]
+    return nutrition.batch_targets(*columns)
+
+
+def batch_python(profiles):
+    np, nutrition.np = nutrition.np, None
+    try:
+        return batch(profiles)
+    finally:
+        nutrition.np = np
+
+
+def fill(db, profiles):
+    conn = db.get_connection()
+    conn.executemany('''
+        INSERT INTO users (user_id, age, weight, height, gender, workout_days, goals)
+        VALUES (:user_id, :age, :weight, :height, :gender, :workout_days, :goals)
+    ''', profiles)
+    conn.executemany("INSERT INTO diet_plans (user_id, plan_data, is_active) VALUES (?, '{}', 1)",
+                     ((profile['user_id'],) for profile in profiles))
+    conn.commit()
+    conn.close()
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=100_000)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    profiles = make_profiles(args.users)
+    print(f"{args.users} users, numpy {'available' if nutrition.np is not None else 'not installed'}")
+    expected, baseline = timed(per_user, profiles)
+    print(f"{'per user':<16} {baseline:>8.3f}s")
+    for name, fn in (('batch', batch), ('batch, python', batch_python)):
+        result, elapsed = timed(fn, profiles)
+        assert result == expected, f"{name} disagrees with daily_targets"
+        print(f"{name:<16} {elapsed:>8.3f}s  {baseline / elapsed:5.1f}x")
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.db')
+        db = DatabaseManager(path, backend=SQLiteBackend(path))
+        fill(db, profiles)
+        updated, elapsed = timed(db.recompute_nutrition_targets)
+        print(f"nightly recompute, all plans      {elapsed:>8.3f}s  ({updated} updated)")
+
+        conn = db.get_connection()
+        conn.execute('UPDATE users SET weight = weight - 2 WHERE user_id % 100 = 0')
+        conn.commit()
+        conn.close()
+        updated, elapsed = timed(db.recompute_nutrition_targets)
+        print(f"nightly recompute, 1% reweighed   {elapsed:>8.3f}s  ({updated} updated)")
+
+
+if __name__ == '__main__':
+    main()
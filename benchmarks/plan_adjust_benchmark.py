@@ -0,0 +1,115 @@
+"""Cost of updating plans after a weight change: full regeneration vs a plan adjustment.
+
+For each sample profile, generates a workout and a diet plan, changes the
+weight, then gets the new plans both ways: regenerating them in full, and
+AIService.adjust_plan with the stored plan and the change.
+
+With OPENROUTER_API_KEY set, the requests go to the API and the table shows
+the token counts and latency it reports. Without a key, completions are
+answered locally (the templated plans for full generations, a single
+revised section for adjustments); prompt tokens are then estimated at four
+characters per token and completion tokens are the max_tokens requested,
+which is what a full-length answer would cost.
+
+To get API numbers repeatably, record once and replay the cassette after
+(see cassette.py); replay serves the recorded answers, usage and latency:
+
+    AI_CASSETTE_MODE=record python benchmarks/plan_adjust_benchmark.py
+    AI_CASSETTE_MODE=replay python benchmarks/plan_adjust_benchmark.py --profiles 3
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import fallbacks  # noqa: E402
+from ai_service import AIService  # noqa: E402
+from nutrition import daily_targets  # noqa: E402
+from plan_jobs import apply_revisions  # noqa: E402
+
+PROFILES = [
+    {'user_id': 1, 'age': 28, 'weight': 82, 'height': 180, 'gender': 'Male', 'fitness_level': 'Beginner',
+     'goals': 'Weight Loss', 'medical_conditions': 'None', 'dietary_restrictions': 'None',
+     'workout_days': 3, 'workout_duration': 45},
+    {'user_id': 2, 'age': 35, 'weight': 64, 'height': 165, 'gender': 'Female', 'fitness_level': 'Intermediate',
+     'goals': 'Muscle Gain', 'medical_conditions': 'None', 'dietary_restrictions': 'Vegetarian',
+     'workout_days': 4, 'workout_duration': 60},
+    {'user_id': 3, 'age': 47, 'weight': 95, 'height': 175, 'gender': 'Male', 'fitness_level': 'Advanced',
+     'goals': 'Endurance', 'medical_conditions': 'Mild knee pain', 'dietary_restrictions': 'None',
+     'workout_days': 5, 'workout_duration': 60},
+]
+
+
+class OfflineAIService(AIService):
+    """Answers completions locally and counts what would have been sent"""
+
+    def _post_completion(self, data, tag='other'):
+        started = time.monotonic()
+        prompt = ''.join(message['content'] for message in data['messages'])
+        if tag.endswith('_adjust'):
+            content = "**Daily Calorie Target:**\nAbout 150 kcal less per day for the new weight."
+        elif tag == 'diet_plan':
+            content = fallbacks.diet_plan(self._profile, daily_targets(self._profile)['calories_target'])
+        else:
+            content = fallbacks.workout_plan(self._profile)
+        self.usage.record(tag, time.monotonic() - started,
+                          {'prompt_tokens': len(prompt) // 4, 'completion_tokens': data['max_tokens']})
+        return content
+
+
+def run(ai, profiles):
+    for profile in profiles:
+        ai._profile = profile
+        workout = ai.generate_workout_plan(profile)
+        diet = ai.generate_diet_plan(profile)
+
+        changed = dict(profile, weight=profile['weight'] - 4)
+        ai._profile = changed
+        ai.generate_workout_plan(changed)
+        ai.generate_diet_plan(changed)
+
+        changes = {'weight': (profile['weight'], changed['weight'])}
+        for kind, plan in (('workout', workout), ('diet', diet)):
+            revisions = ai.adjust_plan(kind, plan, changes)
+            if revisions:
+                apply_revisions(plan, revisions)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--profiles', type=int, default=len(PROFILES))
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    replay = os.getenv('AI_CASSETTE_MODE', 'off').lower() == 'replay'
+    live = bool(os.getenv('OPENROUTER_API_KEY')) or replay
+    if not live:
+        # Never sent: OfflineAIService answers every completion itself
+        os.environ['OPENROUTER_API_KEY'] = 'offline'
+    ai = AIService() if live else OfflineAIService()
+    run(ai, PROFILES[:args.profiles])
+
+    stats = ai.get_usage_stats()
+    print(f"{'replayed API' if replay else 'live API' if live else 'offline estimate'}, {args.profiles} profiles")
+    print(f"{'request':<22} {'count':>6} {'prompt tok':>11} {'completion tok':>15} {'seconds':>8}")
+    for tag in ('workout_plan', 'workout_plan_adjust', 'diet_plan', 'diet_plan_adjust'):
+        values = stats.get(tag)
+        if values:
+            print(f"{tag:<22} {values['requests']:>6} {values['avg_prompt_tokens']:>11} "
+                  f"{values['avg_completion_tokens']:>15} {values['avg_seconds']:>8}")
+
+    for kind in ('workout', 'diet'):
+        full, adjust = stats.get(f'{kind}_plan'), stats.get(f'{kind}_plan_adjust')
+        if full and adjust:
+            full_tokens = full['avg_prompt_tokens'] + full['avg_completion_tokens']
+            adjust_tokens = adjust['avg_prompt_tokens'] + adjust['avg_completion_tokens']
+            print(f"{kind}: adjustment uses {adjust_tokens / full_tokens:.0%} of the tokens of a full plan "
+                  f"({adjust['avg_completion_tokens'] / full['avg_completion_tokens']:.0%} of the completion tokens)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""Peak Python memory of a full reminders scan, raw tuples vs typed rows.
+
+Fills a temporary database with --rows active reminders, then runs the
+reminder selection pass (filter by type and time, collect user ids) three
+ways, measuring each with tracemalloc:
+
+    fetchall tuples   the old get_active_reminders: every row as a tuple in one list
+    fetchall dicts    the same rows turned into dicts, as callers often did
+    typed scan        get_active_reminders now: ReminderRows streamed in batches
+
+    python benchmarks/row_memory_benchmark.py --rows 1000000
+
+Times include tracemalloc's overhead, which weighs on the allocation-heavy
+typed scan most; without it, tuples and typed rows take about the same time.
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import fields
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from database_manager import DatabaseManager  # noqa: E402
+from rows import ReminderRow  # noqa: E402
+from storage import SQLiteBackend  # noqa: E402
+
+TYPES = ('workout', 'general', 'hydration')
+TIMES = ('morning', 'evening', 'noon')
+
+
+def fill(db, rows):
+    conn = db.get_connection()
+    conn.executemany('''
+        INSERT INTO reminders (user_id, reminder_type, reminder_time, reminder_days, message, is_active)
+        VALUES (?, ?, ?, 'daily', NULL, 1)
+    ''', ((index, TYPES[index % 3], TIMES[index % 3 // 2]) for index in range(rows)))
+    conn.commit()
+    conn.close()
+
+
+def fetchall_tuples(db):
+    conn = db.get_connection()
+    reminders = conn.execute('SELECT * FROM reminders WHERE is_active = 1').fetchall()
+    conn.close()
+    return [reminder[1] for reminder in reminders if reminder[2] == 'workout' and 'morning' in reminder[3]]
+
+
+def fetchall_dicts(db):
+    conn = db.get_connection()
+    cursor = conn.execute('SELECT * FROM reminders WHERE is_active = 1')
+    names = [column[0] for column in cursor.description]
+    reminders = [dict(zip(names, row)) for row in cursor.fetchall()]
+    conn.close()
+    return [reminder['user_id'] for reminder in reminders
+            if reminder['reminder_type'] == 'workout' and 'morning' in reminder['reminder_time']]
+
+
+def typed_scan(db):
+    return [reminder.user_id for reminder in db.get_active_reminders()
+            if reminder.reminder_type == 'workout' and 'morning' in reminder.reminder_time]
+
+
+def measure(fn, db):
+    tracemalloc.start()
+    started = time.perf_counter()
+    selected = fn(db)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak, elapsed, len(selected)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.db')
+        db = DatabaseManager(path, backend=SQLiteBackend(path))
+        fill(db, args.rows)
+
+        print(f"{args.rows} reminders; ReminderRow has {len(fields(ReminderRow))} slots, "
+              f"{sys.getsizeof(ReminderRow(*range(len(fields(ReminderRow)))))} bytes per row object")
+        print(f"{'method':<18} {'peak MB':>9} {'seconds':>8} {'selected':>9}")
+        for name, fn in (('fetchall tuples', fetchall_tuples), ('fetchall dicts', fetchall_dicts),
+                         ('typed scan', typed_scan)):
+            peak, elapsed, selected = measure(fn, db)
+            print(f"{name:<18} {peak / 2 ** 20:>9.1f} {elapsed:>8.2f} {selected:>9}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Write throughput of log_progress by shard count.
+
+Writer threads log progress for random users against a fresh sharded store
+in a temporary directory, for each shard count in turn.
+
+    python benchmarks/shard_write_benchmark.py --shards 1 2 4 8 --threads 8 --seconds 5
+
+Each write is its own transaction, as in the bot, so a single file is bound
+by its one write lock (and fsync); extra shards add independent locks.
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from database_manager import DatabaseManager  # noqa: E402
+from storage import ShardedSQLiteBackend  # noqa: E402
+
+USERS = 1000
+
+
+def run(shard_count, threads, seconds):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.db')
+        db = DatabaseManager(path, backend=ShardedSQLiteBackend(path, shard_count))
+        for user_id in range(1, USERS + 1):
+            conn = db.get_connection(user_id)
+            conn.execute('INSERT INTO users (user_id, first_name) VALUES (?, ?)', (user_id, 'Bench'))
+            conn.commit()
+            conn.close()
+
+        counts = [0] * threads
+        errors = [0] * threads
+        deadline = time.perf_counter() + seconds
+
+        def writer(index):
+            rng = random.Random(index)
+            while time.perf_counter() < deadline:
+                try:
+                    db.log_progress(rng.randint(1, USERS), weight=70 + rng.random() * 10,
+                                    workout_completed=True, duration_minutes=30)
+                    counts[index] += 1
+                except Exception:
+                    errors[index] += 1
+
+        workers = [threading.Thread(target=writer, args=(index,)) for index in range(threads)]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+        return sum(counts) / elapsed, sum(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    baseline = None
+    print(f"{'shards':>6}  {'writes/s':>10}  {'speedup':>7}  {'errors':>6}")
+    for shard_count in args.shards:
+        throughput, errors = run(shard_count, args.threads, args.seconds)
+        baseline = baseline or throughput
+        print(f"{shard_count:>6}  {throughput:>10.0f}  {throughput / baseline:>6.2f}x  {errors:>6}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Cold-start benchmark: time from `import main` to the first 200 OK on GET /.
+
+Each run uses a fresh interpreter so nothing is cached between runs.
+
+    python benchmarks/startup_benchmark.py --runs 10 --record
+
+--record appends the result to benchmarks/startup_history.jsonl so the
+number can be tracked across commits.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HISTORY_FILE = os.path.join(ROOT, 'benchmarks', 'startup_history.jsonl')
+
+CHILD = '''
+import time
+started = time.perf_counter()
+import main
+response = main.app.test_client().get('/')
+assert response.status_code == 200, response.status_code
+print(time.perf_counter() - started)
+'''
+
+
+def run_once():
+    env = dict(os.environ, TELEGRAM_TOKEN=os.environ.get('TELEGRAM_TOKEN', '123:benchmark'))
+    output = subprocess.run([sys.executable, '-c', CHILD], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--record', action='store_true', help='append the result to the history file')
+    args = parser.parse_args()
+
+    samples = [run_once() for _ in range(args.runs)]
+    result = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'revision': git_revision(),
+        'runs': args.runs,
+        'median_ms': round(statistics.median(samples) * 1000, 1),
+        'min_ms': round(min(samples) * 1000, 1),
+        'max_ms': round(max(samples) * 1000, 1),
+    }
+    print(json.dumps(result))
+
+    if args.record:
+        with open(HISTORY_FILE, 'a') as history:
+            history.write(json.dumps(result) + '\n')
+
+
+if __name__ == '__main__':
+    main()
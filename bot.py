@@ -1,15 +1,36 @@
 import logging
+from datetime import datetime
 import telebot
 from telebot import types
 from database_manager import DatabaseManager
 from ai_service import AIService
+from admission import AdmissionRejected, BUSY_MESSAGE, rate_limited_message
+from job_queue import JobQueue, JobWorkerPool
+from plan_jobs import WORKOUT_PLAN_JOB, DIET_PLAN_JOB, PLAN_ADJUST_JOB, PLAN_JOB_TYPES
+from leaderboard import Leaderboard
+from progress_charts import ProgressChartService
+from export_service import EXPORT_FORMATS, EXPORT_JOB_TYPES
+from exercise_catalog import ExerciseCatalog
+from timezones import parse_timezone, get_zone
 
 logger = logging.getLogger(__name__)
 
+LEADERBOARD_SIZE = 10
+MEDALS = {1: "🥇", 2: "🥈", 3: "🥉"}
+
+PROGRESS_PAGE_SIZE = 10
+# Callback data for the next page of progress history: prefix, then the
+# (date, id) keyset cursor as '<id>:<date>' (well under Telegram's 64 bytes)
+OLDER_PROGRESS_PREFIX = "progress_before:"
+# Callback data for adjusting plans after a weight update: prefix, then the previous weight
+ADJUST_PLANS_PREFIX = "adjust_plans:"
+
 # In-memory state management (for profile setup)
 user_states = {}
 
-def create_bot(bot: telebot.TeleBot, db: DatabaseManager, ai: AIService):
+def create_bot(bot: telebot.TeleBot, db: DatabaseManager, ai: AIService,
+               job_queue: JobQueue, job_workers: JobWorkerPool, leaderboard: Leaderboard,
+               charts: ProgressChartService, exercises: ExerciseCatalog):
     """Creates and configures the Telegram bot with all its handlers."""
 
     # Handler for /start command
@@ -55,9 +76,150 @@ def create_bot(bot: telebot.TeleBot, db: DatabaseManager, ai: AIService):
 /diet - Manage your diet plan
 /progress - Log and view your progress
 /reminders - Set and manage reminders
+/leaderboard - This week's top athletes (join/leave to opt in or out)
+/export - Download your full history (add 'json' for JSON instead of CSV)
+/exercise <name> - How to perform an exercise
+/timezone <zone> - Set your timezone for reminders (e.g. Europe/Berlin or UTC+3)
         """
         bot.send_message(message.chat.id, help_text, parse_mode='Markdown')
 
+    # Handler for /leaderboard command
+    @bot.message_handler(commands=['leaderboard'])
+    def leaderboard_command(message):
+        user_id = message.from_user.id
+        args = message.text.split()[1:]
+        action = args[0].lower() if args else ''
+
+        if action == 'join':
+            if not db.get_user(user_id):
+                bot.send_message(message.chat.id, "Please complete your profile setup first using /start")
+                return
+            leaderboard.join(user_id)
+            bot.send_message(message.chat.id, "🏁 You're on this week's leaderboard! Every logged workout counts.")
+        elif action == 'leave':
+            leaderboard.leave(user_id)
+            bot.send_message(message.chat.id, "You've left the leaderboard. Use /leaderboard join to come back anytime.")
+            return
+
+        show_leaderboard(message, user_id)
+
+    # Handler for /export command
+    @bot.message_handler(commands=['export'])
+    def export_command(message):
+        user_id = message.from_user.id
+        args = message.text.split()[1:]
+        export_format = args[0].lower() if args else 'csv'
+        if export_format not in EXPORT_FORMATS:
+            bot.send_message(message.chat.id, "Usage: /export or /export json")
+            return
+
+        if not db.get_user(user_id):
+            bot.send_message(message.chat.id, "Please complete your profile setup first using /start")
+            return
+
+        try:
+            job_queue.enqueue(EXPORT_JOB_TYPES[export_format], user_id, message.chat.id, {'format': export_format})
+            job_workers.notify()
+            bot.send_message(message.chat.id, "📦 Preparing your export... I'll send the file here shortly.")
+        except Exception as e:
+            logger.error(f"Error queueing export for user {user_id}: {e}")
+            bot.send_message(message.chat.id, "Sorry, I couldn't start your export. Please try again later.")
+
+    # Handler for /exercise command
+    @bot.message_handler(commands=['exercise'])
+    def exercise_command(message):
+        query = message.text.partition(' ')[2].strip()
+        if not query:
+            bot.send_message(message.chat.id, "Usage: /exercise <name>, e.g. /exercise push up")
+            return
+
+        user_id = message.from_user.id
+        user = db.get_user(user_id)
+        level = (user or {}).get('fitness_level') or 'beginner'
+
+        def explain(name):
+            # Only catalog misses cost a generation, so only they count against the user's rate
+            if not ai.admission.check_user(user_id):
+                raise AdmissionRejected('rate_limited', f"user {user_id} over generation rate")
+            with ai.admission.notify_queued(lambda position: bot.send_message(
+                    message.chat.id, f"⏳ Lots of requests right now, you're #{position} in line...")):
+                return ai.generate_exercise_explanation(name, level.lower(), strict=True)
+
+        try:
+            exercise, source = exercises.lookup(query, explain, level)
+        except AdmissionRejected:
+            bot.send_message(message.chat.id, rate_limited_message(ai.admission.retry_after(user_id)))
+            return
+        except Exception as e:
+            logger.error(f"Error looking up exercise '{query}': {e}")
+            bot.send_message(message.chat.id, "Sorry, I couldn't find that exercise right now. Please try again later.")
+            return
+
+        text = f"🏋️ {exercise['name']}\n"
+        if exercise.get('muscle_groups'):
+            text += f"Muscles: {exercise['muscle_groups']}\n"
+        if exercise.get('equipment'):
+            text += f"Equipment: {exercise['equipment']}\n"
+        text += f"\n{exercise['instructions']}"
+        if source == 'ai':
+            related = [name for name in exercises.related(query) if name != exercise['name']]
+            if related:
+                text += f"\n\nRelated: {', '.join(related)}"
+        bot.send_message(message.chat.id, text)
+
+    # Handler for /timezone command
+    @bot.message_handler(commands=['timezone'])
+    def timezone_command(message):
+        user_id = message.from_user.id
+        user = db.get_user(user_id)
+        if not user:
+            bot.send_message(message.chat.id, "Please complete your profile setup first using /start")
+            return
+
+        query = message.text.partition(' ')[2].strip()
+        if not query:
+            current = user.get('timezone') or 'server default'
+            bot.send_message(message.chat.id, f"🕒 Your timezone: {current}\n\n"
+                             "Reminders arrive at your local time. To change it, send e.g. "
+                             "/timezone Europe/Berlin or /timezone UTC+3")
+            return
+
+        timezone_name = parse_timezone(query)
+        if not timezone_name:
+            bot.send_message(message.chat.id, "I don't recognise that timezone. "
+                             "Try a name like America/New_York or an offset like UTC-5.")
+            return
+        db.set_user_timezone(user_id, timezone_name)
+        local_time = datetime.now(get_zone(timezone_name)).strftime('%H:%M')
+        bot.send_message(message.chat.id, f"✅ Timezone set to {timezone_name} (it's {local_time} there). "
+                         "Reminders will follow your local time.")
+
+    def show_leaderboard(message, user_id):
+        top = leaderboard.top(LEADERBOARD_SIZE)
+        names = db.get_display_names(user_id for user_id, _ in top)
+
+        text = "🏆 This Week's Leaderboard\n\n"
+        if top:
+            rank = 0
+            previous = None
+            for position, (member_id, workouts) in enumerate(top, start=1):
+                if workouts != previous:
+                    rank, previous = position, workouts
+                text += f"{MEDALS.get(rank, f'{rank}.')} {names.get(member_id, 'Athlete')} – {workouts} workouts\n"
+        else:
+            text += "No workouts logged yet this week. Be the first! 💪\n"
+
+        standing = leaderboard.rank(user_id)
+        if standing:
+            rank, workouts, members = standing
+            if workouts:
+                text += f"\nYou're #{rank} of {members} with {workouts} workouts."
+            else:
+                text += "\nLog a workout to get on the board!"
+        else:
+            text += "\nWant to compete? Use /leaderboard join"
+        bot.send_message(message.chat.id, text)
+
     # Callback query handler
     @bot.callback_query_handler(func=lambda call: True)
     def callback_handler(call):
@@ -77,6 +239,13 @@ def create_bot(bot: telebot.TeleBot, db: DatabaseManager, ai: AIService):
 
             if action in actions:
                 actions[action](call.message, user_id)
+            elif action.startswith(OLDER_PROGRESS_PREFIX):
+                record_id, _, date = action[len(OLDER_PROGRESS_PREFIX):].partition(':')
+                show_progress_history(call.message, user_id, before=(date, int(record_id)))
+                bot.answer_callback_query(call.id)
+            elif action.startswith(ADJUST_PLANS_PREFIX):
+                adjust_plans(call.message, user_id, float(action[len(ADJUST_PLANS_PREFIX):]))
+                bot.answer_callback_query(call.id)
             else:
                 bot.answer_callback_query(call.id, "Action not implemented yet.")
         except Exception as e:
@@ -87,6 +256,7 @@ def create_bot(bot: telebot.TeleBot, db: DatabaseManager, ai: AIService):
     def show_profile(message, user_id):
         user_profile = db.get_user(user_id)
         if user_profile:
+            streaks = db.get_streaks(user_id)
             profile_text = f"""
 👤 **Your Profile:**
 
@@ -96,6 +266,7 @@ def create_bot(bot: telebot.TeleBot, db: DatabaseManager, ai: AIService):
 • Gender: {user_profile.get('gender', 'N/A')}
 • Fitness Level: {user_profile.get('fitness_level', 'N/A')}
 • Goals: {user_profile.get('goals', 'N/A')}
+• 🔥 Current Streak: {streaks['current_streak']} days (best: {streaks['longest_streak']})
             """
             markup = types.InlineKeyboardMarkup()
             markup.add(types.InlineKeyboardButton("📝 Update Profile", callback_data="update_profile"))
@@ -108,54 +279,80 @@ def create_bot(bot: telebot.TeleBot, db: DatabaseManager, ai: AIService):
         user_states[user_id] = {'step': 'update_weight', 'data': {}}
 
     # --- Plan Generation ---
-    def generate_workout_plan(message, user_id):
+    # Plans are generated by the job workers (see plan_jobs.py) and delivered when ready.
+    def enqueue_plan(message, user_id, job_type, label, payload=None):
         user_profile = db.get_user(user_id)
         if not user_profile:
             bot.send_message(message.chat.id, "Please complete your profile setup first using /start")
             return
 
-        bot.send_message(message.chat.id, "🔄 Generating your personalized workout plan...")
+        if not ai.admission.check_user(user_id):
+            bot.send_message(message.chat.id, rate_limited_message(ai.admission.retry_after(user_id)))
+            return
+
         try:
-            plan = ai.generate_workout_plan(user_profile)
-            db.save_workout_plan(user_id, {'plan': plan})
-            bot.send_message(message.chat.id, f"💪 **Your Workout Plan:**\n\n{plan}", parse_mode='Markdown')
+            # Shed rather than queue work that would take too long to reach
+            if not ai.admission.admit_job(job_queue.count_queued(PLAN_JOB_TYPES)):
+                logger.warning(f"Plan backlog full, shedding {label} plan for user {user_id}: "
+                               f"{ai.admission.get_metrics()}")
+                bot.send_message(message.chat.id, BUSY_MESSAGE)
+                return
+
+            job_id = job_queue.enqueue(job_type, user_id, message.chat.id, payload)
+            job_workers.notify()
+            position = job_queue.position(job_id, PLAN_JOB_TYPES)
+            if job_type == PLAN_ADJUST_JOB:
+                text = "🔄 Adjusting your plans to your updated profile... I'll send the changes here shortly."
+            else:
+                text = f"🔄 Generating your personalized {label} plan... I'll send it here as soon as it's ready."
+            # Others still waiting ahead means every worker is busy
+            if position > 1:
+                text += f"\n\n⏳ It's busy right now, you're #{position} in line."
+            bot.send_message(message.chat.id, text)
         except Exception as e:
-            logger.error(f"Error generating workout plan for user {user_id}: {e}")
-            bot.send_message(message.chat.id, "Sorry, I couldn't generate a workout plan at the moment. Please try again later.")
+            logger.error(f"Error queueing {label} plan for user {user_id}: {e}")
+            bot.send_message(message.chat.id, f"Sorry, I couldn't generate a {label} plan at the moment. Please try again later.")
+
+    def generate_workout_plan(message, user_id):
+        enqueue_plan(message, user_id, WORKOUT_PLAN_JOB, "workout")
 
     def generate_diet_plan(message, user_id):
-        user_profile = db.get_user(user_id)
-        if not user_profile:
-            bot.send_message(message.chat.id, "Please complete your profile setup first using /start")
-            return
+        enqueue_plan(message, user_id, DIET_PLAN_JOB, "diet")
 
-        bot.send_message(message.chat.id, "🔄 Generating your personalized diet plan...")
-        try:
-            plan = ai.generate_diet_plan(user_profile)
-            db.save_diet_plan(user_id, {'plan': plan})
-            bot.send_message(message.chat.id, f"🥗 **Your Diet Plan:**\n\n{plan}", parse_mode='Markdown')
-        except Exception as e:
-            logger.error(f"Error generating diet plan for user {user_id}: {e}")
-            bot.send_message(message.chat.id, "Sorry, I couldn't generate a diet plan at the moment. Please try again later.")
+    def adjust_plans(message, user_id, old_weight):
+        """Revise the active plans for the new weight; only the changed sections are generated"""
+        user_profile = db.get_user(user_id)
+        changes = {'weight': (old_weight, user_profile['weight'])} if user_profile else {}
+        enqueue_plan(message, user_id, PLAN_ADJUST_JOB, "adjusted", payload={'changes': changes})
 
     # --- Progress Tracking ---
     def log_progress_start(message, user_id):
         bot.send_message(message.chat.id, "Did you complete your workout today? (yes/no)")
         user_states[user_id] = {'step': 'log_workout_completed', 'data': {}}
 
-    def show_progress_history(message, user_id):
-        progress_records = db.get_progress_history(user_id)
+    def show_progress_history(message, user_id, before=None):
+        """First page as a new message with the chart; older pages replace the message"""
+        progress_records, next_cursor = db.get_progress_page(user_id, before, PROGRESS_PAGE_SIZE)
         if progress_records:
-            history_text = "📊 **Your Recent Progress:**\n\n"
+            history_text = "📊 **Your Recent Progress:**\n\n" if before is None else "📊 **Earlier Progress:**\n\n"
             for record in progress_records:
-                record_dict = dict(record)
-                date = record_dict['date'].split()[0]
-                history_text += f"• {date}: Weight {record_dict.get('weight', 'N/A')}kg"
-                if record_dict.get('workout_completed'):
+                date = record.date.split()[0]
+                history_text += f"• {date}: Weight {record.weight if record.weight is not None else 'N/A'}kg"
+                if record.workout_completed:
                     history_text += " ✅ Workout completed"
                 history_text += "\n"
-            bot.send_message(message.chat.id, history_text, parse_mode='Markdown')
-        else:
+            markup = None
+            if next_cursor:
+                markup = types.InlineKeyboardMarkup()
+                markup.add(types.InlineKeyboardButton(
+                    "⬅️ Older", callback_data=f"{OLDER_PROGRESS_PREFIX}{next_cursor[1]}:{next_cursor[0]}"))
+            if before is None:
+                bot.send_message(message.chat.id, history_text, reply_markup=markup, parse_mode='Markdown')
+                charts.send_chart(message.chat.id, user_id)
+            else:
+                bot.edit_message_text(history_text, message.chat.id, message.message_id,
+                                      reply_markup=markup, parse_mode='Markdown')
+        elif before is None:
             bot.send_message(message.chat.id, "No progress recorded yet. Use 'Log Progress' to start!")
 
     # --- Settings ---
@@ -321,7 +518,12 @@ def create_bot(bot: telebot.TeleBot, db: DatabaseManager, ai: AIService):
             notes=data['notes']
         )
         del user_states[user_id]
-        bot.send_message(message.chat.id, "✅ Progress logged successfully!")
+        reply = "✅ Progress logged successfully!"
+        if data['workout_completed']:
+            streak = db.get_streaks(user_id)['current_streak']
+            if streak > 1:
+                reply += f"\n🔥 {streak}-day streak, keep it going!"
+        bot.send_message(message.chat.id, reply)
 
     @bot.message_handler(func=lambda message: user_states.get(message.from_user.id, {}).get('step') == 'update_weight')
     def handle_update_weight(message):
@@ -331,10 +533,19 @@ def create_bot(bot: telebot.TeleBot, db: DatabaseManager, ai: AIService):
             if 30 <= weight <= 300:
                 user = db.get_user(user_id)
                 if user:
+                    old_weight = user['weight']
                     user['weight'] = weight
                     db.save_user(user)
                     del user_states[user_id]
-                    bot.send_message(message.chat.id, "✅ Your weight has been updated!")
+                    has_plans = db.get_active_workout_plan(user_id) or db.get_active_diet_plan(user_id)
+                    if old_weight not in (None, weight) and has_plans:
+                        markup = types.InlineKeyboardMarkup()
+                        markup.add(types.InlineKeyboardButton(
+                            "🔄 Adjust my plans", callback_data=f"{ADJUST_PLANS_PREFIX}{old_weight}"))
+                        bot.send_message(message.chat.id, "✅ Your weight has been updated! "
+                                         "Want me to adjust your current plans to match?", reply_markup=markup)
+                    else:
+                        bot.send_message(message.chat.id, "✅ Your weight has been updated!")
                     show_profile(message, user_id)
                 else:
                     bot.send_message(message.chat.id, "Could not find your profile. Please create one using /start.")
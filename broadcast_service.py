@@ -0,0 +1,244 @@
+import logging
+import threading
+import time
+from typing import Callable, Iterable, Optional
+
+from database_manager import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+# broadcast_jobs.status
+RUNNING = 'running'
+COMPLETED = 'completed'
+CANCELLED = 'cancelled'
+
+# broadcast_recipients.status
+PENDING = 'pending'
+SENDING = 'sending'
+SENT = 'sent'
+FAILED = 'failed'
+UNKNOWN = 'unknown'
+
+
+class BroadcastService:
+    """Sends one message to many users as a resumable, checkpointed job.
+
+    Recipients are walked in user_id order, one keyset page at a time, and
+    the job's cursor is saved after each page. Every recipient gets a status
+    row that is set to 'sending' before the message goes out, so a restarted
+    job never messages anyone twice: rows left in 'sending' by a crash are
+    marked 'unknown' and skipped.
+    """
+
+    def __init__(self, db: DatabaseManager, send: Callable[[int, str], bool], page_size: int = 500,
+                 send_interval: float = 0.05, stale_after: float = 300):
+        self.db = db
+        self.send = send
+        self.page_size = page_size
+        # Telegram allows about 30 messages per second across all chats
+        self.send_interval = send_interval
+        # A running job whose heartbeat is older than this has lost its worker
+        self.stale_after = stale_after
+        self._cancelled = set()
+        self._running = set()
+        self._lock = threading.Lock()
+
+    def create(self, message: str, target_users: Optional[Iterable[int]] = None):
+        """Record a new broadcast and return its id.
+
+        With no target_users the job goes to every active user, read page by
+        page while it runs; an explicit list is stored up front.
+        """
+        conn = self.db.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO broadcast_jobs (message, target, status, heartbeat_at) VALUES (?, ?, ?, ?)
+        ''', (message, 'active' if target_users is None else 'explicit', RUNNING, time.time()))
+        job_id = cursor.lastrowid
+        if target_users is not None:
+            cursor.executemany('''
+                INSERT OR IGNORE INTO broadcast_recipients (job_id, user_id) VALUES (?, ?)
+            ''', ((job_id, user_id) for user_id in target_users))
+        conn.commit()
+        conn.close()
+        logger.info(f"Broadcast {job_id} created")
+        return job_id
+
+    def start(self, job_id):
+        """Run a broadcast on a background thread"""
+        thread = threading.Thread(target=self.run, args=(job_id,), daemon=True,
+                                  name=f'broadcast-{job_id}')
+        thread.start()
+        return thread
+
+    def cancel(self, job_id):
+        """Stop a broadcast after the message currently being sent"""
+        with self._lock:
+            self._cancelled.add(job_id)
+        conn = self.db.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE broadcast_jobs SET status = ?, finished_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND status = ?
+        ''', (CANCELLED, job_id, RUNNING))
+        cancelled = cursor.rowcount > 0
+        conn.commit()
+        conn.close()
+        if cancelled:
+            logger.info(f"Broadcast {job_id} cancelled")
+        return cancelled
+
+    def get_progress(self, job_id):
+        """Status and counters for a broadcast, or None if it does not exist"""
+        conn = self.db.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT status, target, cursor_user_id, sent, failed, skipped, created_at, finished_at
+            FROM broadcast_jobs WHERE id = ?
+        ''', (job_id,))
+        row = cursor.fetchone()
+        if row is None:
+            conn.close()
+            return None
+        progress = dict(zip(('status', 'target', 'cursor_user_id', 'sent', 'failed', 'skipped',
+                             'created_at', 'finished_at'), row))
+        if progress['target'] == 'explicit':
+            cursor.execute('''
+                SELECT COUNT(*) FROM broadcast_recipients WHERE job_id = ? AND status = ?
+            ''', (job_id, PENDING))
+            progress['remaining'] = cursor.fetchone()[0]
+        conn.close()
+        return progress
+
+    def resume_incomplete(self):
+        """Restart running broadcasts whose worker has gone away; returns their ids"""
+        conn = self.db.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id FROM broadcast_jobs
+            WHERE status = ? AND (heartbeat_at IS NULL OR heartbeat_at < ?)
+        ''', (RUNNING, time.time() - self.stale_after))
+        job_ids = [row[0] for row in cursor.fetchall()]
+        conn.close()
+        for job_id in job_ids:
+            logger.info(f"Resuming broadcast {job_id}")
+            self.start(job_id)
+        return job_ids
+
+    def _next_page(self, job_id, target, after_user_id):
+        if target == 'active':
+            return self.db.get_active_user_ids_page(after_user_id, self.page_size)
+        conn = self.db.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT user_id FROM broadcast_recipients
+            WHERE job_id = ? AND user_id > ?
+            ORDER BY user_id LIMIT ?
+        ''', (job_id, after_user_id, self.page_size))
+        user_ids = [row[0] for row in cursor.fetchall()]
+        conn.close()
+        return user_ids
+
+    def _is_cancelled(self, job_id):
+        with self._lock:
+            return job_id in self._cancelled
+
+    def run(self, job_id):
+        """Send a broadcast from its last checkpoint until done or cancelled"""
+        with self._lock:
+            if job_id in self._running:
+                return self.get_progress(job_id)
+            self._running.add(job_id)
+        try:
+            return self._run(job_id)
+        finally:
+            with self._lock:
+                self._running.discard(job_id)
+                self._cancelled.discard(job_id)
+
+    def _run(self, job_id):
+        conn = self.db.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT message, target, status, cursor_user_id FROM broadcast_jobs WHERE id = ?',
+                       (job_id,))
+        row = cursor.fetchone()
+        if row is None or row[2] != RUNNING:
+            conn.close()
+            return self.get_progress(job_id)
+        message, target, _, after_user_id = row
+
+        # Anything caught mid-send by a crash may or may not have arrived
+        cursor.execute('''
+            UPDATE broadcast_recipients SET status = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE job_id = ? AND status = ?
+        ''', (UNKNOWN, job_id, SENDING))
+        if cursor.rowcount:
+            cursor.execute('UPDATE broadcast_jobs SET skipped = skipped + ? WHERE id = ?',
+                           (cursor.rowcount, job_id))
+        conn.commit()
+
+        try:
+            while True:
+                cursor.execute('SELECT status FROM broadcast_jobs WHERE id = ?', (job_id,))
+                if self._is_cancelled(job_id) or cursor.fetchone()[0] != RUNNING:
+                    break
+
+                page = self._next_page(job_id, target, after_user_id)
+                if not page:
+                    cursor.execute('''
+                        UPDATE broadcast_jobs SET status = ?, finished_at = CURRENT_TIMESTAMP
+                        WHERE id = ? AND status = ?
+                    ''', (COMPLETED, job_id, RUNNING))
+                    conn.commit()
+                    logger.info(f"Broadcast {job_id} completed")
+                    break
+
+                cursor.executemany('''
+                    INSERT OR IGNORE INTO broadcast_recipients (job_id, user_id) VALUES (?, ?)
+                ''', ((job_id, user_id) for user_id in page))
+                cursor.execute(f'''
+                    SELECT user_id FROM broadcast_recipients
+                    WHERE job_id = ? AND status = ? AND user_id IN ({','.join('?' * len(page))})
+                    ORDER BY user_id
+                ''', (job_id, PENDING, *page))
+                pending = [row[0] for row in cursor.fetchall()]
+                conn.commit()
+
+                for user_id in pending:
+                    if self._is_cancelled(job_id):
+                        break
+                    self._deliver(cursor, job_id, user_id, message)
+                    conn.commit()
+                    if self.send_interval:
+                        time.sleep(self.send_interval)
+                else:
+                    # Checkpoint: the whole page has been handled
+                    after_user_id = page[-1]
+                    cursor.execute('''
+                        UPDATE broadcast_jobs SET cursor_user_id = ?, heartbeat_at = ? WHERE id = ?
+                    ''', (after_user_id, time.time(), job_id))
+                    conn.commit()
+        finally:
+            conn.close()
+        return self.get_progress(job_id)
+
+    def _deliver(self, cursor, job_id, user_id, message):
+        cursor.execute('''
+            UPDATE broadcast_recipients SET status = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE job_id = ? AND user_id = ?
+        ''', (SENDING, job_id, user_id))
+        cursor.connection.commit()
+
+        try:
+            delivered = bool(self.send(user_id, message))
+        except Exception as e:
+            logger.error(f"Broadcast {job_id} failed for user {user_id}: {e}")
+            delivered = False
+
+        cursor.execute('''
+            UPDATE broadcast_recipients SET status = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE job_id = ? AND user_id = ?
+        ''', (SENT if delivered else FAILED, job_id, user_id))
+        column = 'sent' if delivered else 'failed'
+        cursor.execute(f'UPDATE broadcast_jobs SET {column} = {column} + 1, heartbeat_at = ? WHERE id = ?',
+                       (time.time(), job_id))
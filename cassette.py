@@ -0,0 +1,115 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+MODES = ('off', 'record', 'replay')
+# What replay does with a request that is not on the cassette
+MISS_STRATEGIES = ('error', 'live', 'record')
+
+
+class CassetteMiss(Exception):
+    """Raised in replay mode for a request the cassette has no response for"""
+
+
+def request_key(data: dict) -> str:
+    """Hash of a completion request (model, messages, max_tokens, temperature)"""
+    return hashlib.sha256(json.dumps(data, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+class Cassette:
+    """Recorded AI completions, for load tests and regression runs without the API.
+
+    In record mode every completion is appended to a JSON-lines file as
+    request hash, content, token usage and latency. In replay mode those
+    responses are served without any network traffic, after the recorded
+    latency times latency_scale (0 answers at once). A request that is not on
+    the cassette is handled per on_miss: 'error' raises CassetteMiss, 'live'
+    sends it to the API, 'record' sends it and adds the answer.
+    """
+
+    def __init__(self, path: str = None, mode: str = None, latency_scale: float = None, on_miss: str = None):
+        self.path = path or os.getenv('AI_CASSETTE_PATH', 'ai_cassette.jsonl')
+        self.mode = (mode or os.getenv('AI_CASSETTE_MODE', 'off')).lower()
+        self.latency_scale = float(latency_scale if latency_scale is not None
+                                   else os.getenv('AI_CASSETTE_LATENCY_SCALE', '1'))
+        self.on_miss = (on_miss or os.getenv('AI_CASSETTE_ON_MISS', 'error')).lower()
+        if self.mode not in MODES:
+            raise ValueError(f"AI_CASSETTE_MODE must be one of {', '.join(MODES)}, not {self.mode!r}")
+        if self.on_miss not in MISS_STRATEGIES:
+            raise ValueError(f"AI_CASSETTE_ON_MISS must be one of {', '.join(MISS_STRATEGIES)}, not {self.on_miss!r}")
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.stats = {'recorded': 0, 'replayed': 0, 'misses': 0}
+        if self.mode != 'off':
+            self._load()
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != 'off'
+
+    @property
+    def needs_network(self) -> bool:
+        """Whether completions may still go to the API"""
+        return self.mode != 'replay' or self.on_miss != 'error'
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            if self.mode == 'replay':
+                logger.warning(f"Cassette {self.path} does not exist; every request will miss")
+            return
+        with open(self.path, encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A run killed mid-write leaves a partial last line
+                    logger.warning(f"Skipping unreadable line {line_number} of cassette {self.path}")
+                    continue
+                # Re-recorded requests append; the newest answer wins
+                self._entries[entry['key']] = entry
+        logger.info(f"Cassette {self.path} loaded ({len(self._entries)} responses, mode {self.mode})")
+
+    def play(self, data: dict) -> Optional[dict]:
+        """The recorded entry for a request, after its simulated latency.
+
+        Returns None when the request should go to the API instead (not
+        replaying, or a miss with on_miss 'live'/'record').
+        """
+        if self.mode != 'replay':
+            return None
+        with self._lock:
+            entry = self._entries.get(request_key(data))
+            self.stats['replayed' if entry else 'misses'] += 1
+        if entry is None:
+            if self.on_miss == 'error':
+                raise CassetteMiss(f"no recorded response for {data.get('model')} request")
+            return None
+        delay = entry.get('latency', 0) * self.latency_scale
+        if delay > 0:
+            time.sleep(delay)
+        return entry
+
+    def record(self, data: dict, content: str, usage: Optional[dict], latency: float):
+        """Add a live completion, if this mode keeps them"""
+        if self.mode != 'record' and not (self.mode == 'replay' and self.on_miss == 'record'):
+            return
+        entry = {'key': request_key(data), 'model': data.get('model'), 'content': content,
+                 'usage': usage or {}, 'latency': round(latency, 3)}
+        line = json.dumps(entry, ensure_ascii=False)
+        with self._lock:
+            self._entries[entry['key']] = entry
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+            self.stats['recorded'] += 1
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return dict(self.stats, mode=self.mode, entries=len(self._entries))
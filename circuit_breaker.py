@@ -0,0 +1,80 @@
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker.
+
+    closed    -> requests flow; `failure_threshold` failures in a row open it
+    open      -> requests are refused immediately until `reset_timeout` passes
+    half_open -> a single probe request is let through; success closes the
+                 circuit, failure re-opens it for another `reset_timeout`
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        self.stats = {'opened': 0, 'short_circuited': 0, 'probes': 0}
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def allow_request(self) -> bool:
+        """Return True if the caller may go to the remote service"""
+        if self._state == self.CLOSED:
+            return True
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._state = self.HALF_OPEN
+                self._probe_in_flight = False
+                logger.info(f"Circuit '{self.name}' half-open, probing for recovery")
+            if self._state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                self.stats['probes'] += 1
+                return True
+            if self._state == self.CLOSED:
+                return True
+            self.stats['short_circuited'] += 1
+            return False
+
+    def record_success(self):
+        if self._state == self.CLOSED and self._failures == 0:
+            return
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info(f"Circuit '{self.name}' closed")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or (
+                    self._state == self.CLOSED and self._failures >= self.failure_threshold):
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+                self.stats['opened'] += 1
+                logger.warning(f"Circuit '{self.name}' opened after {self._failures} consecutive failures")
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats['state'] = self._state
+            stats['consecutive_failures'] = self._failures
+        return stats
@@ -1,24 +1,101 @@
 import sqlite3
 import json
+import heapq
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import logging
+import os
+from nutrition import batch_targets
+from reminder_times import EVERY_DAY, days_mask, minute_of_day
+from rows import AchievementRow, ProgressRow, ReminderRow, UserRow, row_factory
+from storage import StorageBackend, USER_TABLES, backend_from_env
+from user_cache import UserProfileCache
 
 logger = logging.getLogger(__name__)
 
+# Bump whenever init_database creates or alters anything, so existing
+# databases pick up the change on the next start.
+SCHEMA_VERSION = 13
+
+# Per-user tables included in a history export, in export order
+EXPORT_TABLES = ('users', 'progress', 'workout_plans', 'diet_plans', 'achievements', 'reminders')
+
+# SQLite's default limit on host parameters is 999
+MAX_QUERY_PARAMS = 900
+
 
 class DatabaseManager:
-    def __init__(self, db_name='fitness_bot.db'):
+    def __init__(self, db_name='fitness_bot.db', backend: StorageBackend = None):
         self.db_name = db_name
+        self.backend = backend or backend_from_env(db_name)
+        self._progress_listeners = []
+        self.user_cache = UserProfileCache(self.backend, int(os.getenv('USER_CACHE_SIZE', '5000')))
+        self._fan_out_executor = None
+        if self.backend.shard_count > 1:
+            self._fan_out_executor = ThreadPoolExecutor(max_workers=self.backend.shard_count,
+                                                        thread_name_prefix='db-fan-out')
         self.init_database()
 
-    def get_connection(self):
-        return sqlite3.connect(self.db_name, check_same_thread=False)
+    def get_connection(self, user_id=None):
+        """Connection to the shard holding user_id's rows, or to shard 0 (global tables)"""
+        return self.backend.connect(0 if user_id is None else self.backend.shard_for(user_id))
+
+    def fan_out(self, query):
+        """Run query(conn) on every shard, in parallel when there are several.
+
+        Returns the results in shard order; each connection is closed afterwards.
+        """
+        def run(shard):
+            conn = self.backend.connect(shard)
+            try:
+                return query(conn)
+            finally:
+                conn.close()
+
+        if self._fan_out_executor is None:
+            return [run(shard) for shard in self.backend.shards()]
+        return list(self._fan_out_executor.map(run, self.backend.shards()))
+
+    def scan(self, cls, query, params=(), batch_size=1000):
+        """Lazily yield cls rows (tuples if cls is None) for query from every shard in turn.
+
+        Rows are fetched in batches, so memory use does not grow with the
+        size of the scan. Each shard's connection stays open until its rows
+        have been consumed.
+        """
+        for shard in self.backend.shards():
+            conn = self.backend.connect(shard)
+            try:
+                if cls is not None:
+                    conn.row_factory = row_factory(cls)
+                cursor = conn.execute(query, params)
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield from rows
+            finally:
+                conn.close()
 
     def init_database(self):
-        """Initialize database with all required tables"""
-        conn = self.get_connection()
+        """Initialize every shard with all required tables.
+
+        An up-to-date database costs a single PRAGMA user_version read per shard.
+        """
+        for shard in self.backend.shards():
+            conn = self.backend.connect(shard)
+            try:
+                self._init_shard(conn)
+            finally:
+                conn.close()
+
+    def _init_shard(self, conn):
         cursor = conn.cursor()
 
+        cursor.execute('PRAGMA user_version')
+        if cursor.fetchone()[0] >= SCHEMA_VERSION:
+            return
+
         # Users table with comprehensive profile data
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS users (
@@ -126,52 +203,323 @@ class DatabaseManager:
             )
         ''')
 
+        # Durable background jobs (see job_queue.py); times are unix epochs
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_type TEXT NOT NULL,
+                user_id INTEGER,
+                chat_id INTEGER,
+                payload TEXT,
+                status TEXT DEFAULT 'queued',
+                attempts INTEGER DEFAULT 0,
+                max_attempts INTEGER DEFAULT 3,
+                run_after REAL,
+                lease_owner TEXT,
+                lease_expires REAL,
+                last_error TEXT,
+                created_at REAL,
+                updated_at REAL
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status_run_after ON jobs (status, run_after)')
+
+        # Incremental achievement state: running counters and a bitmask of
+        # awarded achievements (see achievement_engine.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS achievement_state (
+                user_id INTEGER PRIMARY KEY,
+                awarded_mask INTEGER DEFAULT 0,
+                total_workouts INTEGER DEFAULT 0,
+                first_weight REAL,
+                last_weight REAL,
+                registered_at TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (user_id)
+            )
+        ''')
+
+        # Workout streaks, maintained incrementally by log_progress
+        self._add_column_if_missing(cursor, 'users', 'current_streak', 'INTEGER DEFAULT 0')
+        self._add_column_if_missing(cursor, 'users', 'longest_streak', 'INTEGER DEFAULT 0')
+        self._add_column_if_missing(cursor, 'users', 'last_workout_date', 'TEXT')
+
+        # Opt-in weekly leaderboard (see leaderboard.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS leaderboard_members (
+                user_id INTEGER PRIMARY KEY,
+                joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (user_id)
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS leaderboard_scores (
+                week TEXT,
+                user_id INTEGER,
+                workouts INTEGER DEFAULT 0,
+                PRIMARY KEY (week, user_id)
+            )
+        ''')
+
+        # Exercise catalog: unique names for bulk upserts and an FTS5 index
+        # for /exercise search (see exercise_catalog.py)
+        cursor.execute('''
+            DELETE FROM exercises WHERE id NOT IN (
+                SELECT MIN(id) FROM exercises GROUP BY name COLLATE NOCASE
+            )
+        ''')
+        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_exercises_name ON exercises (name COLLATE NOCASE)')
+        try:
+            cursor.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS exercises_fts USING fts5(
+                    name, muscle_groups, instructions,
+                    content='exercises', content_rowid='id', tokenize='porter unicode61'
+                )
+            ''')
+            cursor.executescript('''
+                CREATE TRIGGER IF NOT EXISTS exercises_fts_insert AFTER INSERT ON exercises BEGIN
+                    INSERT INTO exercises_fts (rowid, name, muscle_groups, instructions)
+                    VALUES (new.id, new.name, new.muscle_groups, new.instructions);
+                END;
+                CREATE TRIGGER IF NOT EXISTS exercises_fts_delete AFTER DELETE ON exercises BEGIN
+                    INSERT INTO exercises_fts (exercises_fts, rowid, name, muscle_groups, instructions)
+                    VALUES ('delete', old.id, old.name, old.muscle_groups, old.instructions);
+                END;
+                CREATE TRIGGER IF NOT EXISTS exercises_fts_update AFTER UPDATE ON exercises BEGIN
+                    INSERT INTO exercises_fts (exercises_fts, rowid, name, muscle_groups, instructions)
+                    VALUES ('delete', old.id, old.name, old.muscle_groups, old.instructions);
+                    INSERT INTO exercises_fts (rowid, name, muscle_groups, instructions)
+                    VALUES (new.id, new.name, new.muscle_groups, new.instructions);
+                END;
+            ''')
+            cursor.execute("INSERT INTO exercises_fts (exercises_fts) VALUES ('rebuild')")
+        except sqlite3.OperationalError as e:
+            logger.warning(f"FTS5 unavailable, exercise search will use LIKE matching: {e}")
+
+        # Resumable broadcasts (see broadcast_service.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS broadcast_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                message TEXT NOT NULL,
+                target TEXT DEFAULT 'active',
+                status TEXT DEFAULT 'running',
+                cursor_user_id INTEGER DEFAULT 0,
+                sent INTEGER DEFAULT 0,
+                failed INTEGER DEFAULT 0,
+                skipped INTEGER DEFAULT 0,
+                heartbeat_at REAL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                finished_at TIMESTAMP
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS broadcast_recipients (
+                job_id INTEGER,
+                user_id INTEGER,
+                status TEXT DEFAULT 'pending',
+                error TEXT,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (job_id, user_id),
+                FOREIGN KEY (job_id) REFERENCES broadcast_jobs (id)
+            )
+        ''')
+
+        # IANA timezone name for reminders; NULL means the server default
+        self._add_column_if_missing(cursor, 'users', 'timezone', 'TEXT')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_timezone ON users (timezone)')
+
+        # Every change to a user row, from any process, for profile cache
+        # invalidation (see user_cache.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS user_changes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.executescript('''
+            CREATE TRIGGER IF NOT EXISTS users_changes_insert AFTER INSERT ON users BEGIN
+                INSERT INTO user_changes (user_id) VALUES (new.user_id);
+            END;
+            CREATE TRIGGER IF NOT EXISTS users_changes_update AFTER UPDATE ON users BEGIN
+                INSERT INTO user_changes (user_id) VALUES (old.user_id);
+            END;
+            CREATE TRIGGER IF NOT EXISTS users_changes_delete AFTER DELETE ON users BEGIN
+                INSERT INTO user_changes (user_id) VALUES (old.user_id);
+            END;
+        ''')
+
+        # Keyset pagination of progress history, newest first
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_progress_user_date ON progress (user_id, date, id)')
+
+        # Webhook update ids already accepted, for dropping re-deliveries
+        # (see update_dedup.py); received_at is a unix epoch
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS processed_updates (
+                update_id INTEGER PRIMARY KEY,
+                received_at REAL
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_processed_updates_received ON processed_updates (received_at)')
+
+        # Reminder targeting: local minute of day and weekday bitmask
+        # (reminder_times.py), filled from reminder_time / reminder_days
+        self._add_column_if_missing(cursor, 'reminders', 'minute_of_day', 'INTEGER')
+        self._add_column_if_missing(cursor, 'reminders', 'days_mask', f'INTEGER DEFAULT {EVERY_DAY}')
+        cursor.execute('SELECT id, reminder_time, reminder_days FROM reminders WHERE minute_of_day IS NULL')
+        cursor.executemany('UPDATE reminders SET minute_of_day = ?, days_mask = ? WHERE id = ?',
+                           [(minute_of_day(reminder_time), days_mask(reminder_days), reminder_id)
+                            for reminder_id, reminder_time, reminder_days in cursor.fetchall()])
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_reminders_target
+            ON reminders (is_active, reminder_type, minute_of_day, user_id)
+        ''')
+
+        # Daily macro targets (g) next to calories_target (see nutrition.py)
+        for column in ('protein_target', 'carbs_target', 'fat_target'):
+            self._add_column_if_missing(cursor, 'diet_plans', column, 'INTEGER')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_diet_plans_active ON diet_plans (is_active, id)')
+
+        # AI explanations for exercises missing from the catalog, per query and
+        # fitness level; kept out of the curated catalog and its FTS index
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS exercise_explanations (
+                query TEXT NOT NULL,
+                fitness_level TEXT NOT NULL,
+                name TEXT,
+                instructions TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (query, fitness_level)
+            )
+        ''')
+        # Earlier versions stored them in the catalog, written for one user's level
+        cursor.execute("DELETE FROM exercises WHERE category = 'ai_generated'")
+
+        cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
         conn.commit()
-        conn.close()
         logger.info("Database initialized successfully")
 
+    @staticmethod
+    def _add_column_if_missing(cursor, table, column, definition):
+        cursor.execute(f'PRAGMA table_info({table})')
+        if column not in [row[1] for row in cursor.fetchall()]:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
     def save_user(self, user_data: dict):
         """Save or update user profile"""
         logger.info(f"Saving user data: {user_data}")
-        conn = self.get_connection()
+        conn = self.get_connection(user_data['user_id'])
         cursor = conn.cursor()
 
+        # Upsert rather than REPLACE so columns maintained elsewhere (streaks,
+        # created_at) survive profile updates
         cursor.execute('''
-            INSERT OR REPLACE INTO users 
+            INSERT INTO users 
             (user_id, username, first_name, age, weight, height, gender, fitness_level, 
              goals, medical_conditions, dietary_restrictions, workout_days, workout_duration, updated_at)
             VALUES (:user_id, :username, :first_name, :age, :weight, :height, :gender, :fitness_level, 
                     :goals, :medical_conditions, :dietary_restrictions, :workout_days, :workout_duration, CURRENT_TIMESTAMP)
+            ON CONFLICT(user_id) DO UPDATE SET
+                username = excluded.username,
+                first_name = excluded.first_name,
+                age = excluded.age,
+                weight = excluded.weight,
+                height = excluded.height,
+                gender = excluded.gender,
+                fitness_level = excluded.fitness_level,
+                goals = excluded.goals,
+                medical_conditions = excluded.medical_conditions,
+                dietary_restrictions = excluded.dietary_restrictions,
+                workout_days = excluded.workout_days,
+                workout_duration = excluded.workout_duration,
+                updated_at = CURRENT_TIMESTAMP
         ''', user_data)
 
         conn.commit()
         conn.close()
+        self.user_cache.invalidate(user_data['user_id'])
         logger.info(f"User {user_data['user_id']} profile saved/updated")
 
     def get_user(self, user_id):
         """Get user profile by ID"""
-        conn = self.get_connection()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-        user = cursor.fetchone()
-        conn.close()
-        if user:
-            return dict(user)
-        return None
+        return self.get_users([user_id]).get(user_id)
 
-    def get_all_users(self):
-        """Get all users from the database."""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM users')
-        users = cursor.fetchall()
-        conn.close()
+    def get_users(self, user_ids):
+        """Map user ids to profiles, from the profile cache or one query per shard.
+
+        Unknown ids are left out.
+        """
+        user_ids = list(dict.fromkeys(user_ids))
+        if not self.user_cache.enabled:
+            return self._load_users(user_ids)
+        users, missing, generation = self.user_cache.lookup(user_ids)
+        if missing:
+            loaded = self._load_users(missing)
+            self.user_cache.store(loaded, generation)
+            users.update(loaded)
+        return users
+
+    def _load_users(self, user_ids):
+        by_shard = {}
+        for user_id in user_ids:
+            by_shard.setdefault(self.backend.shard_for(user_id), []).append(user_id)
+        users = {}
+        for shard, shard_ids in by_shard.items():
+            conn = self.backend.connect(shard)
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            for start in range(0, len(shard_ids), MAX_QUERY_PARAMS):
+                chunk = shard_ids[start:start + MAX_QUERY_PARAMS]
+                cursor.execute(f'SELECT * FROM users WHERE user_id IN ({",".join("?" * len(chunk))})', chunk)
+                users.update((row['user_id'], dict(row)) for row in cursor.fetchall())
+            conn.close()
         return users
 
+    def get_user_cache_stats(self):
+        """Profile cache hits, misses, invalidations and hit ratio"""
+        return self.user_cache.get_stats()
+
+    def get_all_users(self):
+        """Yield every user as a UserRow"""
+        return self.scan(UserRow, f'SELECT {UserRow.columns()} FROM users')
+
+    def get_active_user_ids_page(self, after_user_id=0, limit=500, days=30):
+        """One keyset page of users active in the last `days` days, by user_id.
+
+        Each shard returns its own first page; the sorted pages are merged.
+        """
+        def query(conn):
+            return [row[0] for row in conn.execute('''
+                SELECT u.user_id FROM users u
+                WHERE u.user_id > ?
+                  AND (u.created_at > datetime('now', ?)
+                       OR EXISTS (SELECT 1 FROM progress p
+                                  WHERE p.user_id = u.user_id AND p.date > datetime('now', ?)))
+                ORDER BY u.user_id
+                LIMIT ?
+            ''', (after_user_id, f'-{days} days', f'-{days} days', limit))]
+
+        return list(heapq.merge(*self.fan_out(query)))[:limit]
+
+    def get_display_names(self, user_ids):
+        """Map user ids to first names, one query per shard"""
+        by_shard = {}
+        for user_id in user_ids:
+            by_shard.setdefault(self.backend.shard_for(user_id), []).append(user_id)
+        names = {}
+        for shard, shard_ids in by_shard.items():
+            conn = self.backend.connect(shard)
+            cursor = conn.cursor()
+            placeholders = ','.join('?' * len(shard_ids))
+            cursor.execute(f'SELECT user_id, first_name, username FROM users WHERE user_id IN ({placeholders})',
+                           shard_ids)
+            names.update((user_id, first_name or username or 'Athlete')
+                         for user_id, first_name, username in cursor.fetchall())
+            conn.close()
+        return names
+
     def save_workout_plan(self, user_id, plan_data, plan_type="general"):
         """Save workout plan for user"""
-        conn = self.get_connection()
+        conn = self.get_connection(user_id)
         cursor = conn.cursor()
 
         # Deactivate previous plans
@@ -189,7 +537,7 @@ class DatabaseManager:
 
     def get_active_workout_plan(self, user_id):
         """Get current active workout plan"""
-        conn = self.get_connection()
+        conn = self.get_connection(user_id)
         cursor = conn.cursor()
         cursor.execute('''
             SELECT plan_data FROM workout_plans 
@@ -203,9 +551,10 @@ class DatabaseManager:
             return json.loads(result[0])
         return None
 
-    def save_diet_plan(self, user_id, plan_data, calories_target=None):
-        """Save diet plan for user"""
-        conn = self.get_connection()
+    def save_diet_plan(self, user_id, plan_data, calories_target=None, protein_target=None,
+                       carbs_target=None, fat_target=None):
+        """Save diet plan for user, with its daily targets (nutrition.daily_targets)"""
+        conn = self.get_connection(user_id)
         cursor = conn.cursor()
 
         # Deactivate previous plans
@@ -213,9 +562,10 @@ class DatabaseManager:
 
         # Insert new plan
         cursor.execute('''
-            INSERT INTO diet_plans (user_id, plan_data, calories_target, is_active) 
-            VALUES (?, ?, ?, 1)
-        ''', (user_id, json.dumps(plan_data), calories_target))
+            INSERT INTO diet_plans (user_id, plan_data, calories_target, protein_target, carbs_target,
+                                    fat_target, is_active)
+            VALUES (?, ?, ?, ?, ?, ?, 1)
+        ''', (user_id, json.dumps(plan_data), calories_target, protein_target, carbs_target, fat_target))
 
         conn.commit()
         conn.close()
@@ -223,7 +573,7 @@ class DatabaseManager:
 
     def get_active_diet_plan(self, user_id):
         """Get current active diet plan"""
-        conn = self.get_connection()
+        conn = self.get_connection(user_id)
         cursor = conn.cursor()
         cursor.execute('''
             SELECT plan_data FROM diet_plans 
@@ -237,11 +587,79 @@ class DatabaseManager:
             return json.loads(result[0])
         return None
 
+    def get_nutrition_targets(self, user_id):
+        """Targets stored with the active diet plan, or None"""
+        conn = self.get_connection(user_id)
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT calories_target, protein_target, carbs_target, fat_target FROM diet_plans
+            WHERE user_id = ? AND is_active = 1
+            ORDER BY created_at DESC LIMIT 1
+        ''', (user_id,))
+        result = cursor.fetchone()
+        conn.close()
+
+        if result and result[0] is not None:
+            return dict(zip(('calories_target', 'protein_target', 'carbs_target', 'fat_target'), result))
+        return None
+
+    def recompute_nutrition_targets(self, batch_size=5000):
+        """Bring the targets of every active diet plan in line with its user's current profile.
+
+        Plans are read in id order, batch_size at a time, and each batch is
+        computed at once (nutrition.batch_targets). Only plans whose targets
+        changed, say after a weight update, are written. Returns that number.
+        """
+        updated = sum(self.fan_out(lambda conn: self._recompute_shard_targets(conn, batch_size)))
+        logger.info(f"Recomputed nutrition targets: {updated} diet plans updated")
+        return updated
+
+    @staticmethod
+    def _recompute_shard_targets(conn, batch_size):
+        cursor = conn.cursor()
+        updated = 0
+        last_id = 0
+        while True:
+            cursor.execute('''
+                SELECT d.id, u.age, u.weight, u.height, u.gender, u.workout_days, u.goals,
+                       d.calories_target, d.protein_target, d.carbs_target, d.fat_target
+                FROM diet_plans d JOIN users u ON u.user_id = d.user_id
+                WHERE d.is_active = 1 AND d.id > ?
+                ORDER BY d.id LIMIT ?
+            ''', (last_id, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+
+            plan_ids, ages, weights, heights, genders, workout_days, goals, *stored = zip(*rows)
+            targets = batch_targets(ages, weights, heights, genders, workout_days, goals)
+            changes = [(*target, plan_id) for plan_id, target, current in zip(plan_ids, targets, zip(*stored))
+                       if target != current]
+            cursor.executemany('''
+                UPDATE diet_plans SET calories_target = ?, protein_target = ?, carbs_target = ?, fat_target = ?
+                WHERE id = ?
+            ''', changes)
+            conn.commit()
+            updated += len(changes)
+        return updated
+
+    def add_progress_listener(self, listener):
+        """Register a callable invoked with an event dict after each log_progress"""
+        self._progress_listeners.append(listener)
+
+    def _notify_progress(self, event):
+        for listener in self._progress_listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                logger.error(f"Progress listener error for user {event['user_id']}: {e}")
+
     def log_progress(self, user_id, weight=None, workout_completed=False,
                      exercises_completed=0, duration_minutes=0, calories_burned=0,
                      notes=None, mood_rating=None):
         """Log user progress"""
-        conn = self.get_connection()
+        conn = self.get_connection(user_id)
         cursor = conn.cursor()
 
         cursor.execute('''
@@ -251,59 +669,314 @@ class DatabaseManager:
             VALUES (?, ?, ?, ?, ?, ?, ?, ?)
         ''', (user_id, weight, workout_completed, exercises_completed,
               duration_minutes, calories_burned, notes, mood_rating))
+        progress_id = cursor.lastrowid
+
+        current_streak = longest_streak = None
+        if workout_completed:
+            # O(1) streak update: same day keeps the streak, the day after
+            # extends it, anything later restarts it
+            cursor.execute('''
+                UPDATE users SET
+                    current_streak = CASE
+                        WHEN last_workout_date = date('now') THEN COALESCE(current_streak, 1)
+                        WHEN last_workout_date = date('now', '-1 day') THEN COALESCE(current_streak, 0) + 1
+                        ELSE 1 END,
+                    longest_streak = MAX(COALESCE(longest_streak, 0), CASE
+                        WHEN last_workout_date = date('now') THEN COALESCE(current_streak, 1)
+                        WHEN last_workout_date = date('now', '-1 day') THEN COALESCE(current_streak, 0) + 1
+                        ELSE 1 END),
+                    last_workout_date = date('now')
+                WHERE user_id = ?
+            ''', (user_id,))
+            cursor.execute('SELECT current_streak, longest_streak FROM users WHERE user_id = ?', (user_id,))
+            streaks = cursor.fetchone()
+            if streaks:
+                current_streak, longest_streak = streaks
 
         conn.commit()
         conn.close()
         logger.info(f"Progress logged for user {user_id}")
 
+        self._notify_progress({
+            'user_id': user_id,
+            'progress_id': progress_id,
+            'weight': weight,
+            'workout_completed': bool(workout_completed),
+            'duration_minutes': duration_minutes,
+            'calories_burned': calories_burned,
+            'current_streak': current_streak,
+            'longest_streak': longest_streak
+        })
+        return progress_id
+
+    def get_streaks(self, user_id):
+        """Get current and longest workout streaks (days).
+
+        The stored current streak only changes when a workout is logged, so it
+        counts as broken once a full day has passed without one.
+        """
+        conn = self.get_connection(user_id)
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT CASE WHEN last_workout_date >= date('now', '-1 day') THEN current_streak ELSE 0 END,
+                   longest_streak
+            FROM users WHERE user_id = ?
+        ''', (user_id,))
+        result = cursor.fetchone()
+        conn.close()
+
+        if result:
+            return {'current_streak': result[0] or 0, 'longest_streak': result[1] or 0}
+        return {'current_streak': 0, 'longest_streak': 0}
+
+    def set_user_timezone(self, user_id, timezone_name):
+        conn = self.get_connection(user_id)
+        conn.execute('UPDATE users SET timezone = ? WHERE user_id = ?', (timezone_name, user_id))
+        conn.commit()
+        conn.close()
+
+    def get_user_timezones(self):
+        """Distinct timezone names in use (None for users on the server default)"""
+        shard_timezones = self.fan_out(
+            lambda conn: [row[0] for row in conn.execute('SELECT DISTINCT timezone FROM users')])
+        return list(dict.fromkeys(name for names in shard_timezones for name in names))
+
+    @staticmethod
+    def _timezone_slot_filter(timezones, include_default, spread, slot, users='users', active_days=None):
+        """WHERE clause and params selecting users in the timezones whose jitter slot equals `slot`.
+
+        `slot` is SQL (a '?' placeholder or an expression) whose parameters
+        the caller appends. None if no timezone can match. The jitter slot is
+        a fixed hash of the user id, so each user lands in the same minute of
+        a reminder window every day. With active_days, only users who
+        registered or logged progress in that many days are selected.
+        """
+        conditions = []
+        if timezones:
+            conditions.append(f"{users}.timezone IN ({','.join('?' * len(timezones))})")
+        if include_default:
+            conditions.append(f'{users}.timezone IS NULL')
+        if not conditions:
+            return None
+        sql = f"({' OR '.join(conditions)})"
+        params = tuple(timezones)
+        if active_days is not None:
+            sql += f'''
+              AND ({users}.created_at > datetime('now', ?)
+                   OR EXISTS (SELECT 1 FROM progress p
+                              WHERE p.user_id = {users}.user_id AND p.date > datetime('now', ?)))'''
+            params += (f'-{active_days} days', f'-{active_days} days')
+        sql += f'''
+              AND ((abs({users}.user_id) % 2147483648) * 1103515245 + 12345) % 2147483648 / 65536 % ? = {slot}'''
+        return sql, (*params, spread)
+
+    def get_user_ids_in_timezones(self, timezones, include_default=False, spread=1, slot=0, active_days=None):
+        """Users in the given timezones whose jitter slot (0..spread-1) is `slot`.
+
+        With active_days, only users who registered or logged progress in that many days.
+        """
+        where = self._timezone_slot_filter(timezones, include_default, spread, '?', active_days=active_days)
+        if where is None:
+            return []
+        sql = f'SELECT user_id FROM users WHERE {where[0]}'
+        shard_ids = self.fan_out(lambda conn: [row[0] for row in conn.execute(sql, (*where[1], slot))])
+        return [user_id for user_ids in shard_ids for user_id in user_ids]
+
+    def iter_due_reminders(self, reminder_type, local, timezones, include_default=False, spread=1):
+        """Yield ids of users whose active reminder_type reminder is due at local time `local`.
+
+        A reminder set for minute m of the day goes out at m plus the user's
+        jitter slot (0..spread-1, see get_user_ids_in_timezones), on the
+        weekdays in its days_mask. Only users in the given timezones are
+        included. Seeks idx_reminders_target for the last `spread` minutes and
+        streams the ids shard by shard.
+        """
+        where = self._timezone_slot_filter(timezones, include_default, spread,
+                                           '(? - r.minute_of_day + 1440) % 1440', users='u')
+        if where is None:
+            return
+        minute = local.hour * 60 + local.minute
+        window = [(minute - offset) % 1440 for offset in range(min(spread, 1440))]
+        # A window crossing midnight holds reminders set for yesterday
+        today, yesterday = 1 << local.weekday(), 1 << (local.weekday() - 1) % 7
+        sql = f'''
+            SELECT DISTINCT r.user_id FROM reminders r
+            JOIN users u ON u.user_id = r.user_id
+            WHERE r.is_active = 1 AND r.reminder_type = ?
+              AND r.minute_of_day IN ({','.join('?' * len(window))})
+              AND r.days_mask & (CASE WHEN r.minute_of_day <= ? THEN ? ELSE ? END) != 0
+              AND {where[0]}
+        '''
+        params = (reminder_type, *window, minute, today, yesterday, *where[1], minute)
+        for (user_id,) in self.scan(None, sql, params):
+            yield user_id
+
+    def has_active_reminders(self, reminder_type, minute=None):
+        """Whether any user has an active reminder of this type (at this minute of day, if given)"""
+        sql = 'SELECT 1 FROM reminders WHERE is_active = 1 AND reminder_type = ?'
+        params = (reminder_type,)
+        if minute is not None:
+            sql += ' AND minute_of_day = ?'
+            params += (minute,)
+        return any(self.fan_out(lambda conn: conn.execute(sql + ' LIMIT 1', params).fetchone() is not None))
+
+    def backfill_streaks(self):
+        """Recompute streaks for every user from progress history in one ordered pass per shard"""
+        updated = sum(self.fan_out(self._backfill_shard_streaks))
+        logger.info(f"Backfilled streaks for {updated} users")
+        return updated
+
+    @staticmethod
+    def _backfill_shard_streaks(conn):
+        read_cursor = conn.cursor()
+        read_cursor.execute('''
+            SELECT user_id, date(date) AS day FROM progress
+            WHERE workout_completed = 1
+            GROUP BY user_id, day
+            ORDER BY user_id, day
+        ''')
+        updates = []
+
+        def finish(user_id, current, longest, last_day):
+            updates.append((current, longest, last_day.isoformat(), user_id))
+
+        user_id = current = longest = last_day = None
+        for row_user_id, day_text in read_cursor:
+            day = datetime.strptime(day_text, '%Y-%m-%d').date()
+            if row_user_id != user_id:
+                if user_id is not None:
+                    finish(user_id, current, longest, last_day)
+                user_id, current, longest = row_user_id, 1, 1
+            elif (day - last_day).days == 1:
+                current += 1
+                longest = max(longest, current)
+            else:
+                current = 1
+            last_day = day
+        if user_id is not None:
+            finish(user_id, current, longest, last_day)
+
+        cursor = conn.cursor()
+        cursor.execute('UPDATE users SET current_streak = 0, longest_streak = 0, last_workout_date = NULL')
+        cursor.executemany('''
+            UPDATE users SET current_streak = ?, longest_streak = ?, last_workout_date = ?
+            WHERE user_id = ?
+        ''', updates)
+        conn.commit()
+        return len(updates)
+
     def get_progress_history(self, user_id, limit=10):
         """Get user progress history"""
-        conn = self.get_connection()
-        conn.row_factory = sqlite3.Row
+        return self.get_progress_page(user_id, limit=limit)[0]
+
+    def get_progress_page(self, user_id, before=None, limit=10):
+        """One page of progress, newest first, and the cursor for the next (older) page.
+
+        `before` is a (date, id) cursor from a previous page; the next cursor
+        is None on the last page. Seeks on idx_progress_user_date, so a page
+        far back costs the same as the first.
+        """
+        conn = self.get_connection(user_id)
+        conn.row_factory = row_factory(ProgressRow)
         cursor = conn.cursor()
-        cursor.execute('''
-            SELECT * FROM progress 
-            WHERE user_id = ? 
-            ORDER BY date DESC 
-            LIMIT ?
-        ''', (user_id, limit))
+        if before is None:
+            cursor.execute(f'''
+                SELECT {ProgressRow.columns()} FROM progress
+                WHERE user_id = ?
+                ORDER BY date DESC, id DESC
+                LIMIT ?
+            ''', (user_id, limit + 1))
+        else:
+            cursor.execute(f'''
+                SELECT {ProgressRow.columns()} FROM progress
+                WHERE user_id = ? AND (date, id) < (?, ?)
+                ORDER BY date DESC, id DESC
+                LIMIT ?
+            ''', (user_id, before[0], before[1], limit + 1))
 
         progress = cursor.fetchall()
         conn.close()
-        return progress
+        if len(progress) <= limit:
+            return progress, None
+        progress = progress[:limit]
+        return progress, (progress[-1].date, progress[-1].id)
+
+    def get_last_progress_id(self, user_id):
+        """Id of the user's newest progress row (None if there is none)"""
+        conn = self.get_connection(user_id)
+        cursor = conn.cursor()
+        cursor.execute('SELECT MAX(id) FROM progress WHERE user_id = ?', (user_id,))
+        result = cursor.fetchone()[0]
+        conn.close()
+        return result
+
+    def iter_daily_progress(self, user_id):
+        """Yield (day, average weight, workouts completed) per day, oldest first"""
+        conn = self.get_connection(user_id)
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT date(date) AS day, AVG(weight), SUM(workout_completed = 1)
+                FROM progress
+                WHERE user_id = ?
+                GROUP BY day
+                ORDER BY day
+            ''', (user_id,))
+            for row in cursor:
+                yield row
+        finally:
+            conn.close()
+
+    def iter_user_table(self, table, user_id, batch_size=500):
+        """Stream one user's rows from an export table.
+
+        Yields the column names first, then each row as a tuple. Rows are
+        fetched in batches from the cursor, so memory use does not grow with
+        the number of rows.
+        """
+        if table not in EXPORT_TABLES:
+            raise ValueError(f"Table '{table}' cannot be exported")
+        conn = self.get_connection(user_id)
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f'SELECT * FROM {table} WHERE user_id = ? ORDER BY rowid', (user_id,))
+            yield [column[0] for column in cursor.description]
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            conn.close()
 
     def save_reminder(self, user_id, reminder_type, reminder_time,
                       reminder_days=None, message=None):
         """Save user reminder preferences"""
-        conn = self.get_connection()
+        conn = self.get_connection(user_id)
         cursor = conn.cursor()
 
         cursor.execute('''
-            INSERT INTO reminders 
-            (user_id, reminder_type, reminder_time, reminder_days, message)
-            VALUES (?, ?, ?, ?, ?)
+            INSERT INTO reminders
+            (user_id, reminder_type, reminder_time, reminder_days, message, minute_of_day, days_mask)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
         ''', (user_id, reminder_type, reminder_time,
-              json.dumps(reminder_days) if reminder_days else None, message))
+              json.dumps(reminder_days) if reminder_days else None, message,
+              minute_of_day(reminder_time), days_mask(reminder_days)))
 
         conn.commit()
         conn.close()
         logger.info(f"Reminder saved for user {user_id}")
 
     def get_active_reminders(self):
-        """Get all active reminders"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT * FROM reminders 
+        """Yield all active reminders as ReminderRows"""
+        return self.scan(ReminderRow, f'''
+            SELECT {ReminderRow.columns()} FROM reminders
             WHERE is_active = 1
         ''')
-        reminders = cursor.fetchall()
-        conn.close()
-        return reminders
 
     def add_achievement(self, user_id, achievement_type, title, description):
         """Add achievement for user"""
-        conn = self.get_connection()
+        conn = self.get_connection(user_id)
         cursor = conn.cursor()
 
         cursor.execute('''
@@ -317,11 +990,12 @@ class DatabaseManager:
 
     def get_user_achievements(self, user_id):
         """Get user achievements"""
-        conn = self.get_connection()
+        conn = self.get_connection(user_id)
+        conn.row_factory = row_factory(AchievementRow)
         cursor = conn.cursor()
-        cursor.execute('''
-            SELECT * FROM achievements 
-            WHERE user_id = ? 
+        cursor.execute(f'''
+            SELECT {AchievementRow.columns()} FROM achievements
+            WHERE user_id = ?
             ORDER BY achieved_at DESC
         ''', (user_id,))
 
@@ -331,7 +1005,7 @@ class DatabaseManager:
 
     def get_user_stats(self, user_id):
         """Get comprehensive user statistics"""
-        conn = self.get_connection()
+        conn = self.get_connection(user_id)
         cursor = conn.cursor()
 
         # Total workouts completed
@@ -393,17 +1067,69 @@ class DatabaseManager:
 
     def cleanup_old_data(self, days=90):
         """Clean up old progress data (optional maintenance)"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        def delete(conn):
+            cursor = conn.cursor()
+            cursor.execute('''
+                DELETE FROM progress 
+                WHERE date < datetime('now', '-{} days')
+            '''.format(days))
+            deleted = cursor.rowcount
+            # The change log only needs to outlive the profile caches' polling
+            cursor.execute("DELETE FROM user_changes WHERE changed_at < datetime('now', '-1 day')")
+            conn.commit()
+            return deleted
 
-        cursor.execute('''
-            DELETE FROM progress 
-            WHERE date < datetime('now', '-{} days')
-        '''.format(days))
-
-        deleted_rows = cursor.rowcount
-        conn.commit()
-        conn.close()
+        deleted_rows = sum(self.fan_out(delete))
 
         logger.info(f"Cleaned up {deleted_rows} old progress records")
-        return deleted_rows
\ No newline at end of file
+        return deleted_rows
+
+    def rebalance_shards(self, batch_size=1000):
+        """Move user rows that sit on the wrong shard to the right one.
+
+        Run after switching to the sharded backend or raising STORAGE_SHARDS:
+        shard 0 then still holds every user, and each row is copied to its
+        user's shard and deleted here. Returns the number of rows moved.
+
+        Each shard numbers AUTOINCREMENT ids on its own, so moved rows get new
+        ids on the target (in their original order). Rows keyed by user_id are
+        inserted as they are; a conflict raises rather than overwriting.
+        """
+        moved = 0
+        for source in self.backend.shards():
+            conn = self.backend.connect(source)
+            cursor = conn.cursor()
+            for table in USER_TABLES:
+                columns = [column[1] for column in cursor.execute(f'PRAGMA table_info({table})')]
+                has_id = 'id' in columns
+                if has_id:
+                    columns.remove('id')
+                select = f"SELECT {', '.join(columns)} FROM {table} WHERE user_id IN ({{}})"
+                if has_id:
+                    select += ' ORDER BY id'
+                insert = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({','.join('?' * len(columns))})"
+
+                cursor.execute(f'SELECT DISTINCT user_id FROM {table}')
+                targets = {}
+                for (user_id,) in cursor.fetchall():
+                    target = self.backend.shard_for(user_id)
+                    if target != source:
+                        targets.setdefault(target, []).append(user_id)
+                for target, user_ids in targets.items():
+                    target_conn = self.backend.connect(target)
+                    try:
+                        for start in range(0, len(user_ids), batch_size):
+                            batch = user_ids[start:start + batch_size]
+                            placeholders = ','.join('?' * len(batch))
+                            rows = cursor.execute(select.format(placeholders), batch).fetchall()
+                            if rows:
+                                target_conn.executemany(insert, rows)
+                                target_conn.commit()
+                            cursor.execute(f'DELETE FROM {table} WHERE user_id IN ({placeholders})', batch)
+                            conn.commit()
+                            moved += len(rows)
+                    finally:
+                        target_conn.close()
+            conn.close()
+        logger.info(f"Rebalanced {moved} rows across {self.backend.shard_count} shards")
+        return moved
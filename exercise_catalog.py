@@ -0,0 +1,224 @@
+import difflib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from database_manager import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CATALOG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'exercises.json')
+CATALOG_FIELDS = ('name', 'category', 'muscle_groups', 'equipment', 'difficulty_level', 'instructions')
+
+
+class ExerciseCatalog:
+    """Exercise lookups served from the local catalog before asking the AI.
+
+    Search order: exact name, FTS5 match on the name, then a close spelling
+    match. Explanations generated on a miss are stored per query and fitness
+    level in exercise_explanations, not in the catalog, so each unknown
+    exercise costs one AI call per level and never shows up in searches.
+    """
+
+    def __init__(self, db: DatabaseManager, cache_size: int = 256):
+        self.db = db
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._names = None
+        self._lock = threading.Lock()
+        self.stats = {'cache_hits': 0, 'catalog_hits': 0, 'explanation_hits': 0, 'misses': 0}
+        self.fts_enabled = self._has_fts()
+
+    def _has_fts(self):
+        conn = self.db.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'exercises_fts'")
+        enabled = cursor.fetchone() is not None
+        conn.close()
+        return enabled
+
+    def bulk_load(self, records):
+        """Insert or update catalog entries in one transaction; returns the count"""
+        rows = [tuple(record.get(field) for field in CATALOG_FIELDS) for record in records]
+        conn = self.db.get_connection()
+        cursor = conn.cursor()
+        cursor.executemany('''
+            INSERT INTO exercises (name, category, muscle_groups, equipment, difficulty_level, instructions)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(name COLLATE NOCASE) DO UPDATE SET
+                category = excluded.category,
+                muscle_groups = excluded.muscle_groups,
+                equipment = excluded.equipment,
+                difficulty_level = excluded.difficulty_level,
+                instructions = excluded.instructions
+        ''', rows)
+        conn.commit()
+        conn.close()
+        with self._lock:
+            self._cache.clear()
+            self._names = None
+        logger.info(f"Loaded {len(rows)} exercises into the catalog")
+        return len(rows)
+
+    def load_file(self, path=DEFAULT_CATALOG):
+        with open(path, encoding='utf-8') as catalog_file:
+            return self.bulk_load(json.load(catalog_file))
+
+    def ensure_seeded(self):
+        """Load the bundled catalog if the exercises table is empty"""
+        conn = self.db.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT 1 FROM exercises LIMIT 1')
+        empty = cursor.fetchone() is None
+        conn.close()
+        if empty and os.path.exists(DEFAULT_CATALOG):
+            self.load_file()
+
+    def _all_names(self):
+        with self._lock:
+            if self._names is None:
+                conn = self.db.get_connection()
+                cursor = conn.cursor()
+                cursor.execute('SELECT name FROM exercises')
+                self._names = [row[0] for row in cursor.fetchall()]
+                conn.close()
+            return self._names
+
+    @staticmethod
+    def _fts_query(text, column=None):
+        tokens = re.findall(r'\w+', text.lower())
+        if not tokens:
+            return None
+        prefix = f'{column}: ' if column else ''
+        joiner = ' AND ' if column else ' OR '
+        return prefix + '(' + joiner.join(f'"{token}"*' for token in tokens) + ')'
+
+    def _fetch(self, cursor, where, params):
+        cursor.execute(f'SELECT * FROM exercises WHERE {where} LIMIT 1', params)
+        row = cursor.fetchone()
+        return dict(row) if row else None
+
+    def find(self, query):
+        """Best catalog entry for the query, or None"""
+        conn = self.db.get_connection()
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        try:
+            exercise = self._fetch(cursor, 'name = ? COLLATE NOCASE', (query,))
+            if exercise:
+                return exercise
+
+            # 'kettle bell' should still find 'Kettlebell Swing'
+            compact = re.sub(r'\W+', '', query)
+            name_queries = [self._fts_query(query, 'name'), self._fts_query(compact, 'name')]
+            if self.fts_enabled and name_queries[0]:
+                for name_query in name_queries:
+                    cursor.execute('''
+                        SELECT e.* FROM exercises_fts f JOIN exercises e ON e.id = f.rowid
+                        WHERE exercises_fts MATCH ?
+                        ORDER BY bm25(exercises_fts, 10.0, 2.0, 1.0), length(e.name)
+                        LIMIT 1
+                    ''', (name_query,))
+                    row = cursor.fetchone()
+                    if row:
+                        return dict(row)
+            elif not self.fts_enabled:
+                exercise = self._fetch(cursor, 'name LIKE ?', (f'%{query}%',))
+                if exercise:
+                    return exercise
+
+            # Typos: closest catalog name by spelling
+            lowered = {name.lower(): name for name in self._all_names()}
+            close = difflib.get_close_matches(query.lower(), list(lowered), n=1, cutoff=0.75)
+            if close:
+                return self._fetch(cursor, 'name = ?', (lowered[close[0]],))
+            return None
+        finally:
+            conn.close()
+
+    def related(self, query, limit=5):
+        """Names of catalog entries matching any word of the query in any field"""
+        any_query = self._fts_query(query)
+        if not self.fts_enabled or not any_query:
+            return []
+        conn = self.db.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT e.name FROM exercises_fts f JOIN exercises e ON e.id = f.rowid
+            WHERE exercises_fts MATCH ?
+            ORDER BY bm25(exercises_fts, 10.0, 2.0, 1.0)
+            LIMIT ?
+        ''', (any_query, limit))
+        names = [row[0] for row in cursor.fetchall()]
+        conn.close()
+        return names
+
+    def _remember(self, key, exercise):
+        with self._lock:
+            self._cache[key] = exercise
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def lookup(self, query, explain, level='beginner'):
+        """Return (exercise dict, source) where source is 'cache', 'catalog' or 'ai'.
+
+        `explain(name)` is only called when neither the catalog nor a stored
+        explanation for this query and level has an answer; the answer is
+        stored for that query and level.
+        """
+        key = ' '.join(query.lower().split())
+        level = (level or 'beginner').lower()
+        # Catalog entries suit every level; AI answers are cached per level
+        ai_key = (key, level)
+        with self._lock:
+            for cache_key in (key, ai_key):
+                exercise = self._cache.get(cache_key)
+                if exercise:
+                    self._cache.move_to_end(cache_key)
+                    self.stats['cache_hits'] += 1
+                    return exercise, 'cache'
+
+        exercise = self.find(query)
+        if exercise:
+            with self._lock:
+                self.stats['catalog_hits'] += 1
+            self._remember(key, exercise)
+            return exercise, 'catalog'
+
+        exercise = self._stored_explanation(key, level)
+        if exercise:
+            with self._lock:
+                self.stats['explanation_hits'] += 1
+            self._remember(ai_key, exercise)
+            return exercise, 'ai'
+
+        with self._lock:
+            self.stats['misses'] += 1
+        name = query.strip().title()
+        exercise = {'name': name, 'category': 'ai_generated', 'instructions': explain(name)}
+        self._store(key, level, exercise)
+        self._remember(ai_key, exercise)
+        return exercise, 'ai'
+
+    def _stored_explanation(self, key, level):
+        conn = self.db.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT name, instructions FROM exercise_explanations WHERE query = ? AND fitness_level = ?',
+                       (key, level))
+        row = cursor.fetchone()
+        conn.close()
+        return {'name': row[0], 'category': 'ai_generated', 'instructions': row[1]} if row else None
+
+    def _store(self, key, level, exercise):
+        conn = self.db.get_connection()
+        conn.execute('''
+            INSERT INTO exercise_explanations (query, fitness_level, name, instructions) VALUES (?, ?, ?, ?)
+            ON CONFLICT(query, fitness_level) DO NOTHING
+        ''', (key, level, exercise['name'], exercise['instructions']))
+        conn.commit()
+        conn.close()
@@ -0,0 +1,106 @@
+import csv
+import gzip
+import io
+import json
+import logging
+import tempfile
+from datetime import datetime
+
+import telebot
+from database_manager import DatabaseManager, EXPORT_TABLES
+
+logger = logging.getLogger(__name__)
+
+HISTORY_EXPORT_JOB = 'history_export'
+EXPORT_FORMATS = ('csv', 'json')
+# A job type per format: the queue keeps one job of each type per user, so a
+# pending CSV export must not absorb a request for JSON
+EXPORT_JOB_TYPES = {'csv': HISTORY_EXPORT_JOB, 'json': f'{HISTORY_EXPORT_JOB}_json'}
+
+# Section names used in the export for each table
+SECTION_NAMES = {
+    'users': 'profile',
+    'progress': 'progress',
+    'workout_plans': 'workout_plans',
+    'diet_plans': 'diet_plans',
+    'achievements': 'achievements',
+    'reminders': 'reminders',
+}
+
+
+def iter_csv(db: DatabaseManager, user_id, chunk_size=64 * 1024):
+    """Yield the user's history as CSV text chunks.
+
+    Each table starts with a '# section,<name>' row followed by its header
+    row; sections are separated by an empty line.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for table in EXPORT_TABLES:
+        rows = db.iter_user_table(table, user_id)
+        writer.writerow(['# section', SECTION_NAMES[table]])
+        writer.writerow(next(rows))
+        for row in rows:
+            writer.writerow(row)
+            if buffer.tell() >= chunk_size:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        writer.writerow([])
+    yield buffer.getvalue()
+
+
+def iter_json(db: DatabaseManager, user_id, chunk_size=64 * 1024):
+    """Yield the user's history as one JSON document, in text chunks"""
+    parts = [f'{{"user_id": {json.dumps(user_id)}, "exported_at": {json.dumps(datetime.utcnow().isoformat())}']
+    size = len(parts[0])
+    for table in EXPORT_TABLES:
+        rows = db.iter_user_table(table, user_id)
+        columns = next(rows)
+        opening = f', {json.dumps(SECTION_NAMES[table])}: ['
+        parts.append(opening)
+        size += len(opening)
+        for index, row in enumerate(rows):
+            record = dict(zip(columns, row))
+            if 'plan_data' in record and record['plan_data']:
+                try:
+                    record['plan_data'] = json.loads(record['plan_data'])
+                except ValueError:
+                    pass
+            text = (', ' if index else '') + json.dumps(record, default=str)
+            parts.append(text)
+            size += len(text)
+            if size >= chunk_size:
+                yield ''.join(parts)
+                parts, size = [], 0
+        parts.append(']')
+    parts.append('}\n')
+    yield ''.join(parts)
+
+
+def write_export(db: DatabaseManager, user_id, export_format, fileobj):
+    """Gzip-compress the streamed export into fileobj"""
+    chunks = iter_json(db, user_id) if export_format == 'json' else iter_csv(db, user_id)
+    with gzip.GzipFile(fileobj=fileobj, mode='wb') as archive:
+        for chunk in chunks:
+            archive.write(chunk.encode('utf-8'))
+
+
+def create_export_handler(bot: telebot.TeleBot, db: DatabaseManager):
+    """Job handlers that build an export and send it as a document"""
+
+    def run_history_export(job):
+        export_format = job['payload'].get('format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            export_format = 'csv'
+        filename = f"fitness_history_{job['user_id']}_{datetime.utcnow():%Y%m%d}.{export_format}.gz"
+
+        # Spooled to disk past 1 MB, so large histories never sit in memory
+        with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as output:
+            write_export(db, job['user_id'], export_format, output)
+            output.seek(0)
+            bot.send_document(job['chat_id'], output, visible_file_name=filename,
+                              caption="📦 Here is your complete fitness history.")
+        logger.info(f"History export ({export_format}) sent to user {job['user_id']}")
+
+    return {job_type: run_history_export for job_type in EXPORT_JOB_TYPES.values()}
@@ -0,0 +1,79 @@
+import random
+from typing import Dict, Any
+
+MOTIVATION_TEMPLATES = {
+    'morning': [
+        "Every rep today is a step towards {goals}. Start small, start now! 💪",
+        "A new day, a new chance to {goals}. Show up for yourself this morning! 🌅",
+        "Consistency beats intensity. Get today's session done and keep moving towards {goals}! 🔥",
+    ],
+    'daily': [
+        "Progress, not perfection. One more workout brings you closer to {goals}! 💪",
+        "Your future self will thank you. Keep working towards {goals}! 🚀",
+        "Small steps every day add up. Stay on track with {goals}! 🏃‍♂️",
+    ],
+}
+
+WORKOUT_TEMPLATES = {
+    'Beginner': """📋 Full-body routine ({days} days/week, ~{duration} min)
+
+Warm-up: 5 min brisk walk + arm circles + leg swings
+1. Bodyweight squats – 3 x 10
+2. Knee or wall push-ups – 3 x 8
+3. Glute bridges – 3 x 12
+4. Bird dogs – 3 x 8 per side
+5. Plank – 3 x 20 sec
+Rest 60-90 sec between sets.
+Cool-down: 5 min easy stretching.""",
+    'Intermediate': """📋 Upper/lower split ({days} days/week, ~{duration} min)
+
+Warm-up: 5-8 min light cardio + dynamic stretches
+Upper day: push-ups 4 x 12, rows 4 x 10, overhead press 3 x 10, plank 3 x 40 sec
+Lower day: squats 4 x 12, lunges 3 x 10 per leg, Romanian deadlifts 3 x 10, side plank 3 x 30 sec
+Rest 60 sec between sets.
+Cool-down: 5-10 min stretching.""",
+    'Advanced': """📋 Push/pull/legs ({days} days/week, ~{duration} min)
+
+Warm-up: 8-10 min cardio + mobility work
+Push: bench or weighted push-ups 5 x 8, overhead press 4 x 8, dips 3 x 12
+Pull: pull-ups 5 x 6-8, barbell rows 4 x 8, face pulls 3 x 15
+Legs: back squats 5 x 6, deadlifts 3 x 5, walking lunges 3 x 12 per leg
+Rest 90-120 sec on compound lifts.
+Cool-down: 10 min stretching.""",
+}
+
+DIET_TEMPLATE = """🥗 Balanced daily template (~{calories} kcal)
+
+• Breakfast: oats or eggs with fruit
+• Lunch: lean protein, whole grains and vegetables
+• Snack: yogurt, nuts or a protein shake
+• Dinner: protein, vegetables and a portion of healthy fats
+• Water: 2-3 litres through the day
+
+Aim for protein at every meal and adjust portions to your goal of {goals}."""
+
+OFFLINE_NOTE = "\n\n⚠️ Our AI coach is temporarily unavailable, so this is a standard plan. Try generating again later for a personalised one."
+
+
+def motivation_message(user_profile: Dict[str, Any], context: str = "daily") -> str:
+    """Templated motivation message"""
+    goals = (user_profile.get('goals') or 'your goals').lower()
+    templates = MOTIVATION_TEMPLATES.get(context, MOTIVATION_TEMPLATES['daily'])
+    return random.choice(templates).format(goals=goals)
+
+
+def workout_plan(user_profile: Dict[str, Any]) -> str:
+    """Templated workout plan for the user's fitness level"""
+    template = WORKOUT_TEMPLATES.get(user_profile.get('fitness_level'), WORKOUT_TEMPLATES['Beginner'])
+    return template.format(
+        days=user_profile.get('workout_days') or 3,
+        duration=user_profile.get('workout_duration') or 30
+    ) + OFFLINE_NOTE
+
+
+def diet_plan(user_profile: Dict[str, Any], daily_calories: int) -> str:
+    """Templated diet plan around the estimated daily calories"""
+    return DIET_TEMPLATE.format(
+        calories=daily_calories,
+        goals=(user_profile.get('goals') or 'general fitness').lower()
+    ) + OFFLINE_NOTE
@@ -0,0 +1,18 @@
+import functools
+
+
+def public_method_names(obj):
+    """Names of the public methods defined on obj's class"""
+    cls = type(obj)
+    return [name for name in dir(cls) if not name.startswith('_') and callable(getattr(cls, name))]
+
+
+def wrap_methods(obj, method_names, make_wrapper):
+    """Replace each named method on the instance with make_wrapper(name, method).
+
+    Only the instance is patched, so other instances of the class are untouched.
+    """
+    for name in method_names:
+        method = getattr(obj, name, None)
+        if callable(method):
+            setattr(obj, name, functools.wraps(method)(make_wrapper(name, method)))
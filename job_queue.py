@@ -0,0 +1,305 @@
+import json
+import logging
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+import tracing
+from database_manager import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueue:
+    """SQLite-backed job queue with leases.
+
+    A job is claimed by setting a lease; if the worker dies the lease expires
+    and another worker picks the job up again, so queued work survives restarts.
+    Failed attempts are retried with exponential backoff up to max_attempts.
+    """
+
+    def __init__(self, db: DatabaseManager, lease_seconds: float = 120.0,
+                 backoff_base: float = 5.0, backoff_max: float = 300.0):
+        self.db = db
+        self.lease_seconds = lease_seconds
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._lock = threading.Lock()
+        self.stats = {'enqueued': 0, 'completed': 0, 'retried': 0, 'failed': 0}
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def enqueue(self, job_type: str, user_id: int, chat_id: int, payload: Optional[dict] = None,
+                max_attempts: int = 3) -> int:
+        """Queue a job and return its id.
+
+        If the user already has the same kind of job waiting or running, that
+        job's id is returned instead of queueing a duplicate.
+        """
+        now = time.time()
+        conn = self.db.get_connection()
+        conn.isolation_level = None
+        cursor = conn.cursor()
+        try:
+            # Check and insert under the write lock, so concurrent taps or
+            # processes cannot both queue the job
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('''
+                SELECT id FROM jobs
+                WHERE job_type = ? AND user_id = ? AND status IN ('queued', 'running')
+                LIMIT 1
+            ''', (job_type, user_id))
+            existing = cursor.fetchone()
+            if existing:
+                cursor.execute('COMMIT')
+                return existing[0]
+
+            cursor.execute('''
+                INSERT INTO jobs (job_type, user_id, chat_id, payload, max_attempts,
+                                  run_after, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (job_type, user_id, chat_id, json.dumps(tracing.inject(payload) or {}), max_attempts,
+                  now, now, now))
+            job_id = cursor.lastrowid
+            cursor.execute('COMMIT')
+        except sqlite3.Error:
+            if conn.in_transaction:
+                cursor.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        self._count('enqueued')
+        logger.info(f"Job {job_id} ({job_type}) queued for user {user_id}")
+        return job_id
+
+    def claim(self, worker_id: str) -> Optional[dict]:
+        """Lease the next runnable job (queued and due, or running with an expired lease).
+
+        A job whose lease expired on its last attempt is marked failed instead.
+        """
+        now = time.time()
+        conn = self.db.get_connection()
+        conn.isolation_level = None
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('''
+                UPDATE jobs SET status = 'failed', last_error = 'lease expired on the final attempt',
+                                lease_owner = NULL, lease_expires = NULL, updated_at = ?
+                WHERE status = 'running' AND lease_expires < ? AND attempts >= max_attempts
+            ''', (now, now))
+            expired = cursor.rowcount
+            cursor.execute('''
+                SELECT * FROM jobs
+                WHERE (status = 'queued' AND run_after <= ?)
+                   OR (status = 'running' AND lease_expires < ?)
+                ORDER BY run_after, id
+                LIMIT 1
+            ''', (now, now))
+            row = cursor.fetchone()
+            if row:
+                cursor.execute('''
+                    UPDATE jobs
+                    SET status = 'running', attempts = attempts + 1,
+                        lease_owner = ?, lease_expires = ?, updated_at = ?
+                    WHERE id = ?
+                ''', (worker_id, now + self.lease_seconds, now, row['id']))
+            cursor.execute('COMMIT')
+        except sqlite3.Error:
+            if conn.in_transaction:
+                cursor.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+        if expired:
+            with self._lock:
+                self.stats['failed'] += expired
+            logger.error(f"{expired} jobs failed permanently: lease expired on their final attempt")
+        if not row:
+            return None
+
+        job = dict(row)
+        job['attempts'] += 1
+        job['payload'] = json.loads(job['payload']) if job['payload'] else {}
+        return job
+
+    def complete(self, job_id: int, worker_id: str):
+        """Mark a job done; ignored if the lease has passed to another worker"""
+        conn = self.db.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE jobs SET status = 'done', lease_owner = NULL, lease_expires = NULL, updated_at = ?
+            WHERE id = ? AND lease_owner = ?
+        ''', (time.time(), job_id, worker_id))
+        completed = cursor.rowcount == 1
+        conn.commit()
+        conn.close()
+        if completed:
+            self._count('completed')
+        else:
+            logger.warning(f"Job {job_id} finished after worker {worker_id} lost its lease")
+
+    def fail(self, job: dict, worker_id: str, error: str):
+        """Schedule a retry with backoff, or mark the job failed after its last attempt"""
+        now = time.time()
+        conn = self.db.get_connection()
+        cursor = conn.cursor()
+        if job['attempts'] >= job['max_attempts']:
+            cursor.execute('''
+                UPDATE jobs SET status = 'failed', last_error = ?, lease_owner = NULL,
+                                lease_expires = NULL, updated_at = ?
+                WHERE id = ? AND lease_owner = ?
+            ''', (error, now, job['id'], worker_id))
+            self._count('failed')
+            logger.error(f"Job {job['id']} ({job['job_type']}) failed permanently: {error}")
+        else:
+            delay = min(self.backoff_max, self.backoff_base * 2 ** (job['attempts'] - 1))
+            delay *= random.uniform(0.8, 1.2)
+            cursor.execute('''
+                UPDATE jobs SET status = 'queued', run_after = ?, last_error = ?, lease_owner = NULL,
+                                lease_expires = NULL, updated_at = ?
+                WHERE id = ? AND lease_owner = ?
+            ''', (now + delay, error, now, job['id'], worker_id))
+            self._count('retried')
+            logger.warning(f"Job {job['id']} ({job['job_type']}) attempt {job['attempts']} failed, "
+                           f"retrying in {delay:.0f}s: {error}")
+        conn.commit()
+        conn.close()
+
+    def get_metrics(self) -> dict:
+        """Queue depth per status, age of the oldest waiting job and counters"""
+        now = time.time()
+        conn = self.db.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT status, COUNT(*), MIN(created_at) FROM jobs GROUP BY status')
+        rows = cursor.fetchall()
+        conn.close()
+
+        depth = {status: count for status, count, _ in rows}
+        oldest = [created for status, _, created in rows if status in ('queued', 'running') and created]
+        with self._lock:
+            counters = dict(self.stats)
+        return {
+            'queued': depth.get('queued', 0),
+            'running': depth.get('running', 0),
+            'done': depth.get('done', 0),
+            'failed': depth.get('failed', 0),
+            'oldest_pending_age': round(now - min(oldest), 1) if oldest else 0.0,
+            **counters
+        }
+
+    def count_queued(self, job_types) -> int:
+        """Jobs of these types waiting to run"""
+        conn = self.db.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND job_type IN ({','.join('?' * len(job_types))})
+        ''', tuple(job_types))
+        count = cursor.fetchone()[0]
+        conn.close()
+        return count
+
+    def position(self, job_id: int, job_types) -> int:
+        """1-based place of a queued job among queued jobs of these types, in claim order"""
+        conn = self.db.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT COUNT(*) FROM jobs j, (SELECT run_after, id FROM jobs WHERE id = ?) this
+            WHERE j.status = 'queued' AND j.job_type IN ({','.join('?' * len(job_types))})
+              AND (j.run_after, j.id) <= (this.run_after, this.id)
+        ''', (job_id, *job_types))
+        position = cursor.fetchone()[0]
+        conn.close()
+        return position
+
+    def purge_finished(self, days: int = 7) -> int:
+        """Delete done/failed jobs older than `days`"""
+        conn = self.db.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?
+        ''', (time.time() - days * 86400,))
+        deleted = cursor.rowcount
+        conn.commit()
+        conn.close()
+        return deleted
+
+
+class JobWorkerPool:
+    """Threads that claim jobs from a JobQueue and run the matching handler.
+
+    A handler receives the job dict; raising marks the attempt as failed.
+    """
+
+    def __init__(self, queue: JobQueue, handlers: Dict[str, Callable[[dict], None]],
+                 num_workers: int = 2, poll_interval: float = 1.0):
+        self.queue = queue
+        self.handlers = handlers
+        self.num_workers = num_workers
+        self.poll_interval = poll_interval
+        self.is_running = False
+        self._wakeup = threading.Event()
+        self._threads = []
+
+    def start(self):
+        """Start the worker threads"""
+        if self.is_running:
+            return
+        self.is_running = True
+        for index in range(self.num_workers):
+            worker_id = f"{socket.gethostname()}:{os.getpid()}:{index}"
+            thread = threading.Thread(target=self._run, args=(worker_id,), daemon=True,
+                                      name=f"job-worker-{index}")
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Job worker pool started with {self.num_workers} workers")
+
+    def stop(self, timeout: float = 30.0):
+        """Stop claiming new jobs and wait for running ones to finish"""
+        self.is_running = False
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        logger.info("Job worker pool stopped")
+
+    def notify(self):
+        """Wake idle workers after a job has been queued"""
+        self._wakeup.set()
+
+    def _run(self, worker_id: str):
+        while self.is_running:
+            try:
+                job = self.queue.claim(worker_id)
+            except Exception as e:
+                logger.error(f"Job claim error: {e}")
+                job = None
+
+            if not job:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            handler = self.handlers.get(job['job_type'])
+            attributes = {'job.id': job['id'], 'job.type': job['job_type'], 'job.attempt': job['attempts']}
+            try:
+                # Continues the trace of the update that queued the job
+                with tracing.tracer.span(f"job.{job['job_type']}", kind='consumer', attributes=attributes,
+                                         parent=job['payload'].get('traceparent')):
+                    if not handler:
+                        raise ValueError(f"No handler for job type '{job['job_type']}'")
+                    handler(job)
+                self.queue.complete(job['id'], worker_id)
+            except Exception as e:
+                try:
+                    self.queue.fail(job, worker_id, str(e))
+                except Exception as fail_error:
+                    logger.error(f"Could not record failure of job {job['id']}: {fail_error}")
@@ -0,0 +1,198 @@
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+
+from database_manager import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+
+def current_week(now=None):
+    """ISO week key ('2024-W07') and its Monday 00:00 UTC start as a DB timestamp"""
+    now = now or datetime.now(timezone.utc)
+    year, week, weekday = now.isocalendar()
+    start = (now - timedelta(days=weekday - 1)).strftime('%Y-%m-%d 00:00:00')
+    return f"{year}-W{week:02d}", start
+
+
+class ScoreIndex:
+    """Counts of users per score in a Fenwick tree, plus the users at each score.
+
+    rank() and update() are O(log max_score); top() walks down from the
+    highest score, so it costs O(n + distinct scores skipped).
+    """
+
+    def __init__(self, size: int = 64):
+        self.scores = {}
+        self._buckets = {}
+        self._size = size
+        self._tree = [0] * (size + 1)
+        self._max_score = 0
+
+    def _add(self, score, delta):
+        while score <= self._size:
+            self._tree[score] += delta
+            score += score & -score
+
+    def _count_upto(self, score):
+        total = 0
+        score = min(score, self._size)
+        while score > 0:
+            total += self._tree[score]
+            score -= score & -score
+        return total
+
+    def _grow(self, needed):
+        size = self._size
+        while size < needed:
+            size *= 2
+        self._size = size
+        self._tree = [0] * (size + 1)
+        for score, users in self._buckets.items():
+            self._add(score, len(users))
+
+    def set(self, user_id, score):
+        old = self.scores.get(user_id, 0)
+        if old == score:
+            return
+        if old:
+            self._add(old, -1)
+            self._buckets[old].discard(user_id)
+            if not self._buckets[old]:
+                del self._buckets[old]
+        if score:
+            if score > self._size:
+                self._grow(score)
+            self._add(score, 1)
+            self._buckets.setdefault(score, set()).add(user_id)
+            self.scores[user_id] = score
+            self._max_score = max(self._max_score, score)
+        else:
+            self.scores.pop(user_id, None)
+
+    def rank(self, user_id):
+        """1-based competition rank (ties share a rank); users on 0 rank after everyone else"""
+        score = self.scores.get(user_id, 0)
+        return len(self.scores) - self._count_upto(score) + 1
+
+    def top(self, n):
+        """[(user_id, score)] for the n highest scores, ties broken by user id"""
+        result = []
+        score = self._max_score
+        while score > 0 and len(result) < n:
+            users = self._buckets.get(score)
+            if users:
+                result.extend((user_id, score) for user_id in sorted(users)[:n - len(result)])
+            score -= 1
+        return result
+
+
+class Leaderboard:
+    """Opt-in leaderboard of workouts completed this week.
+
+    Scores are kept in memory in a ScoreIndex and written through to the
+    leaderboard_scores table, which is the snapshot reloaded on start. A new
+    week starts with an empty index; last week's rows are dropped then.
+    """
+
+    def __init__(self, db: DatabaseManager):
+        self.db = db
+        self._lock = threading.Lock()
+        self.members = set()
+        self.week, self.week_start = current_week()
+        self.index = ScoreIndex()
+        self._load()
+
+    def _load(self):
+        conn = self.db.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT user_id FROM leaderboard_members')
+        self.members = {row[0] for row in cursor.fetchall()}
+        cursor.execute('''
+            SELECT s.user_id, s.workouts FROM leaderboard_scores s
+            JOIN leaderboard_members m ON m.user_id = s.user_id
+            WHERE s.week = ?
+        ''', (self.week,))
+        for user_id, workouts in cursor:
+            self.index.set(user_id, workouts)
+        conn.close()
+        logger.info(f"Leaderboard loaded: {len(self.members)} members, {len(self.index.scores)} scored this week")
+
+    def _roll_week(self):
+        """Start a fresh board if the week has changed (call with the lock held)"""
+        week, week_start = current_week()
+        if week == self.week:
+            return
+        self.week, self.week_start = week, week_start
+        self.index = ScoreIndex()
+        conn = self.db.get_connection()
+        conn.execute('DELETE FROM leaderboard_scores WHERE week < ?', (week,))
+        conn.commit()
+        conn.close()
+        logger.info(f"Leaderboard reset for {week}")
+
+    def join(self, user_id):
+        """Opt a user in, seeding their score from this week's progress"""
+        with self._lock:
+            self._roll_week()
+            # Progress lives on the user's shard, the leaderboard on shard 0
+            conn = self.db.get_connection(user_id)
+            workouts = conn.execute('''
+                SELECT COUNT(*) FROM progress
+                WHERE user_id = ? AND workout_completed = 1 AND date >= ?
+            ''', (user_id, self.week_start)).fetchone()[0]
+            conn.close()
+
+            conn = self.db.get_connection()
+            cursor = conn.cursor()
+            cursor.execute('INSERT OR IGNORE INTO leaderboard_members (user_id) VALUES (?)', (user_id,))
+            cursor.execute('''
+                INSERT OR REPLACE INTO leaderboard_scores (week, user_id, workouts) VALUES (?, ?, ?)
+            ''', (self.week, user_id, workouts))
+            conn.commit()
+            conn.close()
+            self.members.add(user_id)
+            self.index.set(user_id, workouts)
+
+    def leave(self, user_id):
+        with self._lock:
+            conn = self.db.get_connection()
+            conn.execute('DELETE FROM leaderboard_members WHERE user_id = ?', (user_id,))
+            conn.execute('DELETE FROM leaderboard_scores WHERE user_id = ?', (user_id,))
+            conn.commit()
+            conn.close()
+            self.members.discard(user_id)
+            self.index.set(user_id, 0)
+
+    def is_member(self, user_id):
+        return user_id in self.members
+
+    def handle_progress(self, event: dict):
+        """Progress listener for DatabaseManager.log_progress"""
+        user_id = event['user_id']
+        if not event.get('workout_completed') or user_id not in self.members:
+            return
+        with self._lock:
+            self._roll_week()
+            conn = self.db.get_connection()
+            conn.execute('''
+                INSERT INTO leaderboard_scores (week, user_id, workouts) VALUES (?, ?, 1)
+                ON CONFLICT(week, user_id) DO UPDATE SET workouts = workouts + 1
+            ''', (self.week, user_id))
+            conn.commit()
+            conn.close()
+            self.index.set(user_id, self.index.scores.get(user_id, 0) + 1)
+
+    def top(self, n: int = 10):
+        """[(user_id, workouts)] for the top n this week"""
+        with self._lock:
+            self._roll_week()
+            return self.index.top(n)
+
+    def rank(self, user_id):
+        """(rank, workouts, member_count) for a member, or None if not opted in"""
+        with self._lock:
+            self._roll_week()
+            if user_id not in self.members:
+                return None
+            return self.index.rank(user_id), self.index.scores.get(user_id, 0), len(self.members)
@@ -1,58 +1,217 @@
 import os
 from dotenv import load_dotenv
+import hmac
 import logging
+import signal
 import threading
 from flask import Flask, request
-import telebot
-from bot import create_bot
-from database_manager import DatabaseManager
-from ai_service import AIService
-from reminder_service import ReminderService
 
-# Configure logging
+load_dotenv()
+
+from tracing import tracer, TraceContextFilter
+
+# Configure logging; records carry the trace id of the update being handled
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    format='%(asctime)s - %(name)s - %(levelname)s - [%(trace_id)s] %(message)s'
 )
+for log_handler in logging.getLogger().handlers:
+    log_handler.addFilter(TraceContextFilter())
 logger = logging.getLogger(__name__)
 
-load_dotenv()
-
 # Environment variables
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
 WEBHOOK_URL = os.getenv('WEBHOOK_URL')
 ENVIRONMENT = os.getenv('ENVIRONMENT', 'development')
 
+# Polling mode settings
+POLLING_WORKERS = int(os.getenv('POLLING_WORKERS', '4'))
+POLLING_MAX_PENDING = int(os.getenv('POLLING_MAX_PENDING', '200'))
+POLLING_LONG_POLL_TIMEOUT = int(os.getenv('POLLING_LONG_POLL_TIMEOUT', '20'))
+POLLING_REQUEST_TIMEOUT = int(os.getenv('POLLING_REQUEST_TIMEOUT', '25'))
+POLLING_DRAIN_TIMEOUT = float(os.getenv('POLLING_DRAIN_TIMEOUT', '60'))
+
+# Webhook mode: threads handling updates, and the secret Telegram sends in
+# X-Telegram-Bot-Api-Secret-Token (1-256 of A-Z, a-z, 0-9, _ and -)
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '4'))
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+
 app = Flask(__name__)
 
-def setup_bot():
-    """Creates and configures the bot."""
+# Services are created off the import path so gunicorn can answer health
+# checks straight after a cold start (see benchmarks/startup_benchmark.py);
+# in production a startup thread creates them right away (start_in_background).
+_bot_instance = None
+_profiler = None
+_update_dedup = None
+_webhook_dispatcher = None
+_setup_done = False
+_setup_lock = threading.Lock()
+
+
+def setup_bot(threaded=False):
+    """Creates and configures the bot.
+
+    With threaded=False handlers run on the thread that processes the update,
+    which the update dispatchers rely on for per-chat ordering and profiling.
+    """
+    global _profiler, _update_dedup
     if not TELEGRAM_TOKEN:
         logger.critical("TELEGRAM_TOKEN environment variable not set!")
         return None
 
+    # Heavy imports are deferred until the bot is actually needed
+    import telebot
+    from bot import create_bot
+    from database_manager import DatabaseManager
+    from ai_service import AIService
+    from reminder_service import ReminderService
+    from job_queue import JobQueue, JobWorkerPool
+    from plan_jobs import create_plan_handlers
+    from export_service import create_export_handler
+    from leaderboard import Leaderboard
+    from progress_charts import ProgressChartService
+    from exercise_catalog import ExerciseCatalog
+    from profiling import RequestProfiler, BOT_SEND_METHODS
+    from update_dedup import UpdateDeduplicator
+
     # Initialize services
     db_manager = DatabaseManager()
-    ai_service = AIService()
-    bot_instance = telebot.TeleBot(TELEGRAM_TOKEN)
+    ai_service = AIService(db_manager)
+    bot_instance = telebot.TeleBot(TELEGRAM_TOKEN, threaded=threaded)
+
+    # Optional per-update profiling (PROFILE_SAMPLE_RATE / PROFILE_SLOW_MS)
+    _profiler = RequestProfiler()
+    _profiler.instrument_public(db_manager, 'db')
+    _profiler.instrument(ai_service, ['_make_request'], 'ai')
+    _profiler.instrument(bot_instance, BOT_SEND_METHODS, 'send')
+
+    # Optional tracing to TRACE_FILE: spans for DB calls, AI requests and sends
+    tracer.instrument_public(db_manager, 'db')
+    tracer.instrument(ai_service, ['_make_request'], 'ai', kind='client')
+    tracer.instrument(bot_instance, BOT_SEND_METHODS, 'telegram', kind='client')
+
+    # Webhook re-deliveries of an update_id are dropped (UPDATE_DEDUP_WINDOW)
+    _update_dedup = UpdateDeduplicator(db_manager)
+
+    # Background workers that generate and deliver plans and exports
+    job_queue = JobQueue(db_manager)
+    job_handlers = create_plan_handlers(bot_instance, db_manager, ai_service)
+    job_handlers.update(create_export_handler(bot_instance, db_manager))
+    job_handlers = {job_type: _profiler.wrap('job', job_type, handler)
+                    for job_type, handler in job_handlers.items()}
+    job_workers = JobWorkerPool(
+        job_queue,
+        job_handlers,
+        num_workers=int(os.getenv('JOB_WORKERS', '2'))
+    )
+    job_workers.start()
+
+    # Weekly leaderboard, kept up to date from progress events
+    leaderboard = Leaderboard(db_manager)
+    db_manager.add_progress_listener(leaderboard.handle_progress)
+
+    # Progress charts are rendered on their own thread
+    charts = ProgressChartService(bot_instance, db_manager)
+
+    # Local exercise catalog, seeded from data/exercises.json on first run
+    exercises = ExerciseCatalog(db_manager)
+    exercises.ensure_seeded()
 
     # Create the bot with its handlers
-    create_bot(bot_instance, db_manager, ai_service)
+    create_bot(bot_instance, db_manager, ai_service, job_queue, job_workers, leaderboard, charts, exercises)
 
     # Initialize and start the reminder service
-    reminder_service = ReminderService(TELEGRAM_TOKEN, db_manager, ai_service)
+    reminder_service = ReminderService(TELEGRAM_TOKEN, db_manager, ai_service, profiler=_profiler)
+    _profiler.instrument(reminder_service.bot, BOT_SEND_METHODS, 'send')
+    tracer.instrument(reminder_service.bot, BOT_SEND_METHODS, 'telegram', kind='client')
     reminder_service.start()
 
     return bot_instance
 
-bot_instance = setup_bot()
+
+def get_bot(threaded=False):
+    """Return the bot, setting up all services on the first call."""
+    global _bot_instance, _setup_done
+    if not _setup_done:
+        with _setup_lock:
+            if not _setup_done:
+                _bot_instance = setup_bot(threaded)
+                _setup_done = True
+    return _bot_instance
+
+
+def register_webhook(bot_instance):
+    """Point Telegram at WEBHOOK_URL, with WEBHOOK_SECRET as the secret token it must send"""
+    if not WEBHOOK_URL:
+        logger.warning("WEBHOOK_URL is not set; leaving the webhook registration unchanged")
+        return
+    if not WEBHOOK_SECRET:
+        logger.warning("WEBHOOK_SECRET is not set; webhook requests are not authenticated")
+    # Replaces any earlier registration, so the secret always matches this deployment
+    bot_instance.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET or None)
+    logger.info(f"Webhook set to {WEBHOOK_URL}")
+
+
+def start_in_background():
+    """Set up the bot and its background services (reminders, job workers) on a startup thread,
+    then register the webhook.
+
+    Imported by gunicorn, nothing else would start them before the first
+    webhook arrived, leaving reminders and queued jobs stalled after a restart.
+    """
+    def run():
+        try:
+            bot_instance = get_bot()
+            if bot_instance:
+                register_webhook(bot_instance)
+        except Exception as e:
+            logger.critical(f"Bot setup failed: {e}")
+
+    threading.Thread(target=run, name='bot-setup', daemon=True).start()
+
+
+def handle_update(bot_instance, update):
+    """Run the bot's handlers for one update"""
+    from update_dispatcher import update_label, update_chat_key
+    label = update_label(update)
+    attributes = {'telegram.update_id': update.update_id, 'telegram.update': label,
+                  'telegram.chat_id': str(update_chat_key(update))}
+    with tracer.span('telegram.update', kind='server', attributes=attributes), \
+            _profiler.track('update', label):
+        bot_instance.process_new_updates([update])
+
+
+def get_webhook_dispatcher():
+    global _webhook_dispatcher
+    if _webhook_dispatcher is None:
+        with _setup_lock:
+            if _webhook_dispatcher is None:
+                from update_dispatcher import ChatOrderedDispatcher
+                _webhook_dispatcher = ChatOrderedDispatcher(num_workers=WEBHOOK_WORKERS)
+    return _webhook_dispatcher
+
 
 @app.route('/', methods=['POST'])
 def webhook():
+    # Checked before the body is read, so junk traffic costs one comparison
+    if WEBHOOK_SECRET and not hmac.compare_digest(
+            request.headers.get('X-Telegram-Bot-Api-Secret-Token', '').encode(), WEBHOOK_SECRET.encode()):
+        return 'Forbidden', 403
     if request.headers.get('content-type') == 'application/json':
+        bot_instance = get_bot()
+        if bot_instance is None:
+            return 'Bot not configured', 503
+        from telebot.types import Update
+        from update_dispatcher import update_chat_key
         json_str = request.get_data().decode('UTF-8')
-        update = telebot.types.Update.de_json(json_str)
-        bot_instance.process_new_updates([update])
+        update = Update.de_json(json_str)
+        if not _update_dedup.first_delivery(update.update_id):
+            logger.info(f"Dropped re-delivered update {update.update_id} "
+                        f"({_update_dedup.stats['duplicates']} duplicates so far)")
+            return '', 200
+        # Handled off the request thread, in order per chat
+        get_webhook_dispatcher().submit(update_chat_key(update), handle_update, bot_instance, update)
         return '', 200
     else:
         return 'Unsupported Media Type', 415
@@ -62,23 +221,55 @@ def index():
     return "Fitness Bot is running!", 200
 
 def run_polling():
-    """Runs the bot in polling mode."""
+    """Runs the bot in polling mode.
+
+    Updates are handled by a pool of POLLING_WORKERS threads. Updates from the
+    same chat are processed in order; different chats run concurrently.
+    SIGTERM or Ctrl+C stops fetching and drains in-flight work.
+    """
     logger.info("Starting bot in development mode with polling...")
-    if not TELEGRAM_TOKEN:
-        logger.critical("TELEGRAM_TOKEN environment variable not set!")
+    bot_instance = get_bot()
+    if not bot_instance:
         return
 
-    # The bot is already set up, so we just need to start polling
+    from update_dispatcher import ChatOrderedDispatcher, update_chat_key
+
     bot_instance.remove_webhook()  # Ensure webhook is removed for polling
-    bot_instance.infinity_polling()
+    dispatcher = ChatOrderedDispatcher(num_workers=POLLING_WORKERS)
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+
+    offset = None
+    try:
+        while not stop_event.is_set():
+            dispatcher.wait_for_capacity(POLLING_MAX_PENDING)
+            try:
+                updates = bot_instance.get_updates(offset=offset, timeout=POLLING_REQUEST_TIMEOUT,
+                                                   long_polling_timeout=POLLING_LONG_POLL_TIMEOUT)
+            except Exception as e:
+                logger.error(f"Polling error: {e}")
+                stop_event.wait(3)
+                continue
+
+            for update in updates:
+                offset = update.update_id + 1
+                dispatcher.submit(update_chat_key(update), handle_update, bot_instance, update)
+    except KeyboardInterrupt:
+        pass
+
+    logger.info(f"Stopping polling, draining {dispatcher.pending} pending updates...")
+    dispatcher.shutdown(timeout=POLLING_DRAIN_TIMEOUT)
 
 if __name__ == "__main__":
     if ENVIRONMENT == 'production':
+        bot_instance = get_bot()
         if bot_instance:
             bot_instance.remove_webhook()
-            bot_instance.set_webhook(url=WEBHOOK_URL)
-            logger.info(f"Webhook set to {WEBHOOK_URL}")
+            register_webhook(bot_instance)
             port = int(os.environ.get('PORT', 5000))
             app.run(host='0.0.0.0', port=port)
     else:
-        run_polling()
\ No newline at end of file
+        run_polling()
+elif ENVIRONMENT == 'production':
+    # Served by gunicorn (main:app)
+    start_in_background()
@@ -0,0 +1,75 @@
+import argparse
+import logging
+from database_manager import DatabaseManager
+from exercise_catalog import ExerciseCatalog, DEFAULT_CATALOG
+import tracing
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def backfill_streaks(db: DatabaseManager, args):
+    """Compute workout streaks for existing progress data"""
+    updated = db.backfill_streaks()
+    print(f"Streaks computed for {updated} users")
+
+
+def load_exercises(db: DatabaseManager, args):
+    """Bulk load an exercise catalog JSON file"""
+    loaded = ExerciseCatalog(db).load_file(args.file)
+    print(f"Loaded {loaded} exercises from {args.file}")
+
+
+def rebalance_shards(db: DatabaseManager, args):
+    """Move user rows to their shard after changing STORAGE_SHARDS"""
+    moved = db.rebalance_shards()
+    print(f"Moved {moved} rows across {db.backend.shard_count} shards")
+
+
+def recompute_nutrition(db: DatabaseManager, args):
+    """Recompute calorie and macro targets of active diet plans"""
+    updated = db.recompute_nutrition_targets()
+    print(f"Updated targets for {updated} diet plans")
+
+
+def show_trace(db: DatabaseManager, args):
+    """Print a trace's span tree, or the slowest traces, from a trace file"""
+    if args.trace_id:
+        spans = [span for span in tracing.read_spans(args.file) if span['traceId'] == args.trace_id]
+        print(tracing.format_trace(spans) or f"No spans for trace {args.trace_id}")
+        return
+    for duration, trace_id, name in tracing.slowest_traces(args.file, args.match, args.limit):
+        print(f"{duration:9.1f}ms  {trace_id}  {name}")
+
+
+COMMANDS = {
+    'backfill-streaks': backfill_streaks,
+    'load-exercises': load_exercises,
+    'rebalance-shards': rebalance_shards,
+    'recompute-nutrition': recompute_nutrition,
+    'trace': show_trace,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fitness bot maintenance tasks")
+    parser.add_argument('--db', default='fitness_bot.db', help='database file')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    parsers = {name: subparsers.add_parser(name, help=command.__doc__) for name, command in COMMANDS.items()}
+    parsers['load-exercises'].add_argument('--file', default=DEFAULT_CATALOG,
+                                           help='JSON list of exercises (default: bundled catalog)')
+    parsers['trace'].add_argument('trace_id', nargs='?', help='trace id (from the logs); omit to list the slowest')
+    parsers['trace'].add_argument('--file', default='traces.jsonl', help='trace file (TRACE_FILE)')
+    parsers['trace'].add_argument('--match', default='', help="only traces whose root mentions this, e.g. 'workout_plan'")
+    parsers['trace'].add_argument('--limit', type=int, default=10)
+    args = parser.parse_args()
+
+    db = DatabaseManager(args.db)
+    COMMANDS[args.command](db, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+from typing import Any, Dict, List, Sequence
+
+try:
+    import numpy as np
+except ImportError:
+    # numpy comes with matplotlib; without it batches are computed row by row
+    np = None
+
+# Used for profile fields that are missing
+DEFAULT_AGE = 25
+DEFAULT_WEIGHT = 70
+DEFAULT_HEIGHT = 170
+DEFAULT_GENDER = 'Male'
+DEFAULT_WORKOUT_DAYS = 3
+
+# Protein (g per kg of body weight) by goal keyword; goals are free text
+PROTEIN_PER_KG = (
+    (('muscle', 'gain', 'bulk', 'strength'), 2.0),
+    (('lose', 'loss', 'fat', 'cut', 'lean'), 1.8),
+)
+DEFAULT_PROTEIN_PER_KG = 1.4
+# Share of calories from fat; carbohydrates make up the rest
+FAT_SHARE = 0.25
+
+
+def activity_factor(workout_days) -> float:
+    """TDEE multiplier for the number of workout days per week"""
+    if workout_days <= 2:
+        return 1.2
+    if workout_days <= 4:
+        return 1.375
+    return 1.55
+
+
+def protein_per_kg(goals) -> float:
+    text = (goals or '').lower()
+    for keywords, grams in PROTEIN_PER_KG:
+        if any(keyword in text for keyword in keywords):
+            return grams
+    return DEFAULT_PROTEIN_PER_KG
+
+
+def bmr(age, weight, height, gender) -> float:
+    """Harris-Benedict basal metabolic rate (kcal/day)"""
+    if gender.lower() == 'male':
+        return 88.362 + (13.397 * weight) + (4.799 * height) - (5.677 * age)
+    return 447.593 + (9.247 * weight) + (3.098 * height) - (4.330 * age)
+
+
+def _targets(age, weight, height, gender, workout_days, goals):
+    calories = int(bmr(age, weight, height, gender) * activity_factor(workout_days))
+    protein = int(round(weight * protein_per_kg(goals)))
+    fat = int(calories * FAT_SHARE / 9)
+    carbs = max(0, int((calories - protein * 4 - fat * 9) / 4))
+    return calories, protein, carbs, fat
+
+
+def _value(value, default):
+    return default if value is None else value
+
+
+def daily_targets(user_profile: Dict[str, Any]) -> Dict[str, int]:
+    """Daily calorie (TDEE) and macro (g) targets for one profile.
+
+    Keys match the diet_plans columns, so the result can be passed straight
+    to DatabaseManager.save_diet_plan.
+    """
+    calories, protein, carbs, fat = _targets(
+        _value(user_profile.get('age'), DEFAULT_AGE),
+        _value(user_profile.get('weight'), DEFAULT_WEIGHT),
+        _value(user_profile.get('height'), DEFAULT_HEIGHT),
+        _value(user_profile.get('gender'), DEFAULT_GENDER),
+        _value(user_profile.get('workout_days'), DEFAULT_WORKOUT_DAYS),
+        user_profile.get('goals'))
+    return {'calories_target': calories, 'protein_target': protein, 'carbs_target': carbs, 'fat_target': fat}
+
+
+def batch_targets(ages: Sequence, weights: Sequence, heights: Sequence, genders: Sequence,
+                  workout_days: Sequence, goals: Sequence) -> List[tuple]:
+    """(calories, protein, carbs, fat) for many users, from one column per profile field.
+
+    Uses numpy array arithmetic when it is installed; the results are the
+    same as daily_targets row by row either way.
+    """
+    if np is None:
+        return [_targets(_value(age, DEFAULT_AGE), _value(weight, DEFAULT_WEIGHT),
+                         _value(height, DEFAULT_HEIGHT), _value(gender, DEFAULT_GENDER),
+                         _value(days, DEFAULT_WORKOUT_DAYS), goal)
+                for age, weight, height, gender, days, goal
+                in zip(ages, weights, heights, genders, workout_days, goals)]
+
+    def column(values, default):
+        # None becomes NaN on conversion
+        array = np.array(values, dtype=float)
+        return np.where(np.isnan(array), default, array)
+
+    # Few distinct genders and goals, so each is classified once
+    male_by_gender = {gender: _value(gender, DEFAULT_GENDER).lower() == 'male' for gender in set(genders)}
+    protein_by_goal = {goal: protein_per_kg(goal) for goal in set(goals)}
+
+    age = column(ages, DEFAULT_AGE)
+    weight = column(weights, DEFAULT_WEIGHT)
+    height = column(heights, DEFAULT_HEIGHT)
+    days = column(workout_days, DEFAULT_WORKOUT_DAYS)
+    male = np.fromiter(map(male_by_gender.__getitem__, genders), dtype=bool, count=len(genders))
+    protein_factor = np.fromiter(map(protein_by_goal.__getitem__, goals), dtype=float, count=len(goals))
+
+    base = np.where(male,
+                    88.362 + (13.397 * weight) + (4.799 * height) - (5.677 * age),
+                    447.593 + (9.247 * weight) + (3.098 * height) - (4.330 * age))
+    factor = np.select([days <= 2, days <= 4], [1.2, 1.375], 1.55)
+    calories = np.trunc(base * factor)
+    protein = np.rint(weight * protein_factor)
+    fat = np.trunc(calories * FAT_SHARE / 9)
+    carbs = np.maximum(0, np.trunc((calories - protein * 4 - fat * 9) / 4))
+    return list(zip(calories.astype(int).tolist(), protein.astype(int).tolist(),
+                    carbs.astype(int).tolist(), fat.astype(int).tolist()))
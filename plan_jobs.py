@@ -0,0 +1,161 @@
+import logging
+import re
+import telebot
+from database_manager import DatabaseManager
+from ai_service import AIService, AIServiceError
+from nutrition import daily_targets
+
+logger = logging.getLogger(__name__)
+
+WORKOUT_PLAN_JOB = 'workout_plan'
+DIET_PLAN_JOB = 'diet_plan'
+PLAN_ADJUST_JOB = 'plan_adjust'
+# Job types that run an AI generation
+PLAN_JOB_TYPES = (WORKOUT_PLAN_JOB, DIET_PLAN_JOB, PLAN_ADJUST_JOB)
+
+# Profile fields a plan is written from; a snapshot is saved with each plan
+PLAN_PROFILE_FIELDS = ('age', 'weight', 'height', 'gender', 'fitness_level', 'goals', 'medical_conditions',
+                       'dietary_restrictions', 'workout_days', 'workout_duration')
+
+# A Markdown heading, or a line that is wholly bold ('**Day 1: Upper Body**')
+_HEADING = re.compile(r'^\s*(#{1,6}\s+.+|\*\*[^*]+\*\*:?)\s*$')
+
+
+def profile_snapshot(user_profile):
+    return {field: user_profile.get(field) for field in PLAN_PROFILE_FIELDS}
+
+
+def profile_changes(snapshot, user_profile):
+    """{field: (old, new)} for plan fields that differ from the snapshot"""
+    return {field: (snapshot.get(field), user_profile.get(field)) for field in PLAN_PROFILE_FIELDS
+            if field in snapshot and snapshot.get(field) != user_profile.get(field)}
+
+
+def _heading_key(line):
+    return re.sub(r'[#*:\s]+', ' ', line).strip().lower()
+
+
+def _split_sections(text):
+    """[(heading line or None, lines)] in order; text before the first heading has no heading"""
+    sections = [(None, [])]
+    for line in text.splitlines():
+        if _HEADING.match(line):
+            sections.append((line, []))
+        else:
+            sections[-1][1].append(line)
+    return sections
+
+
+def apply_revisions(plan, revisions):
+    """Merge revised sections into a plan.
+
+    Each revised section replaces the plan's section with the same heading;
+    sections with new headings are appended, as is a revision without any
+    headings (a note rather than a section).
+    """
+    revised = [section for section in _split_sections(revisions) if section[0]]
+    if not revised:
+        return f"{plan.strip()}\n\n{revisions.strip()}"
+
+    replacements = {_heading_key(heading): (heading, lines) for heading, lines in revised}
+    merged = []
+    for heading, lines in _split_sections(plan):
+        key = _heading_key(heading) if heading else None
+        if key in replacements:
+            heading, lines = replacements.pop(key)
+        if heading:
+            merged.append(heading)
+        merged.extend(lines)
+    for heading, lines in revised:
+        if _heading_key(heading) in replacements:
+            merged.append(heading)
+            merged.extend(lines)
+    return '\n'.join(merged).strip()
+
+
+def create_plan_handlers(bot: telebot.TeleBot, db: DatabaseManager, ai: AIService):
+    """Build the job handlers that generate, save and deliver plans."""
+
+    def deliver(chat_id, text):
+        try:
+            bot.send_message(chat_id, text, parse_mode='Markdown')
+        except telebot.apihelper.ApiTelegramException as e:
+            # LLM output is not always valid Markdown; don't regenerate the plan over it
+            logger.warning(f"Markdown delivery failed for chat {chat_id}, sending plain text: {e}")
+            bot.send_message(chat_id, text)
+
+    def save_diet_plan(user_id, plan_data):
+        # Targets for the profile the plan was written for
+        db.save_diet_plan(user_id, plan_data, **daily_targets(plan_data['profile']))
+
+    def run_plan_job(job, generate, save, title, label):
+        user_profile = db.get_user(job['user_id'])
+        if not user_profile:
+            logger.warning(f"Dropping job {job['id']}: user {job['user_id']} has no profile")
+            return
+
+        try:
+            plan = generate(user_profile, strict=True)
+        except AIServiceError:
+            if job['attempts'] >= job['max_attempts']:
+                # Out of retries; a fallback plan must not replace the user's real one
+                bot.send_message(job['chat_id'], f"Sorry, I couldn't create your {label} plan right now. "
+                                                 "Please try again later.")
+            raise
+        save(job['user_id'], {'plan': plan, 'profile': profile_snapshot(user_profile)})
+        deliver(job['chat_id'], f"{title}\n\n{plan}")
+
+    def run_workout_plan(job):
+        run_plan_job(job, ai.generate_workout_plan, db.save_workout_plan, "💪 **Your Workout Plan:**", "workout")
+
+    def run_diet_plan(job):
+        run_plan_job(job, ai.generate_diet_plan, save_diet_plan, "🥗 **Your Diet Plan:**", "diet")
+
+    def run_plan_adjust(job):
+        """Revise the user's active plans for profile changes instead of regenerating them"""
+        user_id = job['user_id']
+        user_profile = db.get_user(user_id)
+        if not user_profile:
+            logger.warning(f"Dropping job {job['id']}: user {user_id} has no profile")
+            return
+
+        final_attempt = job['attempts'] >= job['max_attempts']
+        # Changes as the user reported them, for plans saved without a profile snapshot
+        reported = {field: tuple(values) for field, values in job['payload'].get('changes', {}).items()}
+        adjusted = failed = 0
+        for kind, get_plan, save, title in (
+                ('workout', db.get_active_workout_plan, db.save_workout_plan, "💪 **Workout plan updates:**"),
+                ('diet', db.get_active_diet_plan, save_diet_plan, "🥗 **Diet plan updates:**")):
+            stored = get_plan(user_id)
+            if not stored or not stored.get('plan'):
+                continue
+            changes = profile_changes(stored['profile'], user_profile) if 'profile' in stored else reported
+            if not changes:
+                continue
+
+            try:
+                revisions = ai.adjust_plan(kind, stored['plan'], changes, strict=True)
+            except AIServiceError:
+                if not final_attempt:
+                    raise
+                # Out of retries; unlike a new plan there is no template worth falling back to
+                logger.warning(f"Giving up adjusting the {kind} plan for user {user_id}")
+                bot.send_message(job['chat_id'], f"Sorry, I couldn't adjust your {kind} plan right now. "
+                                                 f"You can generate a fresh one from the /start menu.")
+                failed += 1
+                continue
+            # Record the new profile either way so the same changes are not sent again
+            save(user_id, {'plan': apply_revisions(stored['plan'], revisions) if revisions else stored['plan'],
+                           'profile': profile_snapshot(user_profile)})
+            if revisions:
+                adjusted += 1
+                deliver(job['chat_id'], f"{title}\n\n{revisions}")
+
+        if not adjusted and not failed:
+            bot.send_message(job['chat_id'], "✅ Your current plans still fit your profile, no changes needed.")
+
+    return {
+        WORKOUT_PLAN_JOB: run_workout_plan,
+        DIET_PLAN_JOB: run_diet_plan,
+        PLAN_ADJUST_JOB: run_plan_adjust,
+    }
@@ -0,0 +1,144 @@
+import cProfile
+import functools
+import logging
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from instrumentation import public_method_names, wrap_methods
+
+logger = logging.getLogger(__name__)
+
+# Phases reported in slow-request logs, in display order
+PHASES = ('db', 'ai', 'send')
+
+# Telegram calls counted as the 'send' phase
+BOT_SEND_METHODS = ('send_message', 'send_photo', 'send_document', 'send_chat_action',
+                    'edit_message_text', 'answer_callback_query')
+
+
+class _Record:
+    __slots__ = ('phases', 'active_phase')
+
+    def __init__(self):
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.active_phase = None
+
+
+class RequestProfiler:
+    """Per-update timing, slow-update logging and sampled cProfile runs.
+
+    track() wraps one unit of work (an update, a reminder run, a job). While
+    it runs, time spent in instrumented methods is added to that unit's db, ai
+    or send phase. Units slower than PROFILE_SLOW_MS are logged with the
+    breakdown, and a PROFILE_SAMPLE_RATE fraction of units runs under cProfile
+    with stats written to PROFILE_DIR, keeping the newest PROFILE_MAX_FILES.
+
+    With both settings at 0 nothing is instrumented and track() only checks a
+    flag.
+    """
+
+    def __init__(self, sample_rate: float = None, slow_ms: float = None, output_dir: str = None,
+                 max_files: int = None):
+        self.sample_rate = float(sample_rate if sample_rate is not None
+                                 else os.getenv('PROFILE_SAMPLE_RATE', '0'))
+        self.slow_ms = float(slow_ms if slow_ms is not None else os.getenv('PROFILE_SLOW_MS', '0'))
+        self.output_dir = output_dir or os.getenv('PROFILE_DIR', 'profiles')
+        self.max_files = int(max_files if max_files is not None else os.getenv('PROFILE_MAX_FILES', '50'))
+        self.enabled = self.sample_rate > 0 or self.slow_ms > 0
+        self._local = threading.local()
+        self._files_lock = threading.Lock()
+        self.stats = {'tracked': 0, 'sampled': 0, 'slow': 0}
+        if self.enabled:
+            logger.info(f"Request profiling on: sample rate {self.sample_rate}, slow threshold {self.slow_ms} ms")
+
+    def instrument(self, obj, method_names, phase):
+        """Count time in obj's methods towards `phase` (no-op when disabled)"""
+        if self.enabled:
+            wrap_methods(obj, method_names, lambda name, method: self._timed(method, phase))
+
+    def instrument_public(self, obj, phase):
+        """instrument() every public method of obj"""
+        self.instrument(obj, public_method_names(obj), phase)
+
+    def _timed(self, method, phase):
+        local = self._local
+
+        def wrapper(*args, **kwargs):
+            record = getattr(local, 'record', None)
+            # Only the outermost instrumented call is counted
+            if record is None or record.active_phase is not None:
+                return method(*args, **kwargs)
+            record.active_phase = phase
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                record.phases[phase] += time.perf_counter() - start
+                record.active_phase = None
+
+        return wrapper
+
+    @contextmanager
+    def track(self, kind: str, name: str = ''):
+        """Time one unit of work; nested calls on the same thread are folded into the outer one"""
+        if not self.enabled or getattr(self._local, 'record', None) is not None:
+            yield
+            return
+
+        record = self._local.record = _Record()
+        profile = None
+        if self.sample_rate and random.random() < self.sample_rate:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiler is already running in this process
+                profile = None
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            if profile:
+                profile.disable()
+            self._local.record = None
+            self.stats['tracked'] += 1
+            if profile:
+                self._save(profile, kind, name, elapsed_ms)
+            if self.slow_ms and elapsed_ms >= self.slow_ms:
+                self.stats['slow'] += 1
+                phases = {phase: seconds * 1000 for phase, seconds in record.phases.items()}
+                other = max(0.0, elapsed_ms - sum(phases.values()))
+                breakdown = ' '.join(f"{phase}={ms:.0f}ms" for phase, ms in phases.items())
+                logger.warning(f"Slow {kind} {name}: {elapsed_ms:.0f}ms ({breakdown} other={other:.0f}ms)")
+
+    def wrap(self, kind: str, name: str, fn):
+        """fn wrapped in track(kind, name)"""
+        if not self.enabled:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with self.track(kind, name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    def _save(self, profile, kind, name, elapsed_ms):
+        label = re.sub(r'[^\w-]+', '_', f"{kind}_{name}".strip('_'))[:60]
+        filename = f"{time.strftime('%Y%m%d-%H%M%S')}_{label}_{elapsed_ms:.0f}ms_{threading.get_ident()}.prof"
+        try:
+            with self._files_lock:
+                os.makedirs(self.output_dir, exist_ok=True)
+                profile.dump_stats(os.path.join(self.output_dir, filename))
+                self.stats['sampled'] += 1
+                files = sorted((entry for entry in os.scandir(self.output_dir) if entry.name.endswith('.prof')),
+                               key=lambda entry: entry.stat().st_mtime)
+                for entry in files[:max(0, len(files) - self.max_files)]:
+                    os.remove(entry.path)
+        except OSError as e:
+            logger.error(f"Could not write profile {filename}: {e}")
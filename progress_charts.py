@@ -0,0 +1,139 @@
+import importlib.util
+import io
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import telebot
+from database_manager import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+
+def downsample(days, max_points):
+    """Merge consecutive daily rows into at most max_points buckets.
+
+    Each bucket keeps its first day, the mean of the known weights and the
+    total workouts, so render time depends on max_points, not history length.
+    """
+    if len(days) <= max_points:
+        return days
+    size = -(-len(days) // max_points)
+    buckets = []
+    for start in range(0, len(days), size):
+        chunk = days[start:start + size]
+        weights = [weight for _, weight, _ in chunk if weight is not None]
+        buckets.append((
+            chunk[0][0],
+            sum(weights) / len(weights) if weights else None,
+            sum(workouts or 0 for _, _, workouts in chunk)
+        ))
+    return buckets
+
+
+def render_chart(points) -> bytes:
+    """Render weight and workout trends to a PNG"""
+    # Imported here so the web process does not pay for matplotlib at startup
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    dates = [datetime.strptime(day, '%Y-%m-%d') for day, _, _ in points]
+    weight_points = [(date, weight) for date, (_, weight, _) in zip(dates, points) if weight is not None]
+
+    figure = Figure(figsize=(8, 5), dpi=100)
+    FigureCanvasAgg(figure)
+    weight_axis, workout_axis = figure.subplots(2, 1, sharex=True, gridspec_kw={'height_ratios': [2, 1]})
+
+    if weight_points:
+        weight_axis.plot([d for d, _ in weight_points], [w for _, w in weight_points],
+                         marker='o', markersize=3, color='#1f77b4')
+    else:
+        weight_axis.text(0.5, 0.5, 'No weight logged yet', ha='center', va='center',
+                         transform=weight_axis.transAxes)
+    weight_axis.set_ylabel('Weight (kg)')
+    weight_axis.set_title('Your Progress')
+    weight_axis.grid(alpha=0.3)
+
+    workout_axis.bar(dates, [workouts or 0 for _, _, workouts in points], color='#2ca02c')
+    workout_axis.set_ylabel('Workouts')
+    workout_axis.grid(alpha=0.3, axis='y')
+    figure.autofmt_xdate()
+    figure.tight_layout()
+
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format='png')
+    return buffer.getvalue()
+
+
+class ProgressChartService:
+    """Renders progress charts off the handler thread and caches them.
+
+    The cache is keyed on (user_id, newest progress id), so a chart is only
+    re-rendered after new progress is logged. Once sent, the Telegram file_id
+    is cached too and repeat views are re-sent without uploading.
+    """
+
+    def __init__(self, bot: telebot.TeleBot, db: DatabaseManager, max_points: int = 120,
+                 cache_size: int = 256):
+        self.bot = bot
+        self.db = db
+        self.max_points = max_points
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        # One render thread: matplotlib is not thread-safe and this bounds CPU use
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='chart-render')
+        self.stats = {'hits': 0, 'renders': 0}
+        self.available = importlib.util.find_spec('matplotlib') is not None
+        if not self.available:
+            logger.warning("matplotlib is not installed; progress charts are disabled")
+
+    def send_chart(self, chat_id, user_id):
+        """Queue rendering and delivery of the user's chart"""
+        if self.available:
+            self._executor.submit(self._send_chart, chat_id, user_id)
+
+    def _cache_get(self, key):
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry:
+                self._cache.move_to_end(key)
+                self.stats['hits'] += 1
+            return entry
+
+    def _cache_put(self, key, entry):
+        with self._lock:
+            # Older charts for this user can never be served again
+            for stale in [k for k in self._cache if k[0] == key[0] and k != key]:
+                del self._cache[stale]
+            self._cache[key] = entry
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _send_chart(self, chat_id, user_id):
+        try:
+            last_id = self.db.get_last_progress_id(user_id)
+            if last_id is None:
+                return
+            key = (user_id, last_id)
+            entry = self._cache_get(key)
+
+            if entry and entry.get('file_id'):
+                self.bot.send_photo(chat_id, entry['file_id'])
+                return
+
+            if not entry:
+                points = downsample(list(self.db.iter_daily_progress(user_id)), self.max_points)
+                entry = {'png': render_chart(points)}
+                with self._lock:
+                    self.stats['renders'] += 1
+
+            sent = self.bot.send_photo(chat_id, io.BytesIO(entry['png']))
+            if sent and sent.photo:
+                entry = {'file_id': sent.photo[-1].file_id}
+            self._cache_put(key, entry)
+        except Exception as e:
+            logger.error(f"Error sending progress chart to user {user_id}: {e}")
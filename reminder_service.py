@@ -2,24 +2,62 @@ import schedule
 import time
 import threading
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import json
 from database_manager import DatabaseManager
 from ai_service import AIService
+from achievement_engine import AchievementEngine
+from broadcast_service import BroadcastService
+from timezones import get_zone
+from profiling import RequestProfiler
+from tracing import tracer
+from contextlib import contextmanager
 import telebot
 import os
 
 logger = logging.getLogger(__name__)
 
+# Stored reminders fire at their own time of day: reminder type -> ReminderService method
+REMINDER_HANDLERS = {
+    'workout': '_send_morning_reminders',
+    'hydration': '_send_hydration_reminders',
+    'general': '_send_evening_reminders',
+}
+
+# Messages every active user gets at a local time: (local time, weekday or None
+# for daily, ReminderService method, reminder type that replaces the slot once
+# anyone has one set for that time, or None)
+REMINDER_SLOTS = [
+    ('08:00', None, '_send_morning_reminders', 'workout'),
+    ('20:00', 6, '_send_weekly_progress_reminders', None),
+]
+
+# Minutes of missed ticks to catch up on after the scheduler stalls
+MAX_CATCH_UP_MINUTES = 60
+
 
 class ReminderService:
-    def __init__(self, bot_token: str, db: DatabaseManager, ai: AIService):
+    def __init__(self, bot_token: str, db: DatabaseManager, ai: AIService,
+                 profiler: RequestProfiler = None):
         self.db = db
         self.ai = ai
         self.bot = telebot.TeleBot(bot_token)
+        self.profiler = profiler or RequestProfiler(sample_rate=0, slow_ms=0)
         self.is_running = False
         self.reminder_thread = None
 
+        # Reminders fire at each user's local time, spread over this many
+        # minutes so a timezone's users are not all messaged at once
+        self.jitter_minutes = max(1, int(os.getenv('REMINDER_JITTER_MINUTES', '30')))
+        self.default_zone = get_zone(os.getenv('REMINDER_DEFAULT_TIMEZONE'))
+        self._last_minute = None
+
+        # Achievements are awarded as progress is logged
+        self.achievements = AchievementEngine(db, self.send_achievement_notification)
+        db.add_progress_listener(self.achievements.handle_progress)
+
+        self.broadcasts = BroadcastService(db, self.send_custom_reminder)
+
     def start(self):
         """Start the reminder service"""
         if not self.is_running:
@@ -27,6 +65,8 @@ class ReminderService:
             self.reminder_thread = threading.Thread(target=self._run_scheduler, daemon=True)
             self.reminder_thread.start()
             logger.info("Reminder service started")
+            # Pick up broadcasts interrupted by a restart
+            self.broadcasts.resume_incomplete()
 
     def stop(self):
         """Stop the reminder service"""
@@ -37,45 +77,115 @@ class ReminderService:
 
     def _run_scheduler(self):
         """Run the scheduler in a separate thread"""
-        # Schedule different types of reminders
-        schedule.every().day.at("08:00").do(self._send_morning_reminders)
-        schedule.every().day.at("18:00").do(self._send_evening_reminders)
-        schedule.every().sunday.at("20:00").do(self._send_weekly_progress_reminders)
-        schedule.every().day.at("12:00").do(self._send_hydration_reminders)
+        schedule.every(5).minutes.do(self.broadcasts.resume_incomplete)
+        schedule.every().hour.do(self._log_cache_stats)
+        # Diet plan targets follow weight and profile changes overnight
+        schedule.every().day.at("03:00").do(self.db.recompute_nutrition_targets)
 
         while self.is_running:
             try:
+                self._tick()
                 schedule.run_pending()
-                time.sleep(60)  # Check every minute
             except Exception as e:
                 logger.error(f"Scheduler error: {e}")
-                time.sleep(60)
-
-    def _send_morning_reminders(self):
+            # Wake just after the next minute boundary
+            time.sleep(60 - time.time() % 60 + 1)
+
+    def _log_cache_stats(self):
+        stats = self.db.get_user_cache_stats()
+        logger.info(f"User profile cache: hit ratio {stats['hit_ratio']:.1%}, {stats['size']} cached, "
+                    f"{stats['invalidations']} invalidations, {stats['evictions']} evictions")
+
+    def _tick(self, now=None):
+        """Process every UTC minute since the last tick, so none is skipped or repeated"""
+        minute = (now or datetime.now(timezone.utc)).replace(second=0, microsecond=0)
+        if self._last_minute is None:
+            self._last_minute = minute - timedelta(minutes=1)
+        self._last_minute = max(self._last_minute, minute - timedelta(minutes=MAX_CATCH_UP_MINUTES))
+        while self._last_minute < minute:
+            self._last_minute += timedelta(minutes=1)
+            self._process_minute(self._last_minute)
+
+    def _timezone_buckets(self, minute):
+        """Group the timezones in use by their local wall time at this UTC minute.
+
+        Zones sharing a UTC offset land in one bucket, so each bucket costs one
+        query per due reminder. Returns {local time: (timezone names, includes default)}.
+        """
+        buckets = {}
+        for name in self.db.get_user_timezones():
+            local = minute.astimezone(get_zone(name, self.default_zone)).replace(tzinfo=None)
+            names, includes_default = buckets.get(local, ([], False))
+            if name:
+                names.append(name)
+            buckets[local] = (names, includes_default or name is None)
+        return buckets
+
+    def _process_minute(self, minute):
+        """Send the reminders due in this UTC minute.
+
+        A user's reminder goes out `jitter` minutes after its local time,
+        where jitter is fixed per user and below jitter_minutes.
+        """
+        for local, (names, includes_default) in self._timezone_buckets(minute).items():
+            # Collected up front: deliveries are paced, and a scan left open
+            # that long would hold a read lock on the database
+            for reminder_type, handler in REMINDER_HANDLERS.items():
+                users = list(self.db.iter_due_reminders(reminder_type, local, names, includes_default,
+                                                        self.jitter_minutes))
+                if users:
+                    getattr(self, handler)(users)
+
+            for slot_time, weekday, handler, replaced_by in REMINDER_SLOTS:
+                hour, slot_minute = map(int, slot_time.split(':'))
+                slot_start = local.replace(hour=hour, minute=slot_minute)
+                offset = int((local - slot_start).total_seconds() // 60)
+                if not 0 <= offset < self.jitter_minutes:
+                    continue
+                if weekday is not None and slot_start.weekday() != weekday:
+                    continue
+                if replaced_by and self.db.has_active_reminders(replaced_by, hour * 60 + slot_minute):
+                    continue
+                users = self._slot_targets(names, includes_default, offset)
+                if users:
+                    getattr(self, handler)(users)
+
+    def _slot_targets(self, names, includes_default, offset):
+        """Ids of the users active in the last 30 days a slot reaches in one timezone bucket and jitter offset"""
+        return self.db.get_user_ids_in_timezones(names, includes_default, self.jitter_minutes, offset,
+                                                 active_days=30)
+
+    @contextmanager
+    def _delivery(self, kind, user_id):
+        """Trace and profile one reminder delivery"""
+        with tracer.span(f'reminder.{kind}', attributes={'user.id': user_id}), \
+                self.profiler.track('reminder', kind):
+            yield
+
+    def _send_morning_reminders(self, users):
         """Send morning workout reminders"""
         try:
-            current_day = datetime.now().strftime('%A').lower()
-            users = self._get_users_for_reminder('workout', 'morning')
-
+            profiles = self.db.get_users(users)
             for user_id in users:
                 try:
-                    user = self.db.get_user(user_id)
-                    if not user:
-                        continue
+                    with self._delivery('morning', user_id):
+                        user = profiles.get(user_id)
+                        if not user:
+                            continue
 
-                    user_profile = {
-                        'goals': user.get('goals'),
-                        'fitness_level': user.get('fitness_level'),
-                        'workout_days': user.get('workout_days')
-                    }
+                        user_profile = {
+                            'goals': user.get('goals'),
+                            'fitness_level': user.get('fitness_level'),
+                            'workout_days': user.get('workout_days')
+                        }
 
-                    # Generate personalized motivation message
-                    motivation = self.ai.generate_motivation_message(user_profile, "morning")
+                        # Generate personalized motivation message
+                        motivation = self.ai.generate_motivation_message(user_profile, "morning")
 
-                    message = f"🌅 Good morning! \n\n{motivation}\n\n💪 Ready for today's workout? Use /workout to see your plan!"
+                        message = f"🌅 Good morning! \n\n{motivation}\n\n💪 Ready for today's workout? Use /workout to see your plan!"
 
-                    self.bot.send_message(user_id, message)
-                    logger.info(f"Morning reminder sent to user {user_id}")
+                        self.bot.send_message(user_id, message)
+                        logger.info(f"Morning reminder sent to user {user_id}")
 
                     # Small delay to avoid rate limiting
                     time.sleep(0.5)
@@ -86,27 +196,27 @@ class ReminderService:
         except Exception as e:
             logger.error(f"Morning reminder service error: {e}")
 
-    def _send_evening_reminders(self):
+    def _send_evening_reminders(self, users):
         """Send evening reminders"""
         try:
-            users = self._get_users_for_reminder('general', 'evening')
-
+            profiles = self.db.get_users(users)
             for user_id in users:
                 try:
-                    user = self.db.get_user(user_id)
-                    if not user:
-                        continue
+                    with self._delivery('evening', user_id):
+                        user = profiles.get(user_id)
+                        if not user:
+                            continue
 
-                    # Check if user worked out today
-                    today_progress = self._get_today_progress(user_id)
+                        # Check if user worked out today
+                        today_progress = self._get_today_progress(user_id)
 
-                    if today_progress and today_progress.get('workout_completed'):
-                        message = "🎉 Great job completing your workout today! 💪\n\nDon't forget to log your progress and stay hydrated! 💧"
-                    else:
-                        message = "🌆 Evening check-in! \n\nIf you haven't worked out yet, there's still time! Even a short 15-minute session counts. 🏃‍♂️\n\nUse /workout to see your plan or /progress to log your day."
+                        if today_progress and today_progress.get('workout_completed'):
+                            message = "🎉 Great job completing your workout today! 💪\n\nDon't forget to log your progress and stay hydrated! 💧"
+                        else:
+                            message = "🌆 Evening check-in! \n\nIf you haven't worked out yet, there's still time! Even a short 15-minute session counts. 🏃‍♂️\n\nUse /workout to see your plan or /progress to log your day."
 
-                    self.bot.send_message(user_id, message)
-                    logger.info(f"Evening reminder sent to user {user_id}")
+                        self.bot.send_message(user_id, message)
+                        logger.info(f"Evening reminder sent to user {user_id}")
                     time.sleep(0.5)
 
                 except Exception as e:
@@ -115,40 +225,43 @@ class ReminderService:
         except Exception as e:
             logger.error(f"Evening reminder service error: {e}")
 
-    def _send_weekly_progress_reminders(self):
+    def _send_weekly_progress_reminders(self, users):
         """Send weekly progress summary"""
         try:
-            users = self._get_all_active_users()
-
+            profiles = self.db.get_users(users)
             for user_id in users:
                 try:
-                    user = self.db.get_user(user_id)
-                    if not user:
-                        continue
+                    with self._delivery('weekly_progress', user_id):
+                        user = profiles.get(user_id)
+                        if not user:
+                            continue
 
-                    # Get user's progress for the past week
-                    week_progress = self._get_week_progress(user_id)
-                    user_stats = self.db.get_user_stats(user_id)
+                        # Get user's progress for the past week
+                        week_progress = self._get_week_progress(user_id)
+                        user_stats = self.db.get_user_stats(user_id)
 
-                    workouts_this_week = sum(1 for p in week_progress if p.get('workout_completed'))
-                    target_workouts = user.get('workout_days', 0)  # workout_days from profile
+                        workouts_this_week = sum(1 for p in week_progress if p.get('workout_completed'))
+                        target_workouts = user.get('workout_days', 0)  # workout_days from profile
 
-                    progress_text = f"📊 **Weekly Progress Summary**\n\n"
-                    progress_text += f"🏋️‍♂️ Workouts completed: {workouts_this_week}/{target_workouts}\n"
-                    progress_text += f"⏱️ Total workout time: {sum(p.get('duration_minutes', 0) for p in week_progress)} minutes\n"
-                    progress_text += f"🔥 Calories burned: {sum(p.get('calories_burned', 0) for p in week_progress)}\n\n"
+                        progress_text = f"📊 **Weekly Progress Summary**\n\n"
+                        progress_text += f"🏋️‍♂️ Workouts completed: {workouts_this_week}/{target_workouts}\n"
+                        progress_text += f"⏱️ Total workout time: {sum(p.get('duration_minutes', 0) for p in week_progress)} minutes\n"
+                        progress_text += f"🔥 Calories burned: {sum(p.get('calories_burned', 0) for p in week_progress)}\n\n"
 
-                    if workouts_this_week >= target_workouts:
-                        progress_text += "🎉 Fantastic! You hit your weekly goal! Keep up the amazing work! 💪"
-                    elif workouts_this_week > 0:
-                        progress_text += f"👍 Good effort this week! Try to reach your goal of {target_workouts} workouts next week."
-                    else:
-                        progress_text += "💙 New week, new opportunities! Let's make this week count. You've got this! 🚀"
+                        if workouts_this_week >= target_workouts:
+                            progress_text += "🎉 Fantastic! You hit your weekly goal! Keep up the amazing work! 💪"
+                        elif workouts_this_week > 0:
+                            progress_text += f"👍 Good effort this week! Try to reach your goal of {target_workouts} workouts next week."
+                        else:
+                            progress_text += "💙 New week, new opportunities! Let's make this week count. You've got this! 🚀"
 
-                    progress_text += f"\n\n📈 Total workouts since joining: {user_stats['total_workouts']}"
+                        progress_text += f"\n\n📈 Total workouts since joining: {user_stats['total_workouts']}"
 
-                    self.bot.send_message(user_id, progress_text, parse_mode='Markdown')
-                    logger.info(f"Weekly progress reminder sent to user {user_id}")
+                        streaks = self.db.get_streaks(user_id)
+                        progress_text += f"\n🔥 Current streak: {streaks['current_streak']} days (best: {streaks['longest_streak']})"
+
+                        self.bot.send_message(user_id, progress_text, parse_mode='Markdown')
+                        logger.info(f"Weekly progress reminder sent to user {user_id}")
                     time.sleep(0.5)
 
                 except Exception as e:
@@ -157,11 +270,9 @@ class ReminderService:
         except Exception as e:
             logger.error(f"Weekly reminder service error: {e}")
 
-    def _send_hydration_reminders(self):
+    def _send_hydration_reminders(self, users):
         """Send hydration reminders"""
         try:
-            users = self._get_users_for_reminder('hydration', 'midday')
-
             hydration_messages = [
                 "💧 Hydration check! Have you been drinking enough water today?",
                 "🚰 Remember to stay hydrated! Your body needs water to perform at its best.",
@@ -173,8 +284,9 @@ class ReminderService:
 
             for user_id in users:
                 try:
-                    message = random.choice(hydration_messages)
-                    self.bot.send_message(user_id, message)
+                    with self._delivery('hydration', user_id):
+                        message = random.choice(hydration_messages)
+                        self.bot.send_message(user_id, message)
                     time.sleep(0.5)
 
                 except Exception as e:
@@ -183,40 +295,9 @@ class ReminderService:
         except Exception as e:
             logger.error(f"Hydration reminder service error: {e}")
 
-    def _get_users_for_reminder(self, reminder_type: str, time_of_day: str):
-        """Get users who should receive specific reminders"""
-        reminders = self.db.get_active_reminders()
-        user_ids = []
-
-        for reminder in reminders:
-            if reminder[2] == reminder_type and time_of_day in reminder[3]:
-                user_ids.append(reminder[1])
-
-        # If no specific reminders set, send to all active users
-        if not user_ids and reminder_type == 'workout':
-            user_ids = self._get_all_active_users()
-
-        return user_ids
-
-    def _get_all_active_users(self):
-        """Get all users who have been active in the last 30 days"""
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            SELECT DISTINCT u.user_id FROM users u
-            LEFT JOIN progress p ON u.user_id = p.user_id
-            WHERE u.created_at > datetime('now', '-30 days')
-            OR p.date > datetime('now', '-30 days')
-        ''')
-
-        users = [row[0] for row in cursor.fetchall()]
-        conn.close()
-        return users
-
     def _get_today_progress(self, user_id):
         """Get user's progress for today"""
-        conn = self.db.get_connection()
+        conn = self.db.get_connection(user_id)
         cursor = conn.cursor()
 
         cursor.execute('''
@@ -239,7 +320,7 @@ class ReminderService:
 
     def _get_week_progress(self, user_id):
         """Get user's progress for the past week"""
-        conn = self.db.get_connection()
+        conn = self.db.get_connection(user_id)
         cursor = conn.cursor()
 
         cursor.execute('''
@@ -290,40 +371,7 @@ class ReminderService:
     def check_and_award_achievements(self, user_id):
         """Check if user deserves any achievements"""
         try:
-            user_stats = self.db.get_user_stats(user_id)
-            existing_achievements = self.db.get_user_achievements(user_id)
-            existing_types = [ach[2] for ach in existing_achievements]
-
-            # First workout achievement
-            if user_stats['total_workouts'] >= 1 and 'first_workout' not in existing_types:
-                self.db.add_achievement(user_id, 'first_workout',
-                                        'First Steps', 'Completed your first workout!')
-                self.send_achievement_notification(user_id, 'First Steps', 'Completed your first workout!')
-
-            # Consistency achievements
-            if user_stats['total_workouts'] >= 10 and 'consistent_10' not in existing_types:
-                self.db.add_achievement(user_id, 'consistent_10',
-                                        'Getting Strong', 'Completed 10 workouts!')
-                self.send_achievement_notification(user_id, 'Getting Strong', 'Completed 10 workouts!')
-
-            if user_stats['total_workouts'] >= 50 and 'consistent_50' not in existing_types:
-                self.db.add_achievement(user_id, 'consistent_50',
-                                        'Fitness Warrior', 'Completed 50 workouts!')
-                self.send_achievement_notification(user_id, 'Fitness Warrior', 'Completed 50 workouts!')
-
-            # Weight loss achievement
-            if user_stats['weight_change'] and user_stats[
-                'weight_change'] <= -5 and 'weight_loss_5kg' not in existing_types:
-                self.db.add_achievement(user_id, 'weight_loss_5kg',
-                                        'Transformation', 'Lost 5kg or more!')
-                self.send_achievement_notification(user_id, 'Transformation', 'Lost 5kg or more!')
-
-            # Long-term commitment
-            if user_stats['days_registered'] >= 30 and 'month_commitment' not in existing_types:
-                self.db.add_achievement(user_id, 'month_commitment',
-                                        'Committed', 'One month of fitness journey!')
-                self.send_achievement_notification(user_id, 'Committed', 'One month of fitness journey!')
-
+            self.achievements.evaluate(user_id)
         except Exception as e:
             logger.error(f"Error checking achievements for user {user_id}: {e}")
 
@@ -333,6 +381,7 @@ class ReminderManager:
     def __init__(self, db_manager, reminder_service):
         self.db = db_manager
         self.reminder_service = reminder_service
+        self.broadcasts = reminder_service.broadcasts
 
     def schedule_workout_reminder(self, user_id, time_str, days_of_week=None):
         """Schedule a workout reminder for specific days and time"""
@@ -351,31 +400,34 @@ class ReminderManager:
 
     def send_motivational_blast(self, message, target_users=None):
         """Send motivational message to all or specific users"""
-        if target_users is None:
-            target_users = self.reminder_service._get_all_active_users()
+        job_id = self.broadcasts.create(message, target_users)
+        return self.broadcasts.run(job_id)['sent']
 
-        success_count = 0
-        for user_id in target_users:
-            if self.reminder_service.send_custom_reminder(user_id, message):
-                success_count += 1
-
-        return success_count
+    def start_motivational_blast(self, message, target_users=None):
+        """Send a blast in the background; returns the broadcast id for progress/cancel"""
+        job_id = self.broadcasts.create(message, target_users)
+        self.broadcasts.start(job_id)
+        return job_id
 
     def get_reminder_stats(self):
         """Get statistics about reminders"""
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
-
-        cursor.execute('SELECT COUNT(*) FROM reminders WHERE is_active = 1')
-        active_reminders = cursor.fetchone()[0]
-
-        cursor.execute('SELECT COUNT(DISTINCT user_id) FROM reminders WHERE is_active = 1')
-        users_with_reminders = cursor.fetchone()[0]
-
-        cursor.execute('SELECT reminder_type, COUNT(*) FROM reminders WHERE is_active = 1 GROUP BY reminder_type')
-        reminder_types = dict(cursor.fetchall())
-
-        conn.close()
+        def shard_stats(conn):
+            cursor = conn.cursor()
+            cursor.execute('SELECT COUNT(*) FROM reminders WHERE is_active = 1')
+            active = cursor.fetchone()[0]
+            cursor.execute('SELECT COUNT(DISTINCT user_id) FROM reminders WHERE is_active = 1')
+            users = cursor.fetchone()[0]
+            cursor.execute('SELECT reminder_type, COUNT(*) FROM reminders WHERE is_active = 1 GROUP BY reminder_type')
+            return active, users, cursor.fetchall()
+
+        # Users never span shards, so per-shard counts simply add up
+        active_reminders = users_with_reminders = 0
+        reminder_types = {}
+        for active, users, types in self.db.fan_out(shard_stats):
+            active_reminders += active
+            users_with_reminders += users
+            for reminder_type, count in types:
+                reminder_types[reminder_type] = reminder_types.get(reminder_type, 0) + count
 
         return {
             'active_reminders': active_reminders,
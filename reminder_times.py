@@ -0,0 +1,52 @@
+import json
+import re
+
+# Named reminder times and the local minute of day they fire at
+NAMED_TIMES = {'morning': 8 * 60, 'midday': 12 * 60, 'noon': 12 * 60, 'evening': 18 * 60}
+
+WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+# Bit d (0 = Monday) set means the reminder fires on weekday d
+EVERY_DAY = 0b1111111
+
+
+def minute_of_day(reminder_time):
+    """Minute of day for 'HH:MM' or a named time ('morning', 'evening'...); None if unknown"""
+    text = str(reminder_time or '').strip().lower()
+    match = re.fullmatch(r'(\d{1,2}):(\d{2})', text)
+    if match:
+        hour, minute = int(match.group(1)), int(match.group(2))
+        if hour < 24 and minute < 60:
+            return hour * 60 + minute
+        return None
+    if text in NAMED_TIMES:
+        return NAMED_TIMES[text]
+    # Older rows stored phrases such as 'early morning'
+    for name, minute in NAMED_TIMES.items():
+        if name in text:
+            return minute
+    return None
+
+
+def days_mask(days):
+    """Weekday bitmask from weekday names, abbreviations or numbers (0 = Monday).
+
+    Accepts a list or its JSON encoding; empty or None means every day.
+    """
+    if isinstance(days, str):
+        try:
+            days = json.loads(days)
+        except ValueError:
+            days = re.split(r'[,\s]+', days)
+    if not days:
+        return EVERY_DAY
+    mask = 0
+    for day in days:
+        if isinstance(day, int) and 0 <= day < 7:
+            mask |= 1 << day
+            continue
+        name = str(day).strip().lower()
+        for index, weekday in enumerate(WEEKDAYS):
+            if name and weekday.startswith(name[:3]):
+                mask |= 1 << index
+    return mask or EVERY_DAY
@@ -0,0 +1,86 @@
+from dataclasses import dataclass, fields
+from typing import Optional
+
+
+class RowModel:
+    """Base for typed query result rows.
+
+    Subclasses are @dataclass(slots=True) with one field per table column,
+    so rows carry no per-instance dict and fields are read by name
+    (reminder.reminder_type) rather than by position. Queries select
+    cls.columns() and set row_factory(cls) on the connection.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def columns(cls) -> str:
+        """Column list for a SELECT, in field order"""
+        return ', '.join(field.name for field in fields(cls))
+
+
+def row_factory(cls):
+    """sqlite3 row_factory building cls from rows selected with cls.columns()"""
+    return lambda cursor, row: cls(*row)
+
+
+@dataclass(slots=True)
+class UserRow(RowModel):
+    user_id: Optional[int] = None
+    username: Optional[str] = None
+    first_name: Optional[str] = None
+    age: Optional[int] = None
+    weight: Optional[float] = None
+    height: Optional[float] = None
+    gender: Optional[str] = None
+    fitness_level: Optional[str] = None
+    goals: Optional[str] = None
+    medical_conditions: Optional[str] = None
+    dietary_restrictions: Optional[str] = None
+    workout_days: Optional[int] = None
+    workout_duration: Optional[int] = None
+    preferred_workout_time: Optional[str] = None
+    created_at: Optional[str] = None
+    updated_at: Optional[str] = None
+    current_streak: Optional[int] = None
+    longest_streak: Optional[int] = None
+    last_workout_date: Optional[str] = None
+    timezone: Optional[str] = None
+
+
+@dataclass(slots=True)
+class ProgressRow(RowModel):
+    id: Optional[int] = None
+    user_id: Optional[int] = None
+    weight: Optional[float] = None
+    workout_completed: Optional[bool] = None
+    exercises_completed: Optional[int] = None
+    duration_minutes: Optional[int] = None
+    calories_burned: Optional[int] = None
+    notes: Optional[str] = None
+    mood_rating: Optional[int] = None
+    date: Optional[str] = None
+
+
+@dataclass(slots=True)
+class ReminderRow(RowModel):
+    id: Optional[int] = None
+    user_id: Optional[int] = None
+    reminder_type: Optional[str] = None
+    reminder_time: Optional[str] = None
+    reminder_days: Optional[str] = None
+    message: Optional[str] = None
+    is_active: Optional[bool] = None
+    created_at: Optional[str] = None
+    minute_of_day: Optional[int] = None
+    days_mask: Optional[int] = None
+
+
+@dataclass(slots=True)
+class AchievementRow(RowModel):
+    id: Optional[int] = None
+    user_id: Optional[int] = None
+    achievement_type: Optional[str] = None
+    title: Optional[str] = None
+    description: Optional[str] = None
+    achieved_at: Optional[str] = None
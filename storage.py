@@ -0,0 +1,113 @@
+import itertools
+import logging
+import os
+import sqlite3
+import zlib
+from abc import ABC, abstractmethod
+
+logger = logging.getLogger(__name__)
+
+# Tables whose rows belong to one user; in a sharded store they live on the
+# user's shard. Everything else (jobs, exercises, broadcasts, leaderboard)
+# lives on shard 0.
+USER_TABLES = ('users', 'workout_plans', 'diet_plans', 'progress', 'reminders', 'achievements',
+               'achievement_state')
+
+
+class StorageBackend(ABC):
+    """Where DatabaseManager's SQLite data lives.
+
+    A backend hands out connections per shard. Single-file backends have one
+    shard; shard 0 is always the one holding the global tables. Subclasses
+    must implement connect(); the sharding methods default to one shard.
+    """
+
+    shard_count = 1
+
+    @abstractmethod
+    def connect(self, shard: int = 0) -> sqlite3.Connection:
+        """A new connection to the given shard"""
+
+    def shard_for(self, user_id) -> int:
+        return 0
+
+    def shards(self):
+        return range(self.shard_count)
+
+    def describe(self) -> str:
+        return type(self).__name__
+
+
+class SQLiteBackend(StorageBackend):
+    """One SQLite file (the default)"""
+
+    def __init__(self, path: str = 'fitness_bot.db'):
+        self.path = path
+
+    def connect(self, shard: int = 0) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, check_same_thread=False)
+
+    def describe(self):
+        return f"SQLite file {self.path}"
+
+
+class MemoryBackend(StorageBackend):
+    """A private in-memory database, for tests and benchmarks.
+
+    Connections share one cache so they all see the same data; a keeper
+    connection holds the database open until close(). Shared-cache locking is
+    per table and does not wait, so this backend suits single-threaded use.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, name: str = None):
+        self.uri = f"file:{name or f'fitness-bot-{os.getpid()}-{next(self._ids)}'}?mode=memory&cache=shared"
+        self._keeper = self.connect()
+
+    def connect(self, shard: int = 0) -> sqlite3.Connection:
+        return sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+
+    def close(self):
+        self._keeper.close()
+
+    def describe(self):
+        return "in-memory SQLite"
+
+
+class ShardedSQLiteBackend(StorageBackend):
+    """User data spread over shard_count SQLite files by a hash of user_id.
+
+    Shard 0 is the original file and keeps the global tables; shard i > 0 is
+    '<name>.shard<i><ext>' next to it. Each file has its own write lock, so
+    writes for users on different shards do not wait for each other.
+    """
+
+    def __init__(self, path: str = 'fitness_bot.db', shard_count: int = 4):
+        if shard_count < 1:
+            raise ValueError("shard_count must be at least 1")
+        self.shard_count = shard_count
+        stem, ext = os.path.splitext(path)
+        self.paths = [path] + [f"{stem}.shard{index}{ext}" for index in range(1, shard_count)]
+
+    def connect(self, shard: int = 0) -> sqlite3.Connection:
+        return sqlite3.connect(self.paths[shard], check_same_thread=False)
+
+    def shard_for(self, user_id) -> int:
+        # crc32 rather than hash() so placement is identical in every process
+        return zlib.crc32(str(user_id).encode()) % self.shard_count
+
+    def describe(self):
+        return f"{self.shard_count} SQLite shards ({self.paths[0]} ...)"
+
+
+def backend_from_env(path: str = 'fitness_bot.db') -> StorageBackend:
+    """Backend chosen by STORAGE_BACKEND (sqlite, sharded or memory) and STORAGE_SHARDS"""
+    kind = os.getenv('STORAGE_BACKEND', 'sqlite').lower()
+    if kind == 'sharded':
+        return ShardedSQLiteBackend(path, int(os.getenv('STORAGE_SHARDS', '4')))
+    if kind == 'memory':
+        return MemoryBackend()
+    if kind != 'sqlite':
+        logger.warning(f"Unknown STORAGE_BACKEND '{kind}', using sqlite")
+    return SQLiteBackend(path)
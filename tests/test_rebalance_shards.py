@@ -0,0 +1,47 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from database_manager import DatabaseManager  # noqa: E402
+from storage import USER_TABLES, ShardedSQLiteBackend  # noqa: E402
+
+PROFILE = {'username': None, 'first_name': 'Test', 'age': 30, 'weight': 80, 'height': 175, 'gender': 'Male',
+           'fitness_level': 'Beginner', 'goals': 'Weight Loss', 'medical_conditions': 'None',
+           'dietary_restrictions': 'None', 'workout_days': 3, 'workout_duration': 45}
+
+
+def row_counts(backend):
+    counts = {}
+    for shard in backend.shards():
+        conn = backend.connect(shard)
+        for table in USER_TABLES:
+            counts[table] = counts.get(table, 0) + conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+        conn.close()
+    return counts
+
+
+def test_rebalance_keeps_rows_with_overlapping_ids(tmp_path):
+    path = str(tmp_path / 'bot.db')
+    before, after = ShardedSQLiteBackend(path, 2), ShardedSQLiteBackend(path, 3)
+    # Two users on different shards now that both move to the same new shard
+    first = next(user_id for user_id in range(1, 1000)
+                 if before.shard_for(user_id) == 0 and after.shard_for(user_id) == 2)
+    second = next(user_id for user_id in range(1, 1000)
+                  if before.shard_for(user_id) == 1 and after.shard_for(user_id) == 2)
+
+    db = DatabaseManager(path, backend=before)
+    for user_id in (first, second):
+        db.save_user(dict(PROFILE, user_id=user_id))
+        db.save_workout_plan(user_id, {'plan': 'Plan'})
+        for weight in (80, 79):
+            db.log_progress(user_id, weight=weight, workout_completed=True)
+    expected = row_counts(before)
+
+    db = DatabaseManager(path, backend=after)
+    # Both users' first progress row has id 1 on its own shard
+    assert db.rebalance_shards() == sum(expected.values())
+    assert row_counts(after) == expected
+    for user_id in (first, second):
+        assert [entry.weight for entry in db.get_progress_history(user_id)] == [79, 80]
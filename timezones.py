@@ -0,0 +1,39 @@
+import re
+from datetime import datetime
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+_OFFSET = re.compile(r'^(?:UTC|GMT)?\s*([+-])(\d{1,2})$', re.IGNORECASE)
+
+
+def parse_timezone(text):
+    """Canonical timezone name for user input, or None if it is not recognised.
+
+    Accepts IANA names ('Europe/Berlin' or 'europe/berlin') and whole-hour
+    offsets ('UTC+3', '-5'), which map to the fixed Etc/GMT zones.
+    """
+    text = text.strip()
+    match = _OFFSET.match(text)
+    if match:
+        sign, hours = match.groups()
+        # Etc/GMT names use the POSIX sign convention: UTC+3 is Etc/GMT-3
+        candidates = ['UTC' if int(hours) == 0 else f"Etc/GMT{'-' if sign == '+' else '+'}{int(hours)}"]
+    else:
+        candidates = [text, '/'.join(part.capitalize() for part in text.split('/'))]
+
+    for candidate in candidates:
+        try:
+            ZoneInfo(candidate)
+            return candidate
+        except (ZoneInfoNotFoundError, ValueError):
+            continue
+    return None
+
+
+def get_zone(name, default=None):
+    """ZoneInfo for a stored name, falling back to `default` (server local time if None)"""
+    if name:
+        try:
+            return ZoneInfo(name)
+        except (ZoneInfoNotFoundError, ValueError):
+            pass
+    return default or datetime.now().astimezone().tzinfo
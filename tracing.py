@@ -0,0 +1,292 @@
+import contextvars
+import json
+import logging
+import os
+import queue
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+
+from instrumentation import public_method_names, wrap_methods
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = 'workouthealthybot'
+
+# OTLP span kinds
+SPAN_KINDS = {'internal': 1, 'server': 2, 'client': 3, 'producer': 4, 'consumer': 5}
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+class Span:
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'kind', 'start_ns', 'end_ns',
+                 'attributes', 'status', 'status_message', 'local_spans')
+
+    def __init__(self, trace_id, parent_id, name, kind, attributes, local_spans):
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes) if attributes else {}
+        self.status = STATUS_OK
+        self.status_message = ''
+        # Finished spans under the same local root, exported together with it
+        self.local_spans = local_spans
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def record_error(self, message):
+        self.status = STATUS_ERROR
+        self.status_message = str(message)
+
+    def traceparent(self):
+        """W3C trace context header value pointing at this span"""
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_otlp(self):
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': SPAN_KINDS.get(self.kind, 1),
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns),
+            'attributes': [{'key': key, 'value': _otlp_value(value)} for key, value in self.attributes.items()],
+            'status': {'code': self.status},
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        if self.status_message:
+            span['status']['message'] = self.status_message
+        return span
+
+
+class Tracer:
+    """Spans for updates, reminders and jobs, written to TRACE_FILE as JSON lines.
+
+    Each line is an OTLP/JSON ExportTraceServiceRequest holding a local root
+    span and every span finished under it, so the file can be replayed into an
+    OpenTelemetry collector (otlpjsonfile receiver) or read directly. Jobs carry
+    the enqueuing span's traceparent, so a plan generated in the background is
+    part of the same trace as the button press that asked for it.
+
+    Without TRACE_FILE, span() yields None and nothing is instrumented.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path if path is not None else os.getenv('TRACE_FILE', '')
+        self.enabled = bool(self.path)
+        self._queue = queue.SimpleQueue()
+        self._writer = None
+        if self.enabled:
+            self._writer = threading.Thread(target=self._write_loop, daemon=True, name='trace-writer')
+            self._writer.start()
+
+    @contextmanager
+    def span(self, name: str, kind: str = 'internal', attributes: dict = None, parent: str = None):
+        """Run the block in a new span, a child of the current one or of `parent` (a traceparent)"""
+        if not self.enabled:
+            yield None
+            return
+
+        current = _current_span.get()
+        remote = self._parse_traceparent(parent) if parent else None
+        if remote:
+            trace_id, parent_id = remote
+            local_spans = []
+        elif current:
+            trace_id, parent_id, local_spans = current.trace_id, current.span_id, current.local_spans
+        else:
+            trace_id, parent_id, local_spans = secrets.token_hex(16), None, []
+        span = Span(trace_id, parent_id, name, kind, attributes, local_spans)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_error(f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            span.end_ns = time.time_ns()
+            _current_span.reset(token)
+            local_spans.append(span)
+            if current is None or remote:
+                self._queue.put(local_spans)
+
+    def instrument(self, obj, method_names, prefix: str, kind: str = 'internal'):
+        """Give each call of obj's methods a span named prefix.method, inside existing traces only"""
+        if self.enabled:
+            wrap_methods(obj, method_names, lambda name, method: self._spanned(method, f"{prefix}.{name}", kind))
+
+    def instrument_public(self, obj, prefix: str, kind: str = 'internal'):
+        self.instrument(obj, public_method_names(obj), prefix, kind)
+
+    def _spanned(self, method, name, kind):
+        def wrapper(*args, **kwargs):
+            if _current_span.get() is None:
+                return method(*args, **kwargs)
+            with self.span(name, kind):
+                return method(*args, **kwargs)
+
+        return wrapper
+
+    @staticmethod
+    def _parse_traceparent(value):
+        parts = str(value).split('-')
+        if len(parts) == 4 and len(parts[1]) == 32 and len(parts[2]) == 16:
+            return parts[1], parts[2]
+        return None
+
+    def flush(self, timeout: float = 5.0):
+        """Wait until queued spans have been written"""
+        if self.enabled:
+            done = threading.Event()
+            self._queue.put(done)
+            done.wait(timeout)
+
+    def _write_loop(self):
+        resource = {'attributes': [{'key': 'service.name', 'value': {'stringValue': SERVICE_NAME}},
+                                   {'key': 'process.pid', 'value': {'intValue': str(os.getpid())}}]}
+        while True:
+            item = self._queue.get()
+            if isinstance(item, threading.Event):
+                item.set()
+                continue
+            line = json.dumps({'resourceSpans': [{
+                'resource': resource,
+                'scopeSpans': [{'scope': {'name': SERVICE_NAME},
+                                'spans': [span.to_otlp() for span in item]}],
+            }]})
+            try:
+                with open(self.path, 'a', encoding='utf-8') as trace_file:
+                    trace_file.write(line + '\n')
+            except OSError as e:
+                logger.error(f"Could not write trace to {self.path}: {e}")
+
+
+def current_span():
+    return _current_span.get()
+
+
+def set_attribute(key, value):
+    """Set an attribute on the current span, if any"""
+    span = _current_span.get()
+    if span is not None:
+        span.set_attribute(key, value)
+
+
+def record_error(message):
+    """Mark the current span as failed, if any"""
+    span = _current_span.get()
+    if span is not None:
+        span.record_error(message)
+
+
+def inject(payload: dict) -> dict:
+    """Add the current traceparent to a job payload"""
+    span = _current_span.get()
+    if span is not None:
+        payload = dict(payload or {}, traceparent=span.traceparent())
+    return payload
+
+
+def read_spans(path):
+    """Yield every span (OTLP dict) in a trace file"""
+    with open(path, encoding='utf-8') as trace_file:
+        for line in trace_file:
+            for resource_spans in json.loads(line)['resourceSpans']:
+                for scope_spans in resource_spans['scopeSpans']:
+                    yield from scope_spans['spans']
+
+
+def slowest_traces(path, match: str = '', limit: int = 10):
+    """[(duration_ms, trace_id, root name)] for the slowest traces whose root span mentions `match`.
+
+    A trace's duration runs from its first span's start to its last span's
+    end, so background jobs are included.
+    """
+    traces = {}
+    for span in read_spans(path):
+        start, end = int(span['startTimeUnixNano']), int(span['endTimeUnixNano'])
+        trace = traces.setdefault(span['traceId'], [start, end, None])
+        trace[0], trace[1] = min(trace[0], start), max(trace[1], end)
+        if not span.get('parentSpanId'):
+            trace[2] = span['name'] + ' ' + ' '.join(str(a['value']) for a in span['attributes'])
+    matches = [((end - start) / 1e6, trace_id, root.split(' ')[0])
+               for trace_id, (start, end, root) in traces.items() if root and match in root]
+    return sorted(matches, reverse=True)[:limit]
+
+
+def format_trace(spans):
+    """Render one trace's spans as an indented tree with start offsets and durations.
+
+    Spans on the critical path are marked with '*'.
+    """
+    by_id = {span['spanId']: span for span in spans}
+    children = {}
+    for span in spans:
+        parent = span.get('parentSpanId')
+        children.setdefault(parent if parent in by_id else None, []).append(span)
+    for siblings in children.values():
+        siblings.sort(key=lambda span: int(span['startTimeUnixNano']))
+    if not spans:
+        return ''
+    origin = min(int(span['startTimeUnixNano']) for span in spans)
+
+    # Walking back from the child that finished last, each step takes the
+    # child that finished latest before the current one started
+    on_path = set()
+    for siblings in children.values():
+        cursor = None
+        for span in sorted(siblings, key=lambda span: int(span['endTimeUnixNano']), reverse=True):
+            if cursor is None or int(span['endTimeUnixNano']) <= cursor:
+                on_path.add(span['spanId'])
+                cursor = int(span['startTimeUnixNano'])
+
+    lines = []
+
+    def walk(span, depth, critical):
+        start = (int(span['startTimeUnixNano']) - origin) / 1e6
+        duration = (int(span['endTimeUnixNano']) - int(span['startTimeUnixNano'])) / 1e6
+        attributes = ' '.join(f"{a['key']}={next(iter(a['value'].values()))}" for a in span['attributes'])
+        error = f" ERROR {span['status'].get('message', '')}" if span['status'].get('code') == STATUS_ERROR else ''
+        lines.append(f"{'*' if critical else ' '} {start:9.1f}ms {duration:9.1f}ms  "
+                     f"{'  ' * depth}{span['name']} {attributes}{error}".rstrip())
+        kids = children.get(span['spanId'], [])
+        for kid in kids:
+            walk(kid, depth + 1, critical and kid['spanId'] in on_path)
+
+    for root in children.get(None, []):
+        walk(root, 0, True)
+    return '\n'.join(lines)
+
+
+class TraceContextFilter(logging.Filter):
+    """Adds trace_id and span_id to log records ('-' outside a trace)"""
+
+    def filter(self, record):
+        span = _current_span.get()
+        record.trace_id = span.trace_id if span else '-'
+        record.span_id = span.span_id if span else '-'
+        return True
+
+
+# Process-wide tracer, configured from the environment on first import
+tracer = Tracer()
@@ -0,0 +1,89 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from database_manager import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateDeduplicator:
+    """Drops webhook updates whose update_id was already accepted.
+
+    Telegram re-delivers an update when the webhook answers slowly, so the
+    same update_id can arrive several times. Accepted ids are recorded in the
+    processed_updates table (shared by every worker process and kept across
+    restarts) for window_seconds; a bounded in-memory copy of recent ids
+    answers repeats without touching the database.
+    """
+
+    def __init__(self, db: DatabaseManager, window_seconds: float = None, max_recent: int = 10000,
+                 prune_every: int = 1000):
+        self.db = db
+        self.window_seconds = float(window_seconds if window_seconds is not None
+                                    else os.getenv('UPDATE_DEDUP_WINDOW', '3600'))
+        self.max_recent = max_recent
+        self.prune_every = prune_every
+        self._recent = OrderedDict()
+        self._lock = threading.Lock()
+        self._since_prune = 0
+        self.stats = {'accepted': 0, 'duplicates': 0, 'duplicates_from_db': 0}
+
+    def first_delivery(self, update_id: int) -> bool:
+        """Record update_id; False if it was already seen within the window"""
+        now = time.time()
+        with self._lock:
+            seen_at = self._recent.get(update_id)
+            if seen_at is not None and now - seen_at < self.window_seconds:
+                self.stats['duplicates'] += 1
+                return False
+
+        conn = self.db.get_connection()
+        cursor = conn.cursor()
+        # A row older than the window no longer counts; replace it
+        cursor.execute('DELETE FROM processed_updates WHERE update_id = ? AND received_at < ?',
+                       (update_id, now - self.window_seconds))
+        cursor.execute('INSERT OR IGNORE INTO processed_updates (update_id, received_at) VALUES (?, ?)',
+                       (update_id, now))
+        accepted = cursor.rowcount == 1
+        conn.commit()
+        conn.close()
+
+        with self._lock:
+            self._recent[update_id] = now
+            self._recent.move_to_end(update_id)
+            while len(self._recent) > self.max_recent:
+                self._recent.popitem(last=False)
+            if not accepted:
+                # Accepted earlier by another process or before a restart
+                self.stats['duplicates'] += 1
+                self.stats['duplicates_from_db'] += 1
+                return False
+            self.stats['accepted'] += 1
+            self._since_prune += 1
+            prune = self._since_prune >= self.prune_every
+            if prune:
+                self._since_prune = 0
+        if prune:
+            self.prune(now)
+        return True
+
+    def prune(self, now: float = None) -> int:
+        """Delete recorded ids older than the window"""
+        conn = self.db.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM processed_updates WHERE received_at < ?',
+                       ((now or time.time()) - self.window_seconds,))
+        deleted = cursor.rowcount
+        conn.commit()
+        conn.close()
+        return deleted
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+        seen = stats['accepted'] + stats['duplicates']
+        stats['duplicate_ratio'] = round(stats['duplicates'] / seen, 3) if seen else 0.0
+        return stats
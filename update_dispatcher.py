@@ -0,0 +1,114 @@
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+def update_chat_key(update):
+    """Key used to order an update: its chat id, else the sender's id."""
+    for attr in ('message', 'edited_message', 'channel_post', 'edited_channel_post'):
+        message = getattr(update, attr, None)
+        if message:
+            return message.chat.id
+    callback = getattr(update, 'callback_query', None)
+    if callback:
+        return callback.message.chat.id if callback.message else callback.from_user.id
+    for attr in ('inline_query', 'chosen_inline_result', 'shipping_query', 'pre_checkout_query',
+                 'poll_answer', 'my_chat_member', 'chat_member', 'chat_join_request'):
+        event = getattr(update, attr, None)
+        user = getattr(event, 'from_user', None) or getattr(event, 'user', None)
+        if user:
+            return user.id
+    return ('update', update.update_id)
+
+
+def update_label(update):
+    """Short description of an update for logs: '/start', 'callback:profile', 'message'..."""
+    message = getattr(update, 'message', None)
+    if message:
+        text = message.text or ''
+        return text.split()[0].split('@')[0] if text.startswith('/') else 'message'
+    callback = getattr(update, 'callback_query', None)
+    if callback:
+        return f"callback:{callback.data}"
+    for attr in ('edited_message', 'channel_post', 'edited_channel_post', 'inline_query',
+                 'chosen_inline_result', 'my_chat_member', 'chat_member'):
+        if getattr(update, attr, None):
+            return attr
+    return 'update'
+
+
+class ChatOrderedDispatcher:
+    """Runs tasks on a worker pool while keeping each chat's tasks in order.
+
+    Tasks for one chat run one at a time in submission order; different chats
+    run concurrently. After each task a chat goes to the back of the pool's
+    queue, so a busy chat cannot hold a worker while others wait.
+    """
+
+    def __init__(self, num_workers: int = 4):
+        self.num_workers = num_workers
+        self._executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix='update-worker')
+        self._queues = {}
+        self._pending = 0
+        self._closed = False
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def submit(self, chat_key, fn, *args):
+        """Queue fn(*args) behind any earlier tasks for the same chat"""
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Dispatcher is shut down")
+            self._pending += 1
+            queue = self._queues.get(chat_key)
+            if queue is not None:
+                queue.append((fn, args))
+                return
+            self._queues[chat_key] = deque([(fn, args)])
+        self._executor.submit(self._run_next, chat_key)
+
+    def _run_next(self, chat_key):
+        with self._lock:
+            fn, args = self._queues[chat_key][0]
+        try:
+            fn(*args)
+        except Exception as e:
+            logger.error(f"Error processing update for chat {chat_key}: {e}")
+        finally:
+            with self._lock:
+                queue = self._queues[chat_key]
+                queue.popleft()
+                if queue:
+                    reschedule = True
+                else:
+                    del self._queues[chat_key]
+                    reschedule = False
+                self._pending -= 1
+                self._idle.notify_all()
+            if reschedule:
+                self._executor.submit(self._run_next, chat_key)
+
+    def wait_for_capacity(self, max_pending: int, timeout: float = None) -> bool:
+        """Block while more than max_pending tasks are queued"""
+        with self._lock:
+            return self._idle.wait_for(lambda: self._pending < max_pending, timeout)
+
+    def shutdown(self, timeout: float = None) -> bool:
+        """Stop accepting tasks and wait for queued ones to finish.
+
+        Returns False if work was still pending when the timeout expired.
+        """
+        with self._lock:
+            self._closed = True
+            drained = self._idle.wait_for(lambda: self._pending == 0, timeout)
+        self._executor.shutdown(wait=drained)
+        if not drained:
+            logger.warning(f"Dispatcher shut down with {self._pending} tasks still pending")
+        return drained
@@ -0,0 +1,132 @@
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class UserProfileCache:
+    """Bounded LRU of user profiles, invalidated through the user_changes log.
+
+    Triggers on the users table append the user_id to user_changes on every
+    insert, update and delete, whichever process or code path made it. Before
+    serving from the cache, each shard's watcher connection reads PRAGMA
+    data_version, which changes whenever another connection has committed to
+    that file. Only then are the changelog rows past the last seen seq read,
+    and the profiles they name are dropped. An unchanged database costs one
+    pragma per lookup.
+
+    A profile loaded while an invalidation was being applied is not stored, so
+    a slow reader cannot put back a row that was already stale.
+    """
+
+    def __init__(self, backend, max_size: int = 5000):
+        self.backend = backend
+        self.max_size = max_size
+        self.enabled = max_size > 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._watchers = {}
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0, 'evictions': 0}
+
+    def _watcher(self, shard):
+        watcher = self._watchers.get(shard)
+        if watcher is None:
+            conn = self.backend.connect(shard)
+            last_seq = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM user_changes').fetchone()[0]
+            watcher = self._watchers[shard] = [conn, None, last_seq]
+        return watcher
+
+    def _sync(self, shard):
+        """Drop profiles changed on `shard` since the last check (caller holds the lock)"""
+        watcher = self._watcher(shard)
+        conn, data_version, last_seq = watcher
+        current = conn.execute('PRAGMA data_version').fetchone()[0]
+        if current == data_version:
+            return
+        watcher[1] = current
+        try:
+            rows = conn.execute('SELECT seq, user_id FROM user_changes WHERE seq > ? ORDER BY seq',
+                                (last_seq,)).fetchall()
+        except sqlite3.Error as e:
+            # Without the log we cannot tell what changed, so forget everything
+            logger.warning(f"User change log unreadable on shard {shard}, clearing profile cache: {e}")
+            self._drop_all()
+            return
+        if rows:
+            newest = rows[-1][0]
+            # Sequence numbers are contiguous, so a gap means cleanup removed
+            # entries this process never saw
+            missed = rows[0][0] != last_seq + 1
+        else:
+            newest = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM sqlite_sequence "
+                                  "WHERE name = 'user_changes'").fetchone()[0]
+            missed = newest > last_seq
+        watcher[2] = max(last_seq, newest)
+        if missed:
+            self._drop_all()
+            return
+        for _, user_id in rows:
+            self._drop(user_id)
+
+    def _drop(self, user_id):
+        self._generation += 1
+        if self._entries.pop(user_id, None) is not None:
+            self.stats['invalidations'] += 1
+
+    def _drop_all(self):
+        self._generation += 1
+        self.stats['invalidations'] += len(self._entries)
+        self._entries.clear()
+
+    def lookup(self, user_ids):
+        """Cached profiles for user_ids, and a generation token for storing the misses.
+
+        Returns (found, missing, generation); found maps user_id to a copy of
+        the profile.
+        """
+        found, missing = {}, []
+        with self._lock:
+            for shard in {self.backend.shard_for(user_id) for user_id in user_ids}:
+                self._sync(shard)
+            for user_id in user_ids:
+                profile = self._entries.get(user_id)
+                if profile is None:
+                    missing.append(user_id)
+                else:
+                    self._entries.move_to_end(user_id)
+                    found[user_id] = dict(profile)
+            self.stats['hits'] += len(found)
+            self.stats['misses'] += len(missing)
+            return found, missing, self._generation
+
+    def store(self, profiles, generation):
+        """Cache profiles loaded after lookup() returned `generation`"""
+        with self._lock:
+            if generation != self._generation:
+                return
+            for user_id, profile in profiles.items():
+                self._entries[user_id] = dict(profile)
+                self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def invalidate(self, user_id):
+        """Forget one profile now, without waiting for the change log"""
+        with self._lock:
+            self._drop(user_id)
+
+    def clear(self):
+        with self._lock:
+            self._drop_all()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats['size'] = len(self._entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 3) if lookups else 0.0
+        return stats